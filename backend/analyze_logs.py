@@ -0,0 +1,265 @@
+"""Aggregate statistics over session history
+
+Streams sessions out of the segmented session log one at a time (nothing
+is loaded whole) and keeps only fixed-size aggregates, so memory stays
+bounded over months of history:
+
+    python analyze_logs.py --since 2026-01-01 --until 2026-02-01
+    python analyze_logs.py --failed --query scopa --json
+
+Reports request rate, success rate, per-stage latency percentiles (from
+the timestamps of the pipeline's progress messages), top queries and the
+search terms that most often matched nothing.
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter
+from datetime import datetime
+
+from log_store import iter_json_array
+from session_logger import iter_sessions
+
+# Pipeline stages: (name, messages that start it, messages that end it); sessions
+# from before the storage backends logged the Drive-only auth messages
+STAGES = [
+    ('auth', ('🔐 Connecting to storage', '🔐 Authenticating'), ('✓ Connected to ', '✓ Authentication successful')),
+    ('folder', ('📁 Finding',), ('✓ Folder found',)),
+    ('catalog', ('📥 Finding latest Excel',), ('✓ Loaded ', '✓ Using shared catalog snapshot')),
+    ('search', ('✓ Loaded ', '✓ Using shared catalog snapshot'), ('📝 Generating',)),
+    ('generate', ('📝 Generating',), ('✓ Tasting sheet generated!', '❌ Error')),
+]
+
+NO_MATCH_RE = re.compile(r"^✗ No matches for '(.*)'$")
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram: fixed memory, percentiles within ~1%"""
+
+    def __init__(self, precision=0.01, floor=0.001):
+        self.growth = math.log1p(precision)
+        self.floor = floor
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        bucket = int(math.log(max(seconds, self.floor) / self.floor) / self.growth)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, p):
+        """Approximate p-th percentile (upper bucket edge), None when empty"""
+        if not self.count:
+            return None
+        rank = math.ceil(p / 100 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return self.floor * math.exp((bucket + 1) * self.growth)
+
+
+class TopK:
+    """Space-Saving heavy hitters: counts for at most `capacity` distinct items"""
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, item):
+        if item in self.counts or len(self.counts) < self.capacity:
+            self.counts[item] = self.counts.get(item, 0) + 1
+            return
+        # Replace the least frequent item; its count bounds the newcomer's error
+        smallest = min(self.counts, key=self.counts.get)
+        self.counts[item] = self.counts.pop(smallest) + 1
+
+    def top(self, n):
+        return sorted(self.counts.items(), key=lambda kv: (-kv[1], kv[0]))[:n]
+
+
+def _parse_time(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def session_status(session):
+    """'cancelled', 'success', 'failed' or 'running' (not finished)"""
+    if session.get('cancelled'):
+        return 'cancelled'
+    if session.get('success') is None:
+        return 'running'
+    return 'success' if session['success'] else 'failed'
+
+
+def stage_durations(session):
+    """{stage: seconds} for every stage whose start and end messages were logged"""
+    durations = {}
+    for name, starts, ends in STAGES:
+        started = None
+        for entry in session.get('messages', []):
+            text = entry.get('message', '').strip()
+            if started is None and text.startswith(starts):
+                started = _parse_time(entry.get('timestamp'))
+            elif started is not None and text.startswith(ends):
+                ended = _parse_time(entry.get('timestamp'))
+                if ended is not None:
+                    durations[name] = (ended - started).total_seconds()
+                break
+
+    started = _parse_time(session.get('timestamp'))
+    completed = _parse_time(session.get('completed_at'))
+    if started is not None and completed is not None:
+        durations['total'] = (completed - started).total_seconds()
+    return durations
+
+
+def matches_filters(session, args):
+    """Whether a session passes the command-line filters"""
+    started = _parse_time(session.get('timestamp'))
+    if args.since and (started is None or started < args.since):
+        return False
+    if args.until and (started is None or started >= args.until):
+        return False
+    if args.status and session_status(session) not in args.status:
+        return False
+    if args.query and args.query.lower() not in (session.get('query') or '').lower():
+        return False
+    return True
+
+
+def analyze(sessions, args):
+    """Fold sessions into aggregates"""
+    statuses = Counter()
+    per_day = Counter()
+    stages = {name: LatencyHistogram() for name, _, _ in STAGES}
+    stages['total'] = LatencyHistogram()
+    queries = TopK(args.capacity)
+    zero_terms = TopK(args.capacity)
+    first = last = None
+
+    for session in sessions:
+        if not matches_filters(session, args):
+            continue
+
+        statuses[session_status(session)] += 1
+        started = _parse_time(session.get('timestamp'))
+        if started is not None:
+            per_day[started.date().isoformat()] += 1
+            first = started if first is None or started < first else first
+            last = started if last is None or started > last else last
+
+        query = ' '.join((session.get('query') or '').lower().split())
+        if query:
+            queries.add(query)
+
+        for entry in session.get('messages', []):
+            match = NO_MATCH_RE.match(entry.get('message', '').strip())
+            if match:
+                zero_terms.add(match.group(1).lower())
+
+        for name, seconds in stage_durations(session).items():
+            stages[name].add(seconds)
+
+    total = sum(statuses.values())
+    finished = statuses['success'] + statuses['failed']
+    span_hours = (last - first).total_seconds() / 3600 if total > 1 else 0
+
+    return {
+        'sessions': total,
+        'first': first.isoformat() if first else None,
+        'last': last.isoformat() if last else None,
+        'per_hour': round(total / span_hours, 3) if span_hours else None,
+        'per_day': dict(sorted(per_day.items())),
+        'statuses': dict(statuses),
+        'success_rate': round(statuses['success'] / finished, 4) if finished else None,
+        'latency': {
+            name: {
+                'count': histogram.count,
+                'p50': histogram.percentile(50),
+                'p95': histogram.percentile(95),
+                'p99': histogram.percentile(99),
+                'mean': histogram.total / histogram.count if histogram.count else None
+            }
+            for name, histogram in stages.items()
+        },
+        'top_queries': queries.top(args.top),
+        'top_zero_result_terms': zero_terms.top(args.top)
+    }
+
+
+def _seconds(value):
+    return f"{value:8.2f}s" if value is not None else '       -'
+
+
+def print_report(report):
+    """Human-readable report"""
+    print(f"\n{'='*80}")
+    print(f"SESSION ANALYTICS - {report['sessions']} sessions")
+    print(f"{'='*80}\n")
+
+    if not report['sessions']:
+        print("No sessions match.")
+        return
+
+    print(f"Range: {report['first']} → {report['last']}")
+    if report['per_hour'] is not None:
+        print(f"Rate: {report['per_hour']:.2f} sessions/hour")
+    statuses = ', '.join(f"{status} {count}" for status, count in sorted(report['statuses'].items()))
+    print(f"Outcomes: {statuses}")
+    if report['success_rate'] is not None:
+        print(f"Success rate: {report['success_rate'] * 100:.1f}% of finished sessions")
+
+    print(f"\nLatency by stage:")
+    print(f"  {'stage':<10} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in report['latency'].items():
+        print(f"  {name:<10} {stats['count']:>7} {_seconds(stats['p50'])} "
+              f"{_seconds(stats['p95'])} {_seconds(stats['p99'])}")
+
+    print(f"\nTop queries:")
+    for query, count in report['top_queries']:
+        print(f"  {count:>6}  {query}")
+
+    print(f"\nTop zero-result terms:")
+    for term, count in report['top_zero_result_terms']:
+        print(f"  {count:>6}  {term}")
+    print()
+
+
+def _date(value):
+    return datetime.fromisoformat(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregate statistics over the session log')
+    parser.add_argument('--file', default=None,
+                        help='read a legacy {"sessions": [...]} JSON file instead of the session log')
+    parser.add_argument('--since', type=_date, help='only sessions started at or after (ISO date/time)')
+    parser.add_argument('--until', type=_date, help='only sessions started before (ISO date/time)')
+    parser.add_argument('--success', dest='status', action='append_const', const='success')
+    parser.add_argument('--failed', dest='status', action='append_const', const='failed')
+    parser.add_argument('--cancelled', dest='status', action='append_const', const='cancelled')
+    parser.add_argument('--query', help='only sessions whose query contains this text')
+    parser.add_argument('--top', type=int, default=10, help='entries in the top-N lists')
+    parser.add_argument('--capacity', type=int, default=1000,
+                        help='distinct queries/terms tracked (bounds memory; counts are approximate beyond it)')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    if args.file and not os.path.exists(args.file):
+        print("No logs found yet.")
+        raise SystemExit(0)
+
+    sessions = iter_json_array(args.file, 'sessions') if args.file else iter_sessions()
+    report = analyze(sessions, args)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
@@ -1,32 +1,189 @@
 """Flask API for wine tasting sheet generation"""
 
-from flask import Flask, request, jsonify, Response, stream_with_context
+from flask import Flask, request, jsonify, Response, stream_with_context, send_from_directory, send_file
 from flask_cors import CORS
-import subprocess
+import io
+import os
 import sys
 import json
+import time
+import uuid
+import zipfile
 from feedback_logger import add_feedback
+from jobs import submit_job, get_job, QueueFull, offload, queue_stats
+from log_store import start_maintenance, maintain_all
+from catalog_store import get_snapshot, tenant_stats
+from drive import call_stats, token_status
+import render_cache
+from shared_cache import FileCache, CACHE_URL as SHARED_CACHE_URL
+from folders import load_folders, get_folder
+from search import parse_query, describe_query, run_query, matched_rows, wine_summary
+from typeahead import complete
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend requests
 
-def stream_output(process):
-    """Stream process output line by line"""
-    for line in iter(process.stdout.readline, ''):
-        if line:
-            yield f"data: {json.dumps({'message': line.strip()})}\n\n"
+# Rotate, compress and expire the session/feedback logs in the background
+start_maintenance(lambda: offload(maintain_all))
 
-    process.wait()
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# Working directory of the generation scripts (token.json, caches and output files live there)
+GENERATE_CWD = os.getenv('GENERATE_CWD', BACKEND_DIR)
+# Per-job output directories for direct downloads (removed with the job)
+DOWNLOAD_DIR = os.getenv('GENERATE_DOWNLOAD_DIR', os.path.join(GENERATE_CWD, 'downloads'))
 
-    if process.returncode == 0:
-        yield f"data: {json.dumps({'done': True, 'success': True})}\n\n"
-    else:
-        error = process.stderr.read()
-        yield f"data: {json.dumps({'done': True, 'success': False, 'error': error})}\n\n"
+# /api/ready reports not ready past these
+READY_MAX_DRIVE_ERROR_RATE = float(os.getenv('READY_MAX_DRIVE_ERROR_RATE', '0.5'))
+READY_MAX_FAILED_JOBS = int(os.getenv('READY_MAX_FAILED_JOBS', '3'))  # consecutive recent failures
+
+TYPEAHEAD_MAX_K = 50
+
+def int_arg(name, default, low, high=None):
+    """An integer query parameter clamped to [low, high]; ValueError when it isn't an integer"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an integer") from None
+    number = max(number, low)
+    return number if high is None else min(number, high)
+
+def keys_arg(keys):
+    """Confirmed row keys from a request body: None, or a non-empty list of strings (ValueError otherwise)"""
+    if keys is None:
+        return None
+    if not isinstance(keys, list) or not keys or not all(isinstance(key, str) and key for key in keys):
+        raise ValueError("'keys' must be a non-empty list of strings")
+    return keys
+
+def stream_events(job, after=0):
+    """Format a job's events as SSE (comment lines keep idle connections open)"""
+    yield f"data: {json.dumps({'job': job.id})}\n\n"
+    for event in job.stream(after):
+        if event is None:
+            yield ": keepalive\n\n"
+            continue
+        if 'download' in event:
+            event = dict(event,
+                         url=f"/api/jobs/{job.id}/files/{event['download']}",
+                         zip_url=f"/api/jobs/{job.id}/download")
+        yield f"data: {json.dumps(event)}\n\n"
+
+def sse_response(events):
+    """Streaming response headers shared by every progress stream"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
 
 @app.route('/api/generate-sheet', methods=['POST'])
 def generate_sheet():
-    """Generate tasting sheet from natural language query (streaming)"""
+    """Generate tasting sheet from natural language query (streaming)
+
+    delivery 'download' writes the documents for direct download and
+    announces them before uploading; upload false skips Drive entirely.
+    """
+    try:
+        data = request.get_json()
+        query = data.get('query', '')
+        delivery = data.get('delivery', 'drive')
+        upload = data.get('upload', True)
+
+        try:
+            keys = keys_arg(data.get('keys'))
+            folder = get_folder(data.get('folder'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not query and not keys:
+            return jsonify({'error': 'Query is required'}), 400
+
+        if delivery not in ('drive', 'download'):
+            return jsonify({'error': "delivery must be 'drive' or 'download'"}), 400
+        if delivery == 'drive' and not upload:
+            return jsonify({'error': "upload can only be disabled with delivery 'download'"}), 400
+
+        # Confirmed keys from /api/search skip re-running the search
+        command = [sys.executable, os.path.join(BACKEND_DIR, 'search_and_generate.py'), '--folder', folder['key']]
+        if keys:
+            command += ['--keys-json', json.dumps(keys)]
+        output_dir = None
+        if delivery == 'download':
+            output_dir = os.path.join(DOWNLOAD_DIR, uuid.uuid4().hex)
+            command += ['--download', output_dir]
+            if not upload:
+                command += ['--skip-upload']
+        command += ['--', query]
+
+        # Generation runs in its own process once admitted; this response only waits on its events
+        client = request.headers.get('X-Real-IP') or request.remote_addr
+        try:
+            job = submit_job(command, cwd=GENERATE_CWD, client=client, output_dir=output_dir)
+        except QueueFull as e:
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+        return sse_response(stream_events(job))
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Reattach to a generation's progress stream (replays from ?after=N)"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+
+    try:
+        after = int_arg('after', 0, 0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return sse_response(stream_events(job, after))
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Stop a generation: no further downloads, rendering or uploads"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f"Unknown job '{job_id}'"}), 404
+
+    return jsonify({'job': job.id, 'cancelled': job.cancel()})
+
+@app.route('/api/jobs/<job_id>/files/<name>', methods=['GET'])
+def job_file(job_id, name):
+    """One document of a direct-download generation"""
+    job = get_job(job_id)
+    if job is None or name not in job.files:
+        return jsonify({'error': f"No document '{name}' for job '{job_id}'"}), 404
+
+    return send_from_directory(job.output_dir, name, as_attachment=True)
+
+@app.route('/api/jobs/<job_id>/download', methods=['GET'])
+def job_download(job_id):
+    """Every document announced so far for a direct-download generation, as one zip"""
+    job = get_job(job_id)
+    if job is None or not job.files:
+        return jsonify({'error': f"No documents ready for job '{job_id}'"}), 404
+
+    # docx files are already compressed: store them as they are
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+        for name in list(job.files):
+            zf.write(os.path.join(job.output_dir, name), name)
+    archive.seek(0)
+    return send_file(archive, mimetype='application/zip', as_attachment=True,
+                     download_name=f"{os.path.splitext(job.files[0])[0]}.zip")
+
+@app.route('/api/search', methods=['POST'])
+def search():
+    """Preview which wines a query matches, using the cached catalog"""
     try:
         data = request.get_json()
         query = data.get('query', '')
@@ -34,33 +191,124 @@ def generate_sheet():
         if not query:
             return jsonify({'error': 'Query is required'}), 400
 
-        # Run the search with real-time output streaming
-        process = subprocess.Popen(
-            [sys.executable, 'search_and_generate.py', query],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            cwd='/home/rivlanm/projects/google_auto/backend'
-        )
-
-        return Response(
-            stream_with_context(stream_output(process)),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+        try:
+            folder = get_folder(data.get('folder'))
+            parsed = parse_query(query)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        start = time.perf_counter()
+        snapshot = get_snapshot(folder['key'])
+        df = snapshot['df']
+
+        results = run_query(snapshot['index'], parsed)
+        rows = list(dict.fromkeys(matched_rows(results)))
+
+        return jsonify({
+            'query': query,
+            'folder': folder['key'],
+            'terms': describe_query(parsed),
+            'unmatched': [result['term'] for result in results if len(result['rows']) == 0],
+            'revision': snapshot['revision'],
+            'wines': wine_summary(df, rows),
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 2)
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/typeahead', methods=['GET'])
+def typeahead():
+    """Suggest producer and cuvee names for a partially typed query"""
+    prefix = request.args.get('q', '')
+    try:
+        k = int_arg('k', 10, 1, TYPEAHEAD_MAX_K)
+        folder = get_folder(request.args.get('folder'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        start = time.perf_counter()
+        snapshot = get_snapshot(folder['key'])
+        completions = complete(snapshot['typeahead'], prefix, k)
+
+        return jsonify({
+            'query': prefix,
+            'completions': completions,
+            'revision': snapshot['revision'],
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+        })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/folders', methods=['GET'])
+def folders():
+    """List configured catalog folders"""
+    return jsonify({
+        'folders': [
+            {'key': key, 'folder': config['folder']}
+            for key, config in load_folders().items()
+        ],
+        'default': get_folder()['key']
+    })
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({'status': 'ok'})
 
+def readiness_problems(drive, token, queue, catalogs):
+    """Reasons the API can't serve generations right now (empty when ready)"""
+    problems = []
+    if token and token['expires_in'] is not None and token['expires_in'] <= 0 and not token['refreshable']:
+        problems.append('Drive token expired and has no refresh token')
+    if drive['calls'] >= 5 and drive['error_rate'] >= READY_MAX_DRIVE_ERROR_RATE:
+        problems.append(f"Drive error rate {drive['error_rate']:.0%} over the last {drive['calls']} calls")
+    if READY_MAX_FAILED_JOBS and queue['recent'] >= READY_MAX_FAILED_JOBS and queue['recent_failures'] == queue['recent']:
+        problems.append(f"The last {queue['recent']} generations failed")
+    for key, catalog in catalogs.items():
+        if catalog['error'] and not catalog['loaded']:
+            problems.append(f"Catalog {key} can't be loaded: {catalog['error']['message']}")
+    return problems
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: catalog revisions and warmth, queue, Drive health and token expiry
+
+    Answers from in-memory state only (never calls Drive), so it can be
+    polled often. 503 with the reasons when something is broken; cold
+    caches are reported but don't fail readiness. The Drive stats include
+    the calls of finished generation pipelines (their processes report
+    them at exit, see jobs), not only the API's own.
+    """
+    start = time.perf_counter()
+    drive = call_stats.summary()
+    token = token_status()
+    queue = queue_stats()
+    catalogs = tenant_stats(changes=False)
+    problems = readiness_problems(drive, token, queue, catalogs)
+
+    # A local (or shared directory) render cache is warm once it exists; a Redis tier isn't probed
+    store = render_cache.store()
+    warm = None
+    if isinstance(store, FileCache):
+        warm = os.path.isdir(os.path.join(GENERATE_CWD, store.directory))
+    return jsonify({
+        'status': 'degraded' if problems else 'ok',
+        'problems': problems,
+        'catalogs': catalogs,
+        'render_cache': {
+            'enabled': store is not None,
+            'shared': bool(SHARED_CACHE_URL),
+            'warm': warm
+        },
+        'jobs': queue,
+        'drive': drive,
+        'token': token,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 3)
+    }), 503 if problems else 200
+
 @app.route('/api/feedback', methods=['POST'])
 def submit_feedback():
     """Submit user feedback"""
@@ -84,7 +332,6 @@ def submit_feedback():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    # Production: bind to localhost only, disable debug
-    import os
+    # Development server; production runs under gunicorn (see gunicorn.conf.py)
     debug_mode = os.getenv('FLASK_DEBUG', 'False') == 'True'
     app.run(host='127.0.0.1', port=5000, debug=debug_mode)
@@ -0,0 +1,329 @@
+"""Exercise the shared cache tier against a local Redis stand-in
+
+Usage: python bench_cache.py [--backend redis|file] [--url redis://...] [--processes 8]
+
+Starts FakeRedis, a small in-memory server that speaks the Redis protocol
+(RESP) for the commands shared_cache sends: GET, SET with NX/PX/GET, DEL
+and the lock-release EVAL, plus AUTH, SELECT and PING. Then it checks the
+tier's behaviour end to end:
+
+    get/set        round trip of a large value, and misses for unknown keys
+    group drop     storing a key drops the previous key of its group
+    single-flight  --processes processes miss the same key at once and
+                   exactly one of them fills it
+    takeover       a filler that dies holding the lock is replaced by a
+                   waiter once the lock expires (SHARED_CACHE_LOCK_SECONDS)
+    snapshot       a catalog snapshot packed, stored, read back and unpacked
+    outage         with the server gone, reads miss and writes are skipped
+
+and reports fill and get/put timings. --backend file runs the same checks
+against a FileCache in a temporary directory; --url runs them against a
+real server instead of the stand-in.
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import shutil
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# Short locks, so the takeover check doesn't wait two minutes (set before shared_cache reads them)
+os.environ.setdefault('SHARED_CACHE_LOCK_SECONDS', '2')
+os.environ.setdefault('SHARED_CACHE_TIMEOUT', '1')
+
+from shared_cache import FileCache, RedisCache, RELEASE_SCRIPT, LOCK_SECONDS
+
+
+class FakeRedis:
+    """In-memory keys with millisecond expiry, behind a RESP server"""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.data = {}  # key -> (value, expires at or None)
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def _live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def execute(self, args, session):
+        """Run one command: a reply value, or an Exception to send as an error"""
+        name = args[0].decode().upper()
+        self.commands += 1
+        if name == 'AUTH':
+            session['authenticated'] = args[-1].decode() == self.password
+            return 'OK' if session['authenticated'] else Exception('WRONGPASS invalid password')
+        if self.password and not session.get('authenticated'):
+            return Exception('NOAUTH Authentication required.')
+        if name == 'PING':
+            return 'PONG'
+        if name == 'SELECT':
+            return 'OK'
+
+        with self.lock:
+            if name == 'GET':
+                entry = self._live(args[1])
+                return None if entry is None else entry[0]
+            if name == 'SET':
+                return self._set(args[1], args[2], [a.decode().upper() for a in args[3:]])
+            if name == 'DEL':
+                removed = [key for key in args[1:] if self._live(key) is not None]
+                for key in removed:
+                    del self.data[key]
+                return len(removed)
+            if name == 'EVAL':
+                if args[1].decode() != RELEASE_SCRIPT or args[2] != b'1':
+                    return Exception('ERR only the shared cache lock release script is supported')
+                entry = self._live(args[3])
+                if entry is not None and entry[0] == args[4]:
+                    del self.data[args[3]]
+                    return 1
+                return 0
+        return Exception(f"ERR unknown command '{name}'")
+
+    def _set(self, key, value, options):
+        expires = None
+        if 'PX' in options:
+            expires = time.time() + int(options[options.index('PX') + 1]) / 1000
+        previous = self._live(key)
+        if 'NX' in options and previous is not None:
+            return None
+        self.data[key] = (value, expires)
+        if 'GET' in options:
+            return None if previous is None else previous[0]
+        return 'OK'
+
+
+def _encode(reply):
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode()
+    if reply is None:
+        return b'$-1\r\n'
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+
+class RedisHandler(socketserver.StreamRequestHandler):
+    """One client connection: RESP arrays of bulk strings in, one reply each out"""
+
+    def handle(self):
+        session = {}
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if not line.startswith(b'*'):
+                self.wfile.write(_encode(Exception('ERR inline commands are not supported')))
+                return
+            args = []
+            for _ in range(int(line[1:])):
+                length = int(self.rfile.readline()[1:])
+                args.append(self.rfile.read(length + 2)[:-2])
+            self.wfile.write(_encode(self.server.redis.execute(args, session)))
+
+
+def start_redis(password=None):
+    """Serve a FakeRedis on a free local port; returns (server, url)"""
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), RedisHandler)
+    server.daemon_threads = True
+    server.redis = FakeRedis(password)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    credentials = f":{password}@" if password else ''
+    return server, f"redis://{credentials}127.0.0.1:{server.server_address[1]}/0"
+
+
+def open_cache(spec, namespace):
+    kind, location = spec
+    return RedisCache(location, namespace) if kind == 'redis' else FileCache(os.path.join(location, namespace))
+
+
+def _fill_worker(spec, namespace, key, fill_seconds, start_at, fills, results):
+    """One process missing the shared key at start_at; counts the fills it did"""
+    cache = open_cache(spec, namespace)
+
+    def fill():
+        with fills.get_lock():
+            fills.value += 1
+        time.sleep(fill_seconds)
+        return b'filled by %d' % os.getpid()
+
+    time.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    value = cache.get_or_fill(key, fill)
+    results.put((time.perf_counter() - start, value))
+
+
+def _hold_lock_and_die(spec, namespace, key, held):
+    """Take the fill lock for key and exit without releasing it"""
+    cache = open_cache(spec, namespace)
+    token = cache.acquire(key)
+    held.put(bool(token))
+    held.close()
+    held.join_thread()
+    os._exit(0)  # a flock goes with the process; a Redis lock stays until it expires
+
+
+class Checks:
+    """Prints one line per check and counts the failures"""
+
+    def __init__(self):
+        self.failures = 0
+
+    def check(self, label, ok, detail=''):
+        print(f"{'✓' if ok else '✗'} {label}{f' ({detail})' if detail else ''}")
+        if not ok:
+            self.failures += 1
+
+
+def check_get_set(checks, cache, size):
+    value = os.urandom(size)
+    key = uuid.uuid4().hex
+    checks.check('miss on an unknown key', cache.get(key) is None)
+
+    start = time.perf_counter()
+    cache.put(key, value)
+    put_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    read = cache.get(key)
+    get_ms = (time.perf_counter() - start) * 1000
+    checks.check(f"get/set round trip of {size // 1024} KB", read == value,
+                 f"put {put_ms:.1f} ms, get {get_ms:.1f} ms")
+
+
+def check_group_drop(checks, cache):
+    group = f"file{uuid.uuid4().hex[:8]}@"
+    old, new = f"{group}rev1", f"{group}rev2"
+    cache.put(old, b'revision 1', group=group)
+    cache.put(new, b'revision 2', group=group)
+    checks.check('group drop: storing rev2 drops rev1',
+                 cache.get(old) is None and cache.get(new) == b'revision 2')
+
+
+def check_single_flight(checks, spec, namespace, processes, fill_seconds):
+    key = uuid.uuid4().hex
+    context = multiprocessing.get_context('fork')
+    fills = context.Value('i', 0)
+    results = context.Queue()
+    start_at = time.time() + 0.5
+    workers = [
+        context.Process(target=_fill_worker, args=(spec, namespace, key, fill_seconds, start_at, fills, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=LOCK_SECONDS * 4 + 30) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    values = {value for _, value in outcomes}
+    waits = sorted(seconds for seconds, _ in outcomes)
+    checks.check(f"single-flight: {processes} processes, {fills.value} fill(s)",
+                 fills.value == 1 and len(values) == 1,
+                 f"fill {fill_seconds:.2f}s, slowest caller {waits[-1]:.2f}s")
+
+
+def check_takeover(checks, spec, namespace):
+    key = uuid.uuid4().hex
+    context = multiprocessing.get_context('fork')
+    held = context.Queue()
+    holder = context.Process(target=_hold_lock_and_die, args=(spec, namespace, key, held))
+    holder.start()
+    took_lock = held.get(timeout=10)
+    holder.join()
+
+    cache = open_cache(spec, namespace)
+    start = time.perf_counter()
+    value = cache.get_or_fill(key, lambda: b'taken over')
+    seconds = time.perf_counter() - start
+    checks.check('takeover: a dead filler\'s lock is taken over',
+                 took_lock and value == b'taken over' and cache.get(key) == b'taken over',
+                 f"after {seconds:.2f}s, lock expiry {LOCK_SECONDS:.0f}s")
+
+
+def check_snapshot(checks, cache, rows):
+    from bench_ingest import build_csv
+    from catalog import read_catalog
+    from search_index import build_search_index
+    from shared_catalog import pack_snapshot, unpack_snapshot
+    from typeahead import build_typeahead
+
+    df = read_catalog(io.BytesIO(build_csv(rows, 4)))
+    snapshot = {'df': df, 'index': build_search_index(df), 'typeahead': build_typeahead(df), 'changes': None}
+    start = time.perf_counter()
+    data = pack_snapshot(snapshot)
+    pack_ms = (time.perf_counter() - start) * 1000
+    key = uuid.uuid4().hex
+    cache.put(key, data)
+    start = time.perf_counter()
+    restored = unpack_snapshot(cache.get(key))
+    load_ms = (time.perf_counter() - start) * 1000
+    checks.check(f"snapshot of {rows} rows through the tier",
+                 restored['df'].equals(df) and restored['typeahead'] == snapshot['typeahead'],
+                 f"{len(data) / 1e6:.1f} MB, pack {pack_ms:.0f} ms, get + unpack {load_ms:.0f} ms")
+
+
+def check_outage(checks, server, cache):
+    server.shutdown()
+    server.server_close()
+    start = time.perf_counter()
+    missed = cache.get(uuid.uuid4().hex) is None
+    cache.put(uuid.uuid4().hex, b'dropped')
+    value = cache.get_or_fill(uuid.uuid4().hex, lambda: b'filled locally')
+    checks.check('outage: misses and skipped writes, no errors', missed and value == b'filled locally',
+                 f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exercise the shared cache tier against a Redis stand-in')
+    parser.add_argument('--backend', choices=['redis', 'file'], default='redis')
+    parser.add_argument('--url', default=None, help='use this Redis server instead of the stand-in')
+    parser.add_argument('--password', default=None, help="stand-in password (tests AUTH)")
+    parser.add_argument('--processes', type=int, default=8, help='processes racing for one key')
+    parser.add_argument('--fill-seconds', type=float, default=0.5, help='duration of the contended fill')
+    parser.add_argument('--value-kb', type=int, default=1024, help='size of the round-trip value')
+    parser.add_argument('--rows', type=int, default=5000, help='rows in the synthetic catalog snapshot')
+    args = parser.parse_args()
+
+    server = directory = None
+    if args.backend == 'file':
+        directory = tempfile.mkdtemp(prefix='bench_cache_')
+        spec = ('file', directory)
+        print(f"FileCache in {directory}")
+    elif args.url:
+        spec = ('redis', args.url)
+        print(f"Redis at {args.url}")
+    else:
+        server, url = start_redis(args.password)
+        spec = ('redis', url)
+        print(f"Redis stand-in at {url}")
+
+    namespace = f"bench-{uuid.uuid4().hex[:8]}"
+    cache = open_cache(spec, namespace)
+    checks = Checks()
+    try:
+        check_get_set(checks, cache, args.value_kb * 1024)
+        check_group_drop(checks, cache)
+        check_single_flight(checks, spec, namespace, args.processes, args.fill_seconds)
+        check_takeover(checks, spec, namespace)
+        check_snapshot(checks, cache, args.rows)
+        if server is not None:
+            check_outage(checks, server, cache)
+            print(f"Stand-in: {server.redis.commands} commands")
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    sys.exit(1 if checks.failures else 0)
@@ -0,0 +1,111 @@
+"""Benchmark catalog ingestion: pd.read_excel vs pruned/typed/streaming read_catalog
+
+Usage: python bench_ingest.py [ROWS] [EXTRA_COLUMNS]
+
+Builds a synthetic catalog workbook (the real columns plus EXTRA_COLUMNS
+unused ones) and the same data as a CSV export, then parses them once per
+reader, each in a fresh process so peak RSS is measured independently.
+"""
+
+import io
+import multiprocessing
+import random
+import sys
+import time
+
+import pandas as pd
+
+from catalog import HAS_CALAMINE, HAS_PYARROW, read_catalog
+
+
+def build_catalog_frame(rows, extra_columns):
+    """Synthetic catalog data"""
+    rng = random.Random(0)
+    data = {
+        'PRODUCER': [f"Producer {rng.randrange(rows // 4 + 1)}" for _ in range(rows)],
+        'CUVEE_NAME': [f"Cuvee {i}" for i in range(rows)],
+        'VINTAGE': [rng.choice([2015, 2018, 2020, 2021, 'NV', None]) for _ in range(rows)],
+        'REGION_APPELLATION': [rng.choice(['Rioja', 'Jura', 'Etna', 'Mosel']) for _ in range(rows)],
+        'BLEND_DETAILS': ['Tempranillo, Garnacha'] * rows,
+        'PACKAGING': ['12x750ml'] * rows,
+        'STANDARD_PRICE': [rng.choice([18, 24.5, '$32', 40]) for _ in range(rows)],
+        'DISCOUNT_PRICE': [rng.choice([None, 15, 21.5]) for _ in range(rows)],
+    }
+    for i in range(extra_columns):
+        data[f"NOTES_{i}"] = [f"unused text {i}-{r}" for r in range(rows)]
+    return pd.DataFrame(data)
+
+
+def build_workbook(rows, extra_columns):
+    """Build a synthetic catalog xlsx in memory"""
+    fh = io.BytesIO()
+    build_catalog_frame(rows, extra_columns).to_excel(fh, index=False)
+    return fh.getvalue()
+
+
+def build_csv(rows, extra_columns):
+    """The same catalog as a Google Sheets CSV export"""
+    return build_catalog_frame(rows, extra_columns).to_csv(index=False).encode('utf-8')
+
+
+def _memory_kb(field):
+    """Read a memory counter (VmRSS, VmHWM) for this process from /proc"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _measure(name, payload, queue):
+    """Parse payload with the named reader and report (seconds, peak RSS MB)"""
+    baseline_rss = _memory_kb('VmRSS')
+    start = time.perf_counter()
+
+    if name == 'pd.read_excel':
+        df = pd.read_excel(io.BytesIO(payload))
+    elif name.startswith('read_catalog[csv'):
+        df = read_catalog(io.BytesIO(payload), engine='csv')
+    elif name == 'read_catalog[openpyxl]':
+        df = read_catalog(io.BytesIO(payload), engine='openpyxl')
+    else:
+        df = read_catalog(io.BytesIO(payload), engine='calamine')
+
+    elapsed = time.perf_counter() - start
+    peak_rss = _memory_kb('VmHWM')
+    queue.put((elapsed, (peak_rss - baseline_rss) / 1024, len(df)))
+
+
+def run(rows, extra_columns):
+    print(f"Building workbook: {rows} rows, {8 + extra_columns} columns...")
+    payload = build_workbook(rows, extra_columns)
+    csv_payload = build_csv(rows, extra_columns)
+    print(f"Workbook size: {len(payload) / 1024 / 1024:.1f} MB, CSV export: "
+          f"{len(csv_payload) / 1024 / 1024:.1f} MB\n")
+
+    readers = ['pd.read_excel', 'read_catalog[openpyxl]']
+    if HAS_CALAMINE:
+        readers.append('read_catalog[calamine]')
+    readers.append('read_catalog[csv, pyarrow]' if HAS_PYARROW else 'read_catalog[csv]')
+
+    ctx = multiprocessing.get_context('spawn')
+    results = {}
+    for name in readers:
+        queue = ctx.Queue()
+        data = csv_payload if name.startswith('read_catalog[csv') else payload
+        process = ctx.Process(target=_measure, args=(name, data, queue))
+        process.start()
+        results[name] = queue.get()
+        process.join()
+
+    base_time, base_mem, _ = results['pd.read_excel']
+    print(f"{'reader':<26}{'seconds':>10}{'peak MB':>10}{'speedup':>10}{'mem ratio':>11}")
+    for name, (elapsed, mem, count) in results.items():
+        mem_ratio = base_mem / mem if mem > 0 else float('inf')
+        print(f"{name:<26}{elapsed:>10.2f}{mem:>10.1f}{base_time / elapsed:>9.1f}x{mem_ratio:>10.1f}x")
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    extra_columns = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    run(rows, extra_columns)
@@ -0,0 +1,664 @@
+"""Load test the API with concurrent clients against a local Drive stand-in
+
+Usage: python bench_load.py [--pattern closed] [--concurrency 20] [--duration 60] ...
+
+Starts a fake Drive holding a synthetic catalog and templates. It serves
+files.list for the query forms drive.py sends, ranged media downloads,
+Sheets tab exports, multipart uploads and batch requests. The API then
+runs under gunicorn with the production config, pointed at the fake
+through DRIVE_API_ROOT, so the whole pipeline runs for real:
+subprocesses, rendering and uploads.
+Clients drive /api/generate-sheet (reading every SSE stream to its done
+event), /api/feedback and /api/health in a weighted mix (--mix), with one
+of these arrival patterns:
+
+    closed   --concurrency clients, each sending its next request as soon as the last one finished
+    poisson  open-loop arrivals at --rate requests/second
+    burst    --concurrency requests at once, then wait for all of them
+
+Reports throughput, error and 429 rates, and p50/p95/p99 time to first
+event and time to done per endpoint. For plain requests both are the
+response time. Each virtual client sends its own X-Real-IP, like
+distinct users behind nginx, and a rejected closed-loop client waits out
+Retry-After. It also reports the peak RSS of the API (gunicorn) and of the
+whole backend process tree, generation subprocesses included.
+Use --url to load an API that is already running instead; RSS is then
+not measured.
+"""
+
+import argparse
+import email.parser
+import hashlib
+import http.client
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from docx import Document
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Pt
+
+from bench_ingest import build_workbook, build_csv
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+SHEET_MIME = 'application/vnd.google-apps.spreadsheet'
+CATALOG_TAB = '1234'  # gid of the catalog tab of a --catalog-format sheet catalog
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+CLAUSE_RE = re.compile(
+    r"^(?:name='(?P<name>.*)'|name contains '(?P<contains>.*)'|mimeType='(?P<mime>.*)'|'(?P<parent>.*)' in parents)$"
+)
+
+
+class FakeDrive:
+    """In-memory files plus the subset of the Drive v3 API the pipeline uses"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.files = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.uploads = 0
+
+    def add(self, name, mime_type, data=b'', parents=(), tabs=None):
+        """Add a file; a Google Sheet's data is its first tab, tabs its CSV tabs by gid"""
+        with self.lock:
+            file_id = f"file{len(self.files) + 1}"
+            self.files[file_id] = {
+                'meta': {
+                    'id': file_id,
+                    'name': name,
+                    'mimeType': mime_type,
+                    'parents': list(parents),
+                    'modifiedTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+                    'version': '1',
+                    'md5Checksum': hashlib.md5(data).hexdigest()
+                },
+                'data': data,
+                'tabs': tabs or {}
+            }
+            return file_id
+
+    def _matches(self, meta, q):
+        for clause in q.split(' and '):
+            match = CLAUSE_RE.match(clause.strip())
+            if match is None:
+                raise ValueError(f"Unsupported query clause: {clause}")
+            if match['name'] is not None and meta['name'] != match['name']:
+                return False
+            if match['contains'] is not None and match['contains'] not in meta['name']:
+                return False
+            if match['mime'] is not None and meta['mimeType'] != match['mime']:
+                return False
+            if match['parent'] is not None and match['parent'] not in meta['parents']:
+                return False
+        return True
+
+    def list(self, q, order_by=None, page_size=100):
+        with self.lock:
+            found = [f['meta'] for f in self.files.values() if self._matches(f['meta'], q or '')]
+        if order_by == 'modifiedTime desc':
+            found.sort(key=lambda meta: meta['modifiedTime'], reverse=True)
+        return found[:page_size]
+
+    def data(self, file_id):
+        with self.lock:
+            return self.files[file_id]['data'] if file_id in self.files else None
+
+    def tab(self, file_id, gid):
+        with self.lock:
+            return self.files[file_id]['tabs'].get(gid) if file_id in self.files else None
+
+
+class DriveHandler(BaseHTTPRequestHandler):
+    """HTTP front end for a FakeDrive (server.drive)"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status, payload):
+        return status, json.dumps(payload).encode(), 'application/json', {}
+
+    def _handle_get(self, path, query, headers):
+        drive = self.server.drive
+        if path == '/drive/v3/files':
+            files = drive.list(query.get('q', [''])[0], query.get('orderBy', [None])[0],
+                               int(query.get('pageSize', ['100'])[0]))
+            return self._json(200, {'files': files})
+
+        # Sheets export URL (drive.export_sheet_tab), one tab by gid
+        match = re.match(r'^/spreadsheets/d/([^/]+)/export$', path)
+        if match:
+            data = drive.tab(match[1], query.get('gid', ['0'])[0])
+            if data is None:
+                return self._json(404, {'error': {'code': 404, 'message': 'Tab not found'}})
+            return 200, data, 'text/csv', {}
+
+        match = re.match(r'^/drive/v3/files/([^/]+)(/export)?$', path)
+        data = drive.data(match[1]) if match else None
+        if data is None:
+            return self._json(404, {'error': {'code': 404, 'message': 'File not found'}})
+
+        # Ranged download (MediaIoBaseDownload asks for one chunk at a time)
+        byte_range = re.match(r'bytes=(\d+)-(\d+)', headers.get('range', ''))
+        if byte_range:
+            start, end = int(byte_range[1]), min(int(byte_range[2]), len(data) - 1)
+            return 206, data[start:end + 1], 'application/octet-stream', {
+                'Content-Range': f"bytes {start}-{end}/{len(data)}"
+            }
+        return 200, data, 'application/octet-stream', {}
+
+    def _handle_upload(self, body, content_type):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        metadata_part, media_part = message.get_payload()
+        metadata = json.loads(metadata_part.get_payload(decode=True))
+        drive = self.server.drive
+        file_id = drive.add(metadata['name'], media_part.get_content_type(),
+                            media_part.get_payload(decode=True), metadata.get('parents', ()))
+        drive.uploads += 1
+        return self._json(200, {'id': file_id})
+
+    def _handle_batch(self, body, content_type):
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        boundary = uuid.uuid4().hex
+        parts = []
+        for part in message.get_payload():
+            request_line, _, rest = part.get_payload().partition('\n')
+            method, url, _ = request_line.split(' ', 2)
+            parsed = urlparse(url)
+            status, payload, part_type, _ = self._handle_get(parsed.path, parse_qs(parsed.query), {})
+            content_id = part['Content-ID'].strip('<>')
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: {part_type}\r\n\r\n{payload.decode()}\r\n"
+            )
+        body = (''.join(parts) + f"--{boundary}--\r\n").encode()
+        return 200, body, f"multipart/mixed; boundary={boundary}", {}
+
+    def _respond(self, handler, *args):
+        self.server.drive.requests += 1
+        if self.server.drive.latency:
+            time.sleep(self.server.drive.latency)
+        try:
+            self._send(*handler(*args))
+        except Exception as e:
+            self._send(*self._json(500, {'error': {'code': 500, 'message': str(e)}}))
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        headers = {k.lower(): v for k, v in self.headers.items()}
+        self._respond(self._handle_get, parsed.path, parse_qs(parsed.query), headers)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        content_type = self.headers.get('Content-Type', '')
+        path = urlparse(self.path).path
+        if path.startswith('/upload/drive/v3/files'):
+            self._respond(self._handle_upload, body, content_type)
+        elif path.startswith('/batch/'):
+            self._respond(self._handle_batch, body, content_type)
+        else:
+            self._send(*self._json(404, {'error': {'code': 404, 'message': 'Unknown endpoint'}}))
+
+
+def build_template():
+    """Tasting sheet template: header, four-paragraph wine block, footer at paragraph 14"""
+    lq, rq = chr(8220), chr(8221)
+    doc = Document()
+    doc.add_paragraph('TASTING SHEET', style='Title')
+    run = doc.add_paragraph().add_run(f'{lq}PRODUCER{rq}')
+    run.bold = True
+    run.font.size = Pt(14)
+    paragraph = doc.add_paragraph()
+    paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    paragraph.add_run(f'{lq}REGION_APPELLATION{rq}').italic = True
+    doc.add_paragraph(f'{lq}CUVEE_NAME{rq} {lq}VINTAGE{rq} ({lq}BLEND_DETAILS{rq})')
+    doc.add_paragraph(f'{lq}PACKAGING{rq} {lq}STANDARD_PRICE{rq}, {lq}DISCOUNTED_PRICE{rq}**')
+    for _ in range(9):
+        doc.add_paragraph('')
+    doc.add_paragraph('** discounted pricing')
+    fh = io.BytesIO()
+    doc.save(fh)
+    return fh.getvalue()
+
+
+def build_price_template():
+    """Price list template: one table with a header row and a placeholder row"""
+    doc = Document()
+    doc.add_paragraph('PRICE LIST')
+    table = doc.add_table(rows=2, cols=3)
+    for cell, text in zip(table.rows[0].cells, ['Wine', 'Price', 'Discount']):
+        cell.text = text
+    fh = io.BytesIO()
+    doc.save(fh)
+    return fh.getvalue()
+
+
+def start_drive(rows, latency, catalog_format='xlsx'):
+    """Serve a FakeDrive with a folder, both templates and a catalog; returns (server, url)
+
+    catalog_format 'sheet' stores the catalog as a Google Sheet whose
+    catalog is on tab CATALOG_TAB (the first tab only holds notes).
+    """
+    drive = FakeDrive(latency)
+    folder_id = drive.add('Load Test Folder', FOLDER_MIME)
+    drive.add('TASTING SHEET', DOCX_MIME, build_template(), [folder_id])
+    drive.add('Price list', DOCX_MIME, build_price_template(), [folder_id])
+    if catalog_format == 'sheet':
+        notes = b'Notes\nThe catalog is on the next tab\n'
+        drive.add('catalog', SHEET_MIME, notes, [folder_id], tabs={'0': notes, CATALOG_TAB: build_csv(rows, 4)})
+    else:
+        drive.add('catalog.xlsx', XLSX_MIME, build_workbook(rows, 4), [folder_id])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), DriveHandler)
+    server.daemon_threads = True
+    server.drive = drive
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _free_port():
+    import socket
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_backend(drive_url, workdir, workers, catalog_format='xlsx'):
+    """Run the API under gunicorn against the fake Drive; returns (process, base url)"""
+    port = _free_port()
+    folders = os.path.join(workdir, 'folders.json')
+    folder = {'folder': 'Load Test Folder', 'tasting_template': 'TASTING SHEET', 'price_template': 'Price list'}
+    if catalog_format == 'sheet':
+        folder.update(catalog_format='sheet', catalog_tab=CATALOG_TAB)
+    with open(folders, 'w') as f:
+        json.dump({'load': folder}, f)
+
+    env = dict(
+        os.environ,
+        DRIVE_API_ROOT=drive_url,
+        FOLDERS_CONFIG=folders,
+        DEFAULT_FOLDER='load',
+        GENERATE_CWD=workdir,
+        LOG_DIR=os.path.join(workdir, 'logs'),
+        SHARED_CATALOG_DIR=os.path.join(workdir, 'shared_catalog'),
+        BIND=f"127.0.0.1:{port}",
+        WEB_WORKERS=str(workers)
+    )
+    log = open(os.path.join(workdir, 'backend.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited, see {log.name}")
+        try:
+            if request(url, 'GET', '/api/health')[0] == 200:
+                return process, url
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Backend didn't come up, see {log.name}")
+
+
+def request(base_url, method, path, payload=None, timeout=30):
+    """One plain request: (status, parsed JSON body or None)"""
+    parsed = urlparse(base_url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+    try:
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+    finally:
+        conn.close()
+
+
+class ProcessTreeSampler:
+    """Peak RSS of a process and of its whole tree, sampled from /proc"""
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.peak_root = 0
+        self.peak_tree = 0
+        self.peak_processes = 0
+        self.stopped = threading.Event()
+
+    @staticmethod
+    def _rss_kb(pid):
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return 0
+
+    def _tree(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        tree, stack = [], [self.pid]
+        while stack:
+            pid = stack.pop()
+            tree.append(pid)
+            stack.extend(children.get(pid, []))
+        return tree
+
+    def sample(self):
+        tree = self._tree()
+        # The API is gunicorn: the master and its direct worker children
+        api = [self.pid] + [p for p in tree if p != self.pid and 'gunicorn' in self._cmdline(p)]
+        self.peak_root = max(self.peak_root, sum(self._rss_kb(p) for p in api))
+        self.peak_tree = max(self.peak_tree, sum(self._rss_kb(p) for p in tree))
+        self.peak_processes = max(self.peak_processes, len(tree))
+
+    @staticmethod
+    def _cmdline(pid):
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                return f.read().decode(errors='replace')
+        except OSError:
+            return ''
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+
+class Results:
+    """Per-request samples, appended from every client thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+
+    def add(self, endpoint, outcome, first_event=None, done=None):
+        with self.lock:
+            self.samples.append({'endpoint': endpoint, 'outcome': outcome,
+                                 'first_event': first_event, 'done': done})
+
+
+def run_generate(base_url, query, timeout, client):
+    """POST /api/generate-sheet and read the SSE stream to its done event"""
+    parsed = urlparse(base_url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.request('POST', '/api/generate-sheet', body=json.dumps({'query': query}),
+                     headers={'Content-Type': 'application/json', 'X-Real-IP': client})
+        response = conn.getresponse()
+        if response.status == 429:
+            response.read()
+            return 'rejected', None, None, float(response.getheader('Retry-After', 1))
+        if response.status != 200:
+            response.read()
+            return 'error', None, None, 0
+
+        first_event = None
+        for line in response:
+            if not line.startswith(b'data: '):
+                continue
+            event = json.loads(line[6:])
+            if 'job' in event and len(event) == 1:
+                continue  # the job id is sent before any work happens
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            if event.get('done'):
+                outcome = 'ok' if event.get('success') else 'error'
+                return outcome, first_event, time.perf_counter() - start, 0
+        return 'error', first_event, None, 0  # stream ended without a done event
+    except OSError:
+        return 'error', None, None, 0
+    finally:
+        conn.close()
+
+
+def run_plain(base_url, method, path, payload, timeout):
+    start = time.perf_counter()
+    try:
+        status, _ = request(base_url, method, path, payload, timeout)
+    except OSError:
+        return 'error', None, None, 0
+    elapsed = time.perf_counter() - start
+    if status == 429:
+        return 'rejected', elapsed, elapsed, 1
+    return ('ok' if status < 400 else 'error'), elapsed, elapsed, 0
+
+
+def client_address(number):
+    """X-Real-IP of a virtual client (the API's per-client queue limit goes by it)"""
+    return f"10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+def one_request(args, rng, results, client):
+    """Send one request picked from the mix and record it; returns the Retry-After of a 429 (else 0)"""
+    endpoint = rng.choices(list(args.mix), weights=list(args.mix.values()))[0]
+    if endpoint == 'generate':
+        outcome = run_generate(args.url, rng.choice(args.queries), args.timeout, client)
+    elif endpoint == 'feedback':
+        outcome = run_plain(args.url, 'POST', '/api/feedback',
+                            {'message': 'load test feedback', 'last_query': rng.choice(args.queries)}, args.timeout)
+    else:
+        outcome = run_plain(args.url, 'GET', '/api/health', None, args.timeout)
+    results.add(endpoint, *outcome[:3])
+    return outcome[3]
+
+
+def drive_load(args, results):
+    """Generate load with the configured arrival pattern"""
+    threads = []
+
+    def spawn(target, *target_args):
+        thread = threading.Thread(target=target, args=target_args, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    if args.pattern == 'burst':
+        for i in range(args.concurrency):
+            spawn(one_request, args, random.Random(args.seed + i), results, client_address(i))
+    elif args.pattern == 'closed':
+        deadline = time.time() + args.duration
+
+        def client(rng, address):
+            while time.time() < deadline:
+                retry_after = one_request(args, rng, results, address)
+                # A rejected client backs off as told instead of spinning on 429s
+                time.sleep(min(retry_after, max(0, deadline - time.time())))
+
+        for i in range(args.concurrency):
+            spawn(client, random.Random(args.seed + i), client_address(i))
+    else:
+        rng = random.Random(args.seed)
+        deadline = time.time() + args.duration
+        arrivals = 0
+        while time.time() < deadline:
+            time.sleep(rng.expovariate(args.rate))
+            spawn(one_request, args, random.Random(rng.random()), results, client_address(arrivals))
+            arrivals += 1
+
+    for thread in threads:
+        thread.join()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+
+
+def report(results, elapsed, sampler, drive):
+    """Aggregate samples per endpoint"""
+    endpoints = {}
+    for endpoint in sorted({s['endpoint'] for s in results.samples}):
+        samples = [s for s in results.samples if s['endpoint'] == endpoint]
+        ok = [s for s in samples if s['outcome'] == 'ok']
+        first = [s['first_event'] for s in ok if s['first_event'] is not None]
+        done = [s['done'] for s in ok if s['done'] is not None]
+        endpoints[endpoint] = {
+            'requests': len(samples),
+            'ok': len(ok),
+            'errors': sum(s['outcome'] == 'error' for s in samples),
+            'rejected': sum(s['outcome'] == 'rejected' for s in samples),
+            'throughput': round(len(ok) / elapsed, 3) if elapsed else None,
+            'error_rate': round(sum(s['outcome'] == 'error' for s in samples) / len(samples), 4),
+            'first_event': {f'p{p}': percentile(first, p) for p in (50, 95, 99)},
+            'done': {f'p{p}': percentile(done, p) for p in (50, 95, 99)}
+        }
+    summary = {'seconds': round(elapsed, 2), 'endpoints': endpoints}
+    if sampler is not None:
+        summary['peak_rss_mb'] = {
+            'api': round(sampler.peak_root / 1024, 1),
+            'backend_tree': round(sampler.peak_tree / 1024, 1),
+            'processes': sampler.peak_processes
+        }
+    if drive is not None:
+        summary['drive'] = {'requests': drive.requests, 'uploads': drive.uploads}
+    return summary
+
+
+def _ms(value):
+    return f"{value * 1000:8.0f}" if value is not None else '       -'
+
+
+def print_report(summary):
+    print(f"\n{'endpoint':<10}{'requests':>9}{'ok':>7}{'errors':>8}{'429':>6}{'req/s':>8}"
+          f"{'first p50':>10}{'p95':>8}{'p99':>8}{'done p50':>10}{'p95':>8}{'p99':>8}  (ms)")
+    for endpoint, stats in summary['endpoints'].items():
+        first, done = stats['first_event'], stats['done']
+        print(f"{endpoint:<10}{stats['requests']:>9}{stats['ok']:>7}{stats['errors']:>8}{stats['rejected']:>6}"
+              f"{stats['throughput']:>8.2f}  {_ms(first['p50'])}{_ms(first['p95'])}{_ms(first['p99'])}"
+              f"  {_ms(done['p50'])}{_ms(done['p95'])}{_ms(done['p99'])}")
+    if 'peak_rss_mb' in summary:
+        rss = summary['peak_rss_mb']
+        print(f"\nPeak RSS: API {rss['api']} MB, backend tree {rss['backend_tree']} MB "
+              f"({rss['processes']} processes at most)")
+    if 'drive' in summary:
+        print(f"Drive stand-in: {summary['drive']['requests']} requests, {summary['drive']['uploads']} uploads")
+    print(f"Wall time: {summary['seconds']}s\n")
+
+
+def _mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ('generate', 'feedback', 'health'):
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}'")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the API against a local Drive stand-in')
+    parser.add_argument('--pattern', choices=['closed', 'poisson', 'burst'], default='closed')
+    parser.add_argument('--concurrency', type=int, default=20, help='clients (closed) or requests (burst)')
+    parser.add_argument('--rate', type=float, default=5.0, help='arrivals per second (poisson)')
+    parser.add_argument('--duration', type=float, default=60.0, help='seconds of load (closed, poisson)')
+    parser.add_argument('--mix', type=_mix, default=_mix('generate=1,feedback=1,health=2'),
+                        help='endpoint weights, e.g. generate=1,feedback=1,health=2')
+    parser.add_argument('--queries', nargs='+', default=None,
+                        help='generation queries (default: four random producer numbers each)')
+    parser.add_argument('--rows', type=int, default=5000, help='rows in the synthetic catalog')
+    parser.add_argument('--catalog-format', choices=['xlsx', 'sheet'], default='xlsx',
+                        help='catalog as an xlsx file or as a Google Sheet tab (CSV export)')
+    parser.add_argument('--drive-latency', type=float, default=0.05, help='seconds added to every Drive call')
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--timeout', type=float, default=300.0, help='per-request socket timeout')
+    parser.add_argument('--url', default=None, help='load an already running API instead of starting one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--keep', action='store_true', help='keep the backend working directory')
+    args = parser.parse_args()
+
+    # Every word is its own search term; a number matches a producer or two plus a cuvee
+    rng = random.Random(args.seed)
+    args.queries = args.queries or [' '.join(map(str, rng.sample(range(args.rows // 4), 4))) for _ in range(10)]
+
+    server = backend = sampler = drive = None
+    workdir = tempfile.mkdtemp(prefix='bench_load_')
+    try:
+        if args.url is None:
+            server, drive_url = start_drive(args.rows, args.drive_latency, args.catalog_format)
+            drive = server.drive
+            backend, args.url = start_backend(drive_url, workdir, args.workers, args.catalog_format)
+            sampler = ProcessTreeSampler(backend.pid).start()
+            # Load the catalog snapshot once so generations can attach to it
+            request(args.url, 'POST', '/api/search', {'query': args.queries[0]}, args.timeout)
+            print(f"Backend {args.url} (pid {backend.pid}), Drive stand-in {drive_url}, workdir {workdir}")
+
+        print(f"Load: {args.pattern}, concurrency {args.concurrency}, rate {args.rate}/s, "
+              f"duration {args.duration}s, mix {args.mix}")
+        results = Results()
+        start = time.perf_counter()
+        drive_load(args, results)
+        elapsed = time.perf_counter() - start
+        if sampler is not None:
+            sampler.sample()
+            sampler.stopped.set()
+
+        summary = report(results, elapsed, sampler, drive)
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            print_report(summary)
+    finally:
+        if backend is not None:
+            backend.terminate()
+            backend.wait(timeout=30)
+        if server is not None:
+            server.shutdown()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,236 @@
+"""Column-pruned, typed ingestion of the product catalog (xlsx, or a Google Sheet's CSV export)"""
+
+import csv
+import io
+import zipfile
+
+import pandas as pd
+from openpyxl import load_workbook
+
+try:
+    import python_calamine
+    HAS_CALAMINE = True
+except ImportError:
+    HAS_CALAMINE = False
+
+try:
+    import pyarrow.csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Columns the pipeline actually uses; everything else in the sheet is skipped
+TEXT_COLUMNS = ['PRODUCER', 'CUVEE_NAME', 'REGION_APPELLATION', 'BLEND_DETAILS', 'PACKAGING']
+PRICE_COLUMNS = ['STANDARD_PRICE', 'DISCOUNT_PRICE']
+CATALOG_COLUMNS = TEXT_COLUMNS + ['VINTAGE'] + PRICE_COLUMNS + ['Chosen']
+
+# 'Chosen' only exists in some sheets (legacy tasting sheet flow)
+OPTIONAL_COLUMNS = ['Chosen']
+
+
+def normalize_vintage(values):
+    """Normalize vintages to strings: 2018.0 -> '2018', 'NV' -> 'NV', blanks -> NA"""
+    vintages = pd.Series(values, dtype=object)
+    numeric = pd.to_numeric(vintages, errors='coerce')
+    whole = numeric.notna() & (numeric == numeric.round())
+
+    result = vintages.where(vintages.notna(), None).astype('string').str.strip()
+    result[whole] = numeric[whole].astype('int64').astype('string')
+    return result.mask(result == '')
+
+
+def normalize_price(values):
+    """Coerce prices to float64 ('$25', '25.00' and 25 all become 25.0)"""
+    prices = pd.Series(values, dtype=object)
+    as_text = prices.astype('string').str.replace(r'[$,\s]', '', regex=True)
+    return pd.to_numeric(as_text, errors='coerce').astype('float64')
+
+
+def wine_keys(df):
+    """Stable per-wine keys: normalized producer|cuvee|vintage|packaging
+
+    Keys survive row reordering between catalog revisions; exact duplicate
+    wines get '#2', '#3'... suffixes in row order.
+    """
+    parts = [
+        df[column].fillna('').astype(str).str.strip().str.lower()
+        for column in ['PRODUCER', 'CUVEE_NAME', 'VINTAGE', 'PACKAGING']
+    ]
+    keys = parts[0] + '|' + parts[1] + '|' + parts[2] + '|' + parts[3]
+
+    occurrence = keys.groupby(keys).cumcount() + 1
+    duplicate = occurrence > 1
+    keys[duplicate] = keys[duplicate] + '#' + occurrence[duplicate].astype(str)
+    return keys
+
+
+def format_prices(prices):
+    """Format normalized prices for display ('$25', '$25.5', '' when missing)"""
+    prices = pd.Series(prices, dtype='float64')
+    whole = prices.notna() & (prices == prices.round())
+
+    formatted = pd.Series('', index=prices.index, dtype=object)
+    formatted[prices.notna()] = '$' + prices[prices.notna()].astype(str)
+    formatted[whole] = '$' + prices[whole].astype('int64').astype(str)
+    return formatted
+
+
+def build_display_fields(df):
+    """Compute every display string for the selected wines in one vectorized pass
+
+    Returns a list of plain dicts (one per row, in order) so renderers never
+    touch pandas objects row by row.
+    """
+    text = {column: df[column].fillna('').astype(str) for column in TEXT_COLUMNS}
+    vintage = df['VINTAGE'].fillna('').astype(str)
+    standard_price = format_prices(df['STANDARD_PRICE'])
+    discount_price = format_prices(df['DISCOUNT_PRICE'])
+
+    # ", $20**" marks discounted wines on the tasting sheet
+    discount_marker = (', ' + discount_price + '**').where(df['DISCOUNT_PRICE'].notna(), '')
+
+    cuvee_line = text['CUVEE_NAME'] + (' ' + vintage).where(vintage != '', '')
+    blend_line = '(' + text['BLEND_DETAILS'] + ')'
+    producer_line = (
+        text['PRODUCER'] + '\n' + cuvee_line + '\n' + blend_line + '\n' + text['REGION_APPELLATION']
+    )
+
+    fields = pd.DataFrame({
+        'producer': text['PRODUCER'],
+        'cuvee': text['CUVEE_NAME'],
+        'region': text['REGION_APPELLATION'],
+        'blend': text['BLEND_DETAILS'],
+        'packaging': text['PACKAGING'],
+        'vintage': vintage,
+        'standard_price': standard_price,
+        'discount_price': discount_price,
+        'discount_marker': discount_marker,
+        'blend_line': blend_line,
+        'producer_line': producer_line,
+        'row': df.index
+    })
+    return fields.to_dict('records')
+
+
+def normalize_catalog(df):
+    """Apply explicit dtypes to the pruned catalog columns"""
+    # Optional columns stay absent when the sheet doesn't have them
+    columns = [c for c in CATALOG_COLUMNS if c in df.columns or c not in OPTIONAL_COLUMNS]
+
+    for column in TEXT_COLUMNS + [c for c in OPTIONAL_COLUMNS if c in columns]:
+        df[column] = df[column].astype('string')
+    df['VINTAGE'] = normalize_vintage(df['VINTAGE'])
+    for column in PRICE_COLUMNS:
+        df[column] = normalize_price(df[column])
+
+    df = df[columns].dropna(how='all').reset_index(drop=True)
+    df['KEY'] = wine_keys(df).astype('string')
+    return df
+
+
+def _column_positions(header):
+    """Position of each catalog column in a header row (first occurrence wins)"""
+    positions = {}
+    for position, name in enumerate(header):
+        if name in CATALOG_COLUMNS and name not in positions:
+            positions[name] = position
+
+    missing = [c for c in CATALOG_COLUMNS if c not in positions and c not in OPTIONAL_COLUMNS]
+    if missing:
+        raise ValueError(f"Catalog is missing required columns: {', '.join(missing)}")
+    return positions
+
+
+def _collect_columns(rows, empty=None):
+    """Keep only catalog columns from an iterator of row tuples (header first)"""
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame(columns=[c for c in CATALOG_COLUMNS if c not in OPTIONAL_COLUMNS])
+
+    positions = _column_positions(header)
+
+    columns = {name: [] for name in positions}
+    for row in rows:
+        # Skip fully empty rows (both readers report formatted-but-blank trailing rows)
+        if all(v is None or v == empty for v in row):
+            continue
+        for name, position in positions.items():
+            value = row[position] if position < len(row) else None
+            columns[name].append(None if value == empty else value)
+
+    return pd.DataFrame(columns)
+
+
+def _read_calamine(file_handle):
+    """Stream rows through the Rust-backed calamine reader"""
+    workbook = python_calamine.CalamineWorkbook.from_filelike(file_handle)
+    try:
+        sheet = workbook.get_sheet_by_index(0)
+        # calamine reports empty cells as ''
+        return _collect_columns(iter(sheet.iter_rows()), empty='')
+    finally:
+        workbook.close()
+
+
+def _read_openpyxl(file_handle):
+    """Stream rows through a read-only openpyxl workbook"""
+    workbook = load_workbook(file_handle, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        return _collect_columns(sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _read_csv(file_handle):
+    """Parse only the catalog columns of a CSV export, every value as text
+
+    Uses pyarrow's multi-threaded reader when installed, pandas' C parser
+    otherwise. Only empty cells are missing values (a cuvee called 'NA'
+    stays a string), matching the xlsx readers.
+    """
+    data = file_handle.read()
+    first_line = data[:data.find(b'\n') + 1 or len(data)].decode('utf-8-sig')
+    header = next(csv.reader([first_line]), None)
+    if not header:
+        return pd.DataFrame(columns=[c for c in CATALOG_COLUMNS if c not in OPTIONAL_COLUMNS])
+
+    columns = list(_column_positions(header))
+    if HAS_PYARROW:
+        table = pa_csv.read_csv(
+            io.BytesIO(data),
+            read_options=pa_csv.ReadOptions(use_threads=True),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=columns,
+                column_types={c: 'string' for c in columns},
+                null_values=[''],
+                strings_can_be_null=True
+            )
+        )
+        return table.to_pandas()
+
+    return pd.read_csv(io.BytesIO(data), usecols=columns, dtype=str, keep_default_na=False,
+                       na_values=[''], encoding='utf-8-sig')
+
+
+def read_catalog(file_handle, engine=None):
+    """Read the catalog into a pruned, typed DataFrame with a stable KEY column
+
+    engine: 'calamine', 'openpyxl', 'csv' or None (CSV unless the data is an
+    xlsx archive, then calamine when installed).
+    """
+    if engine is None:
+        if not zipfile.is_zipfile(file_handle):
+            engine = 'csv'
+        else:
+            engine = 'calamine' if HAS_CALAMINE else 'openpyxl'
+        file_handle.seek(0)
+
+    if engine == 'csv':
+        df = _read_csv(file_handle)
+    elif engine == 'calamine':
+        df = _read_calamine(file_handle)
+    else:
+        df = _read_openpyxl(file_handle)
+
+    return normalize_catalog(df)
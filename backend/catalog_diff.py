@@ -0,0 +1,223 @@
+"""Diff catalog revisions by wine KEY and update derived indexes incrementally
+
+A new week's catalog usually differs from the last one in a few prices and
+a handful of added or removed wines. diff_catalogs() matches the two
+revisions on their stable KEY column with one merge and compares every
+column of the matched rows at once. update_search_index() then carries the
+previous index over: postings of untouched rows are remapped to their new
+positions in one vectorized pass, and only added rows and rows whose text
+changed are normalized and tokenized again. Range fields are a numpy sort
+and are simply rebuilt.
+
+Render cache entries (render_cache) are addressed by content, so unchanged
+wines keep hitting and changed ones miss on their own; nothing there needs
+invalidating.
+
+    python catalog_diff.py old.xlsx new.xlsx    prints the change summary
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+from catalog import TEXT_COLUMNS, PRICE_COLUMNS, read_catalog
+from search_index import TEXT_FIELDS, RANGE_FIELDS, EMPTY, _build_range_field
+from typeahead import FIELDS as TYPEAHEAD_FIELDS, normalize_name
+
+COMPARED_COLUMNS = TEXT_COLUMNS + ['VINTAGE'] + PRICE_COLUMNS
+SUMMARY_LIMIT = 50  # keys listed per kind of change (counts are always exact)
+
+
+def _differs(old_values, new_values):
+    """Element-wise 'changed' for two aligned Series (missing == missing)"""
+    same = old_values.eq(new_values).fillna(False) | (old_values.isna() & new_values.isna())
+    return ~same.to_numpy(dtype=bool)
+
+
+def diff_catalogs(old, new):
+    """Match two catalog DataFrames on KEY
+
+    Returns positions in each frame: 'added' (new rows), 'removed' (old
+    rows), 'old_to_new' (old position -> new position, -1 when removed)
+    and 'changed' ({column: new positions of matched rows whose value
+    changed}).
+    """
+    old_keys = old['KEY'].to_numpy(dtype=object)
+    new_keys = new['KEY'].to_numpy(dtype=object)
+    if len(old_keys) == len(new_keys) and (old_keys == new_keys).all():
+        # Same wines in the same order (a price-only update): no merge needed
+        old_rows = new_rows = np.arange(len(new_keys), dtype=np.int64)
+        added = removed = EMPTY
+    else:
+        merged = pd.merge(
+            pd.DataFrame({'KEY': old_keys, 'old_row': np.arange(len(old))}),
+            pd.DataFrame({'KEY': new_keys, 'new_row': np.arange(len(new))}),
+            on='KEY', how='outer', indicator=True
+        )
+        side = merged['_merge']
+        both = merged[side == 'both']
+        old_rows = both['old_row'].to_numpy(dtype=np.int64)
+        new_rows = both['new_row'].to_numpy(dtype=np.int64)
+        added = np.sort(merged.loc[side == 'right_only', 'new_row'].to_numpy(dtype=np.int64))
+        removed = np.sort(merged.loc[side == 'left_only', 'old_row'].to_numpy(dtype=np.int64))
+
+    old_to_new = np.full(len(old), -1, dtype=np.int64)
+    old_to_new[old_rows] = new_rows
+
+    changed = {}
+    for column in COMPARED_COLUMNS:
+        if column not in old.columns or column not in new.columns:
+            continue
+        differs = _differs(
+            old[column].iloc[old_rows].reset_index(drop=True),
+            new[column].iloc[new_rows].reset_index(drop=True)
+        )
+        changed[column] = np.sort(new_rows[differs])
+
+    return {
+        'added': added,
+        'removed': removed,
+        'old_to_new': old_to_new,
+        'changed': changed
+    }
+
+
+def _repriced(diff):
+    rows = [diff['changed'][c] for c in PRICE_COLUMNS if c in diff['changed']]
+    return np.unique(np.concatenate(rows)) if rows else EMPTY
+
+
+def summarize(diff, old, new, limit=SUMMARY_LIMIT):
+    """Change summary: counts plus (up to limit) keys of added, removed and repriced wines"""
+    repriced = _repriced(diff)
+    text_changed = [diff['changed'][c] for c in TEXT_COLUMNS if c in diff['changed']]
+    updated = np.setdiff1d(np.unique(np.concatenate(text_changed)), repriced) if text_changed else EMPTY
+
+    matched = np.flatnonzero(diff['old_to_new'] >= 0)
+    new_to_old = np.full(len(new), -1, dtype=np.int64)
+    new_to_old[diff['old_to_new'][matched]] = matched
+
+    repriced_details = []
+    for row in repriced[:limit]:
+        detail = {'key': new['KEY'].iat[row]}
+        for column in PRICE_COLUMNS:
+            before, after = old[column].iat[new_to_old[row]], new[column].iat[row]
+            detail[column.lower()] = [None if pd.isna(before) else float(before),
+                                      None if pd.isna(after) else float(after)]
+        repriced_details.append(detail)
+
+    return {
+        'rows': len(new),
+        'added': len(diff['added']),
+        'removed': len(diff['removed']),
+        'repriced': len(repriced),
+        'updated': len(updated),
+        'added_keys': new['KEY'].iloc[diff['added'][:limit]].tolist(),
+        'removed_keys': old['KEY'].iloc[diff['removed'][:limit]].tolist(),
+        'repriced_wines': repriced_details
+    }
+
+
+def _update_text_field(field_index, old_to_new, fresh, values):
+    """Carry one text field's index over to the new revision
+
+    fresh: new positions that need tokenizing (added rows and rows whose
+    value changed). Everything else keeps its normalized value and its
+    postings, remapped to its new position.
+    """
+    size = len(values)
+    if not len(fresh) and len(old_to_new) == size and (old_to_new == np.arange(size)).all():
+        return field_index  # nothing moved or changed: share the previous field index
+
+    normalized = np.empty(size, dtype=object)
+    matched = old_to_new >= 0
+    normalized[old_to_new[matched]] = np.asarray(field_index['normalized'], dtype=object)[matched]
+
+    # Postings as one (token id, row) list: drop removed and stale rows, remap the rest
+    tokens = list(field_index['tokens'])
+    postings = field_index['postings']
+    lengths = [len(postings[t]) for t in tokens]
+    rows = np.concatenate([postings[t] for t in tokens]).astype(np.int64) if tokens else EMPTY
+    token_ids = np.repeat(np.arange(len(tokens), dtype=np.int64), lengths)
+
+    is_fresh = np.zeros(size, dtype=bool)
+    is_fresh[fresh] = True
+    moved = old_to_new[rows]
+    keep = moved >= 0
+    keep[keep] = ~is_fresh[moved[keep]]
+
+    token_id = {token: i for i, token in enumerate(tokens)}
+    fresh_ids, fresh_rows = [], []
+    for row in fresh:
+        value = values[row]
+        normalized[row] = normalize_name(value) if pd.notna(value) else ''
+        for token in set(normalized[row].split()):
+            if token not in token_id:
+                token_id[token] = len(tokens)
+                tokens.append(token)
+            fresh_ids.append(token_id[token])
+            fresh_rows.append(row)
+
+    ids = np.concatenate([token_ids[keep], np.array(fresh_ids, dtype=np.int64)])
+    rows = np.concatenate([moved[keep], np.array(fresh_rows, dtype=np.int64)])
+    order = np.lexsort((rows, ids))
+    ids, rows = ids[order], rows[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if len(ids) else EMPTY
+    ends = np.r_[starts[1:], len(ids)]
+
+    new_postings = {
+        tokens[token]: rows[start:end]
+        for token, start, end in zip(ids[starts].tolist(), starts.tolist(), ends.tolist())
+    }
+    return {
+        'normalized': normalized,
+        'tokens': sorted(new_postings),
+        'postings': new_postings
+    }
+
+
+def update_search_index(index, diff, df):
+    """The new revision's search index, built from the previous one and their diff
+
+    Same result as search_index.build_search_index(df).
+    """
+    text = {}
+    for field, column in TEXT_FIELDS.items():
+        fresh = np.union1d(diff['added'], diff['changed'].get(column, EMPTY))
+        text[field] = _update_text_field(index['text'][field], diff['old_to_new'], fresh, df[column].to_numpy())
+
+    return {
+        'size': len(df),
+        'text': text,
+        'range': {field: _build_range_field(df[column].to_numpy()) for field, column in RANGE_FIELDS.items()}
+    }
+
+
+def names_changed(diff):
+    """Whether the typeahead's names or counts can differ (prices alone don't matter)"""
+    if len(diff['added']) or len(diff['removed']):
+        return True
+    return any(len(diff['changed'].get(column, EMPTY)) for column in TYPEAHEAD_FIELDS)
+
+
+def print_summary(summary):
+    """Human-readable change summary"""
+    print(f"{summary['rows']} wines: {summary['added']} added, {summary['removed']} removed, "
+          f"{summary['repriced']} repriced, {summary['updated']} with other changes")
+    for key in summary['added_keys']:
+        print(f"  + {key}")
+    for key in summary['removed_keys']:
+        print(f"  - {key}")
+    for wine in summary['repriced_wines']:
+        before, after = wine['standard_price']
+        print(f"  $ {wine['key']}: {before} → {after}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print("Usage: python catalog_diff.py OLD.xlsx NEW.xlsx")
+        sys.exit(1)
+    with open(sys.argv[1], 'rb') as old_file, open(sys.argv[2], 'rb') as new_file:
+        old_df, new_df = read_catalog(old_file), read_catalog(new_file)
+    print_summary(summarize(diff_catalogs(old_df, new_df), old_df, new_df))
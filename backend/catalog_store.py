@@ -0,0 +1,278 @@
+"""In-memory catalog snapshots for the API process, one per configured folder
+
+Each folder (tenant) gets its own snapshot: the parsed catalog plus the
+indexes derived from it, loaded once per revision (file id +
+modifiedTime). Storage (Drive, or a local directory, see storage) is
+re-checked for a newer revision at most every CATALOG_REFRESH_SECONDS, in
+the background, so searches never wait on it once a snapshot exists.
+
+Each loaded revision is also published to shared memory (shared_catalog)
+so generation subprocesses can map it instead of re-parsing the xlsx.
+
+A new revision is diffed against the active snapshot by wine KEY
+(catalog_diff): the search index is carried over with only the affected
+postings updated, the typeahead is reused unless names changed, and the
+change summary (added/removed/repriced) is kept on the snapshot.
+
+With a shared cache tier (SHARED_CACHE_URL, see shared_cache) a parsed
+and indexed revision is also stored there (as columnar arrays, see
+shared_catalog.pack_snapshot), and only the first replica to see a
+revision downloads and parses it; the others load the stored one.
+
+Snapshots share a global memory budget (CATALOG_MEMORY_BUDGET_MB); when
+loading one pushes the total over budget, the least recently used tenants
+are evicted (and unpublished from shared memory) and simply reload on
+their next request.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from catalog import read_catalog
+from catalog_diff import diff_catalogs, update_search_index, names_changed, summarize
+from folders import get_folder
+from jobs import offload
+from shared_cache import cache_for
+from shared_catalog import publish, unpublish, revision_dir_name, pack_snapshot, unpack_snapshot
+from storage import thread_storage
+from search_index import build_search_index
+from typeahead import build_typeahead
+
+REFRESH_SECONDS = float(os.getenv('CATALOG_REFRESH_SECONDS', '60'))
+MEMORY_BUDGET = int(float(os.getenv('CATALOG_MEMORY_BUDGET_MB', '512')) * 1024 * 1024)
+
+_lock = threading.Lock()  # guards _tenants
+_tenants = OrderedDict()  # folder key -> tenant state, least recently used first
+
+
+def _tenant(key):
+    """Tenant state for a folder key, marked as most recently used"""
+    with _lock:
+        if key not in _tenants:
+            _tenants[key] = {
+                'lock': threading.Lock(),
+                'folder_id': None,
+                'snapshot': None,
+                'checked_at': 0.0,
+                'refreshing': False,
+                'published': False,
+                'error': None
+            }
+        _tenants.move_to_end(key)
+        return _tenants[key]
+
+
+def snapshot_bytes(snapshot):
+    """Approximate resident size of a snapshot (catalog + indexes)"""
+    size = int(snapshot['df'].memory_usage(deep=True).sum())
+    for field in snapshot['index']['text'].values():
+        size += sum(rows.nbytes for rows in field['postings'].values())
+        size += sum(len(token) + 49 for token in field['tokens']) * 2
+        size += sum(len(value) + 49 for value in field['normalized'])
+    for field in snapshot['index']['range'].values():
+        size += field['values'].nbytes + field['rows'].nbytes
+    # keys + ids + counts + sparse table levels, ~8 bytes per slot plus key strings
+    typeahead = snapshot['typeahead']
+    size += sum(len(key) + 49 for key in typeahead['keys'])
+    size += 8 * (2 * len(typeahead['keys']) + sum(len(level) for level in typeahead['table']))
+    return size
+
+
+def _enforce_budget(keep_key):
+    """Evict least recently used snapshots until the total fits the budget
+
+    Returns the evicted folder keys, whose published revisions the caller
+    removes (outside the lock).
+    """
+    evicted = []
+    with _lock:
+        total = sum(t['snapshot']['bytes'] for t in _tenants.values() if t['snapshot'])
+        for key in list(_tenants):
+            if total <= MEMORY_BUDGET:
+                break
+            tenant = _tenants[key]
+            if key == keep_key or tenant['snapshot'] is None:
+                continue
+            total -= tenant['snapshot']['bytes']
+            tenant['snapshot'] = None
+            tenant['published'] = False
+            tenant['checked_at'] = 0.0
+            evicted.append(key)
+    return evicted
+
+
+def _build_snapshot(file_handle, file_info, previous=None):
+    """Parse one catalog revision and build its derived indexes (CPU-bound)
+
+    With the previous snapshot, indexes are updated from the diff instead
+    of being rebuilt.
+    """
+    df = read_catalog(file_handle)
+    changes = None
+    if previous is None:
+        index = build_search_index(df)
+        typeahead = build_typeahead(df)
+    else:
+        diff = diff_catalogs(previous['df'], df)
+        index = update_search_index(previous['index'], diff, df)
+        typeahead = build_typeahead(df) if names_changed(diff) else previous['typeahead']
+        changes = summarize(diff, previous['df'], df)
+        changes['previous_revision'] = previous['revision']
+    return _snapshot({'df': df, 'index': index, 'typeahead': typeahead, 'changes': changes}, file_info)
+
+
+def _snapshot(fields, file_info):
+    """A snapshot from its df, index, typeahead and changes plus the revision's metadata"""
+    snapshot = dict(
+        fields,
+        revision=f"{file_info['id']}@{file_info['modifiedTime']}",
+        file_name=file_info['name'],
+        modified_at=datetime.fromisoformat(file_info['modifiedTime'].replace('Z', '+00:00')).timestamp(),
+        loaded_at=time.time()
+    )
+    snapshot['bytes'] = snapshot_bytes(snapshot)
+    return snapshot
+
+
+def _restore_snapshot(data, file_info):
+    return _snapshot(unpack_snapshot(data), file_info)
+
+
+def _load_snapshot(storage, file_info, previous=None):
+    """Read one catalog revision (xlsx, or a Sheet's CSV export), then parse it off the event loop
+
+    With a shared cache tier the revision comes from there when another
+    replica already built it (or is building it right now).
+    """
+    def build():
+        with storage.read(file_info) as file_handle:
+            return offload(_build_snapshot, file_handle, file_info, previous)
+
+    cache = cache_for('snapshot')
+    if cache is None:
+        return build()
+
+    built = []
+
+    def fill():
+        built.append(build())
+        return offload(pack_snapshot, built[0])
+
+    revision = f"{file_info['id']}@{file_info['modifiedTime']}"
+    # Grouped by file id, so storing a new revision drops the previous one
+    data = cache.get_or_fill(revision_dir_name(revision), fill, group=revision_dir_name(f"{file_info['id']}@"))
+    if built:
+        return built[0]
+    try:
+        return offload(_restore_snapshot, data, file_info)
+    except ValueError as e:
+        # A corrupt or foreign entry is a miss: build the revision here
+        print(f"Ignoring cached snapshot of {revision}: {e}", file=sys.stderr)
+        return build()
+
+
+def _refresh(folder, tenant):
+    """Check storage for the folder's latest catalog revision and load it if it changed
+
+    The last failure is kept on the tenant (until a refresh succeeds) for
+    readiness reporting.
+    """
+    try:
+        _check_revision(folder, tenant)
+    except Exception as e:
+        tenant['error'] = {'message': f"{type(e).__name__}: {e}"[:200], 'at': time.time()}
+        raise
+    tenant['error'] = None
+
+
+def _check_revision(folder, tenant):
+    """One refresh attempt (see _refresh)"""
+    storage = thread_storage()
+    if tenant['folder_id'] is None:
+        tenant['folder_id'] = storage.find_folder(folder['folder'])
+
+    file_info = storage.find_catalog(tenant['folder_id'], folder)
+    if not file_info:
+        raise FileNotFoundError(f"No Excel files found in {folder['folder']}")
+
+    snapshot = tenant['snapshot']
+    revision = f"{file_info['id']}@{file_info['modifiedTime']}"
+    if snapshot is None or snapshot['revision'] != revision:
+        tenant['snapshot'] = _load_snapshot(storage, file_info, snapshot)
+        changes = tenant['snapshot']['changes']
+        if changes:
+            print(f"Catalog {folder['key']} updated to {revision}: {changes['added']} added, "
+                  f"{changes['removed']} removed, {changes['repriced']} repriced", file=sys.stderr)
+        for key in _enforce_budget(folder['key']):
+            offload(unpublish, key)
+        try:
+            offload(publish, folder['key'], tenant['snapshot'])
+            tenant['published'] = True
+        except OSError:
+            tenant['published'] = False  # workers fall back to downloading the catalog themselves
+    tenant['checked_at'] = time.time()
+
+
+def _refresh_in_background(folder, tenant):
+    """Refresh without blocking readers; they keep the current snapshot meanwhile"""
+    try:
+        with tenant['lock']:
+            _refresh(folder, tenant)
+    finally:
+        tenant['refreshing'] = False
+
+
+def get_snapshot(folder_key=None, force_refresh=False):
+    """Return the active catalog snapshot for a folder (the default folder when None)
+
+    The first call (or force_refresh, or a call after eviction) loads
+    synchronously. After that a stale snapshot is still returned
+    immediately while a background thread checks storage for a newer revision.
+    """
+    folder = get_folder(folder_key)
+    tenant = _tenant(folder['key'])
+
+    snapshot = tenant['snapshot']
+    if snapshot is None or force_refresh:
+        with tenant['lock']:
+            if tenant['snapshot'] is None or force_refresh:
+                _refresh(folder, tenant)
+            return tenant['snapshot']
+
+    stale = time.time() - tenant['checked_at'] >= REFRESH_SECONDS
+    if stale and not tenant['refreshing']:
+        tenant['refreshing'] = True
+        threading.Thread(target=_refresh_in_background, args=(folder, tenant), daemon=True).start()
+
+    return snapshot
+
+
+def tenant_stats(changes=True):
+    """Per-folder snapshot state, most recently used last
+
+    Revision, size, catalog age, whether the snapshot is published to
+    shared memory, the last refresh check and error, and (with changes)
+    the last change summary. Only reads in-memory state.
+    """
+    now = time.time()
+    with _lock:
+        stats = {}
+        for key, t in _tenants.items():
+            snapshot = t['snapshot']
+            stats[key] = {
+                'loaded': snapshot is not None,
+                'revision': snapshot['revision'] if snapshot else None,
+                'bytes': snapshot['bytes'] if snapshot else 0,
+                'age_seconds': round(now - snapshot['modified_at']) if snapshot else None,
+                'published': t['published'] if snapshot else False,
+                'checked_seconds_ago': round(now - t['checked_at'], 1) if t['checked_at'] else None,
+                'refreshing': t['refreshing'],
+                'error': t['error']
+            }
+            if changes:
+                stats[key]['changes'] = snapshot['changes'] if snapshot else None
+        return stats
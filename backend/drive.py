@@ -0,0 +1,535 @@
+"""Google Drive access layer: retries, rate limiting, pagination and batched lookups
+
+Every Drive call goes through execute(), which waits on a per-process
+token-bucket rate limiter and retries 429/5xx (and rate-limit 403s) with
+jittered exponential backoff. Independent metadata lookups can be sent
+together with batch_list() as a single Drive batch HTTP request.
+
+call_stats keeps the latency and outcome of recent call attempts, and
+token_status() the loaded token's expiry, for the readiness endpoint.
+Generation subprocesses make most of the Drive calls; at exit each one
+prints its stats as a CALL_STATS_PREFIX line (report_call_stats), which
+the parent merges into its own, so the API's call_stats covers the
+pipelines too (see jobs).
+"""
+
+import io
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import googleapiclient
+import httplib2
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+
+from shared_cache import cache_for
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+XLSX_MIME = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+GOOGLE_DOC_MIME = 'application/vnd.google-apps.document'
+GOOGLE_SHEET_MIME = 'application/vnd.google-apps.spreadsheet'
+CSV_MIME = 'text/csv'
+# Native formats and what they are exported to
+EXPORTS = {GOOGLE_DOC_MIME: (DOCX_MIME, '.docx'), GOOGLE_SHEET_MIME: (CSV_MIME, '.csv')}
+
+MAX_RETRIES = int(os.getenv('DRIVE_MAX_RETRIES', '5'))
+BACKOFF_BASE = float(os.getenv('DRIVE_BACKOFF_BASE', '0.5'))
+BACKOFF_CAP = float(os.getenv('DRIVE_BACKOFF_CAP', '30'))
+RATE_LIMIT = float(os.getenv('DRIVE_RATE_LIMIT', '10'))  # requests per second per process
+RATE_BURST = int(os.getenv('DRIVE_RATE_BURST', '20'))
+# The client default is 100MB (one request per file, a retry refetches all of it)
+DOWNLOAD_CHUNK_SIZE = int(float(os.getenv('DRIVE_DOWNLOAD_CHUNK_MB', '8')) * 1024 * 1024)
+# Google Docs/Sheets exports, one file per revision (file id [+ tab] + version)
+EXPORT_CACHE_DIR = os.getenv('DRIVE_EXPORT_CACHE', 'export_cache')
+
+# Local Drive stand-in (bench_load.py) to send every call to instead of Google
+API_ROOT = os.getenv('DRIVE_API_ROOT')
+# Sheets export URLs (tabs other than the first); the stand-in serves those too
+SHEETS_EXPORT_ROOT = (os.getenv('SHEETS_EXPORT_ROOT') or API_ROOT or 'https://docs.google.com').rstrip('/')
+
+CALL_WINDOW = 100  # recent Drive call attempts kept for the error rate
+CALL_STATS_PREFIX = '📊 Drive calls: '  # a subprocess's call_stats, see report_call_stats()
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+def authenticate():
+    """Load credentials from token.json (no credentials against a DRIVE_API_ROOT stand-in)"""
+    global _credentials
+    if API_ROOT:
+        return _stand_in_service(API_ROOT)
+    creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    _credentials = creds
+    return build('drive', 'v3', credentials=creds)
+
+
+_credentials = None  # the last loaded token, for token_status()
+
+
+def token_status():
+    """Seconds until the current access token expires, and whether it can be refreshed
+
+    None before this process has authenticated (or against a stand-in).
+    The client refreshes an expired token on its next call, so a negative
+    expires_in only matters when there's no refresh token.
+    """
+    creds = _credentials
+    if creds is None:
+        return None
+    expires_in = None
+    if creds.expiry is not None:
+        expires_in = round((creds.expiry - datetime.utcnow()).total_seconds())
+    return {
+        'expires_in': expires_in,
+        'refreshable': bool(creds.refresh_token)
+    }
+
+
+def _stand_in_service(root):
+    """Drive service for a local stand-in
+
+    Built from the client's bundled discovery document with rootUrl moved:
+    client_options' api_endpoint would leave batch requests going to Google.
+    """
+    path = os.path.join(os.path.dirname(googleapiclient.__file__), 'discovery_cache', 'documents', 'drive.v3.json')
+    with open(path) as f:
+        document = json.load(f)
+    document['rootUrl'] = root.rstrip('/') + '/'
+    return build_from_document(document, credentials=AnonymousCredentials())
+
+
+_local = threading.local()
+
+
+def thread_service():
+    """Drive service for the current thread (httplib2 connections aren't thread-safe)"""
+    if getattr(_local, 'service', None) is None:
+        _local.service = authenticate()
+    return _local.service
+
+
+def thread_http(service):
+    """Authorized HTTP connection for the current thread, sharing service's credentials
+
+    Cheaper than a whole thread_service() when requests are built on a
+    shared service but have to be sent from worker threads.
+    """
+    if getattr(_local, 'http', None) is None:
+        _local.http = AuthorizedHttp(service._http.credentials, http=httplib2.Http())
+    return _local.http
+
+
+class RateLimiter:
+    """Token bucket shared by every Drive call in this process"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = RateLimiter(RATE_LIMIT, RATE_BURST)
+
+
+class CallStats:
+    """Latency and outcome of the most recent Drive call attempts in this process"""
+
+    def __init__(self, window):
+        self.outcomes = deque(maxlen=window)  # True for success, per attempt
+        self.last_seconds = None
+        self.last_at = None
+        self.last_error = None
+        self.last_error_at = None
+
+    def record(self, seconds, error=None):
+        self.outcomes.append(error is None)
+        self.last_seconds = seconds
+        self.last_at = time.time()
+        if error is not None:
+            self.last_error = f"{type(error).__name__}: {error}"[:200]
+            self.last_error_at = self.last_at
+
+    def summary(self):
+        """Plain-value snapshot (no locking: a torn read is off by one call at most)"""
+        outcomes = list(self.outcomes)
+        return {
+            'calls': len(outcomes),
+            'error_rate': round(outcomes.count(False) / len(outcomes), 3) if outcomes else None,
+            'last_ms': round(self.last_seconds * 1000, 1) if self.last_seconds is not None else None,
+            'last_at': self.last_at,
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at
+        }
+
+    def report(self):
+        """The outcomes and last call/error as one CALL_STATS_PREFIX line, for merge() in the parent"""
+        return CALL_STATS_PREFIX + json.dumps({
+            'outcomes': ''.join('1' if ok else '0' for ok in list(self.outcomes)),
+            'last_seconds': self.last_seconds,
+            'last_at': self.last_at,
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at
+        })
+
+    def merge(self, line):
+        """Add a subprocess's report() line; its calls count as the most recent ones"""
+        try:
+            data = json.loads(line[len(CALL_STATS_PREFIX):])
+            self.outcomes.extend(ok == '1' for ok in data['outcomes'])
+            if data['last_at'] and (self.last_at is None or data['last_at'] > self.last_at):
+                self.last_seconds, self.last_at = data['last_seconds'], data['last_at']
+            if data['last_error_at'] and (self.last_error_at is None or data['last_error_at'] > self.last_error_at):
+                self.last_error, self.last_error_at = data['last_error'], data['last_error_at']
+        except (ValueError, KeyError, TypeError):
+            pass  # a garbled report only loses that process's stats
+
+
+call_stats = CallStats(CALL_WINDOW)
+
+
+def report_call_stats():
+    """Print this process's call_stats for its parent (generation scripts run this at exit)"""
+    if call_stats.outcomes:
+        print(call_stats.report(), flush=True)
+
+
+def is_retryable(error):
+    """Whether a Drive error is worth retrying"""
+    if isinstance(error, (socket.timeout, ConnectionError, TimeoutError)):
+        return True
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in RETRY_STATUSES:
+        return True
+    if error.resp.status == 403:
+        reasons = {detail.get('reason') for detail in (error.error_details or []) if isinstance(detail, dict)}
+        return bool(reasons & RETRY_REASONS)
+    return False
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))"""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+def with_retries(call, tokens=1):
+    """Run call() under the rate limiter, retrying transient Drive errors"""
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire(tokens)
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception as e:
+            call_stats.record(time.perf_counter() - start, e)
+            if attempt == MAX_RETRIES or not is_retryable(e):
+                raise
+            time.sleep(backoff_delay(attempt))
+        else:
+            call_stats.record(time.perf_counter() - start)
+            return result
+
+
+def execute(request):
+    """Execute one Drive API request with rate limiting and retries"""
+    return with_retries(request.execute)
+
+
+def list_files(service, q, fields, order_by=None, page_size=100, limit=None):
+    """List every file matching q, following nextPageToken
+
+    fields is the per-file field list, e.g. 'id, name'.
+    """
+    files = []
+    page_token = None
+    while True:
+        request = service.files().list(
+            q=q,
+            fields=f'nextPageToken, files({fields})',
+            orderBy=order_by,
+            pageSize=page_size if limit is None else min(page_size, limit - len(files)),
+            pageToken=page_token
+        )
+        response = execute(request)
+        files.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token or (limit is not None and len(files) >= limit):
+            return files
+
+
+def list_query(q, fields, order_by=None, limit=None):
+    """Describe a files().list lookup for batch_list"""
+    return {'q': q, 'fields': fields, 'order_by': order_by, 'limit': limit}
+
+
+def batch_list(service, lookups):
+    """Run several independent list lookups in one Drive batch request
+
+    lookups: {name: list_query(...)}. Returns {name: [files]}. Lookups that
+    fail inside the batch, or that need more pages, fall back to list_files
+    (with retries) on their own.
+    """
+    if not lookups:
+        return {}
+
+    responses = {}
+    failed = {}
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            failed[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    def send():
+        responses.clear()
+        failed.clear()
+        batch = service.new_batch_http_request(callback=callback)
+        for name, lookup in lookups.items():
+            page_size = lookup['limit'] or 100
+            batch.add(service.files().list(
+                q=lookup['q'],
+                fields=f"nextPageToken, files({lookup['fields']})",
+                orderBy=lookup['order_by'],
+                pageSize=min(page_size, 1000)
+            ), request_id=name)
+        batch.execute()
+
+    with_retries(send, tokens=len(lookups))
+
+    results = {}
+    for name, lookup in lookups.items():
+        response = responses.get(name)
+        needs_more = (
+            response is not None and response.get('nextPageToken')
+            and (lookup['limit'] is None or len(response.get('files', [])) < lookup['limit'])
+        )
+        if response is None or needs_more:
+            if name in failed and not is_retryable(failed[name]):
+                raise failed[name]
+            results[name] = list_files(
+                service, lookup['q'], lookup['fields'], lookup['order_by'], limit=lookup['limit']
+            )
+        else:
+            results[name] = response.get('files', [])
+    return results
+
+
+def folder_query(folder_name):
+    """Lookup for a folder by name"""
+    return list_query(f"name='{folder_name}' and mimeType='{FOLDER_MIME}'", 'id', limit=1)
+
+
+def file_query(folder_id, file_name):
+    """Lookup for the first file in a folder whose name contains file_name"""
+    return list_query(
+        f"'{folder_id}' in parents and name contains '{file_name}'",
+        'id, name, mimeType, modifiedTime, version', limit=1
+    )
+
+
+def latest_xlsx_query(folder_id):
+    """Lookup for the most recently modified .xlsx file in a folder"""
+    return list_query(
+        f"'{folder_id}' in parents and mimeType='{XLSX_MIME}'",
+        'id, name, mimeType, modifiedTime, version', order_by='modifiedTime desc', limit=1
+    )
+
+
+def catalog_query(folder_id, folder):
+    """Lookup for a configured folder's catalog: named file, or the latest xlsx
+    (the latest native Google Sheet with catalog_format 'sheet')"""
+    if folder.get('catalog_format') == 'sheet':
+        name = f" and name contains '{folder['catalog_name']}'" if folder.get('catalog_name') else ''
+        return list_query(
+            f"'{folder_id}' in parents and mimeType='{GOOGLE_SHEET_MIME}'{name}",
+            'id, name, mimeType, modifiedTime, version', order_by='modifiedTime desc', limit=1
+        )
+    if not folder.get('catalog_name'):
+        return latest_xlsx_query(folder_id)
+    return list_query(
+        f"'{folder_id}' in parents and name contains '{folder['catalog_name']}'",
+        'id, name, mimeType, modifiedTime, version', order_by='modifiedTime desc', limit=1
+    )
+
+
+def catalog_file(file_info, folder):
+    """A catalog lookup result with the folder's sheet tab attached (for fetch_file)"""
+    if file_info and folder.get('catalog_tab') is not None:
+        return dict(file_info, tab=str(folder['catalog_tab']))
+    return file_info
+
+
+def versions_query(folder_id, base_name, day):
+    """Lookup for every generated file with base_name from one day (with checksums)"""
+    return list_query(
+        f"'{folder_id}' in parents and name contains '{day}' and name contains '{base_name}'",
+        'id, name, md5Checksum'
+    )
+
+
+def first(files):
+    """First file of a lookup result, or None"""
+    return files[0] if files else None
+
+
+def find_folder(service, folder_name):
+    """Find folder by name"""
+    lookup = folder_query(folder_name)
+    folder = first(list_files(service, lookup['q'], lookup['fields'], limit=1))
+    return folder['id'] if folder else None
+
+
+def get_file(service, folder_id, file_name):
+    """Get file info from folder"""
+    lookup = file_query(folder_id, file_name)
+    return first(list_files(service, lookup['q'], lookup['fields'], limit=1))
+
+
+def find_catalog(service, folder_id, folder):
+    """Catalog file for a configured folder: named file, or the latest xlsx (or Sheet)"""
+    lookup = catalog_query(folder_id, folder)
+    return catalog_file(first(list_files(service, lookup['q'], lookup['fields'], lookup['order_by'], limit=1)), folder)
+
+
+def _export_prefix(file_info):
+    """Cache name prefix shared by every revision of one export (file id, plus tab)"""
+    tab = file_info.get('tab')
+    return f"{file_info['id']}#{tab}@" if tab is not None else f"{file_info['id']}@"
+
+
+def _export_cache_key(file_info):
+    """Cache key for one revision of a Google Doc/Sheet export (None without revision info)"""
+    revision = file_info.get('version') or file_info.get('modifiedTime')
+    if not revision:
+        return None
+    revision = str(revision).replace(':', '-')
+    _, extension = EXPORTS[file_info['mimeType']]
+    return f"{_export_prefix(file_info)}{revision}{extension}"
+
+
+def export_sheet_tab(service, file_id, tab, http=None):
+    """Export one tab (by gid) of a Google Sheet as CSV
+
+    The Drive export endpoint only exports a spreadsheet's first tab, so
+    other tabs go through the Sheets export URL with the same credentials.
+    """
+    http = http or service._http
+    url = f"{SHEETS_EXPORT_ROOT}/spreadsheets/d/{file_id}/export?format=csv&gid={tab}"
+
+    def fetch():
+        response, content = http.request(url)
+        if response.status != 200:
+            raise HttpError(response, content, uri=url)
+        return content
+
+    return io.BytesIO(with_retries(fetch))
+
+
+def download_file(service, file_id, mime_type, http=None):
+    """Download or export file (http overrides the service's connection)"""
+    fh = io.BytesIO()
+
+    if mime_type in EXPORTS:
+        export_mime, _ = EXPORTS[mime_type]
+        request = service.files().export_media(fileId=file_id, mimeType=export_mime)
+    else:
+        request = service.files().get_media(fileId=file_id)
+    if http is not None:
+        request.http = http
+
+    downloader = MediaIoBaseDownload(fh, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+    done = False
+    while not done:
+        status, done = with_retries(downloader.next_chunk)
+
+    fh.seek(0)
+    return fh
+
+
+def fetch_file(service, file_info, http=None):
+    """Download a file, serving Google Doc/Sheet exports from the export cache
+
+    Exporting a Doc to docx is much slower than a media download, so the
+    result is kept per revision (version, else modifiedTime) and only
+    re-exported once the Doc changes. Sheets are exported as CSV (the
+    first tab, or file_info['tab'] by gid, see catalog_file) and cached
+    the same way. The cache is the 'export' tier of shared_cache: with a
+    shared tier, one replica exports a revision and the others wait for it.
+    """
+    def download():
+        if file_info['mimeType'] == GOOGLE_SHEET_MIME and file_info.get('tab') is not None:
+            return export_sheet_tab(service, file_info['id'], file_info['tab'], http=http)
+        return download_file(service, file_info['id'], file_info['mimeType'], http=http)
+
+    key = _export_cache_key(file_info) if file_info['mimeType'] in EXPORTS else None
+    cache = cache_for('export', EXPORT_CACHE_DIR)
+    if key is None or cache is None:
+        return download()
+    return io.BytesIO(cache.get_or_fill(key, lambda: download().getvalue(), group=_export_prefix(file_info)))
+
+
+def download_files(service, files):
+    """Download several files concurrently, one connection per worker thread
+
+    files: {name: file info with 'id' and 'mimeType', plus 'version' or
+    'modifiedTime' so Google Doc/Sheet exports can come from the cache}. Returns
+    ({name: BytesIO}, {name: seconds}); the stage takes about as long as
+    the slowest file rather than the sum of all of them.
+    """
+    def fetch(file_info):
+        start = time.perf_counter()
+        handle = fetch_file(service, file_info, http=thread_http(service))
+        return handle, time.perf_counter() - start
+
+    if not files:
+        return {}, {}
+    with ThreadPoolExecutor(max_workers=len(files)) as pool:
+        futures = {name: pool.submit(fetch, file_info) for name, file_info in files.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    handles = {name: handle for name, (handle, seconds) in results.items()}
+    timings = {name: seconds for name, (handle, seconds) in results.items()}
+    return handles, timings
+
+
+def upload_document(service, folder_id, file_path):
+    """Upload document to Drive"""
+    file_metadata = {
+        'name': os.path.basename(file_path),
+        'parents': [folder_id]
+    }
+    media = MediaFileUpload(file_path, mimetype=DOCX_MIME)
+    file = execute(service.files().create(body=file_metadata, media_body=media, fields='id'))
+    return file.get('id')
@@ -1,32 +1,30 @@
-"""Simple feedback logger"""
+"""Simple feedback logger
+
+Feedback entries are appended to the segmented 'feedback' log (see
+log_store) instead of rewriting one ever-growing JSON file.
+"""
 
-import json
-import os
 from datetime import datetime
 
-FEEDBACK_FILE = 'feedback_log.json'
+from log_store import SegmentedLog, iter_legacy
 
-def load_feedback():
-    """Load existing feedback or create new one"""
-    if os.path.exists(FEEDBACK_FILE):
-        with open(FEEDBACK_FILE, 'r') as f:
-            return json.load(f)
-    return {'feedback': []}
+LOG_NAME = 'feedback'
+LEGACY_FEEDBACK_FILE = 'feedback_log.json'  # pre-segmented history (see log_store.legacy_path)
 
-def save_feedback(feedback_data):
-    """Save feedback to file"""
-    with open(FEEDBACK_FILE, 'w') as f:
-        json.dump(feedback_data, f, indent=2)
+_log = SegmentedLog(LOG_NAME, legacy=(LEGACY_FEEDBACK_FILE, 'feedback'))
 
 def add_feedback(message, last_query=None):
     """Add user feedback"""
-    feedback = load_feedback()
     entry = {
-        'id': len(feedback['feedback']) + 1,
+        'id': _log.next_id(),
         'timestamp': datetime.now().isoformat(),
         'message': message,
         'last_query': last_query
     }
-    feedback['feedback'].append(entry)
-    save_feedback(feedback)
+    _log.append(entry)
     return entry['id']
+
+def iter_feedback():
+    """Every retained feedback entry, oldest first"""
+    yield from iter_legacy(LEGACY_FEEDBACK_FILE, 'feedback')
+    yield from _log.iter_records()
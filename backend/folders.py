@@ -0,0 +1,75 @@
+"""Configured Drive folders (one per client catalog)
+
+Each folder key names a Drive folder plus the templates and catalog inside
+it. Keys come from the JSON file at FOLDERS_CONFIG (default folders.json)
+when it exists, otherwise from DEFAULT_FOLDERS:
+
+    {
+      "demo": {
+        "folder": "Automation Demo Folder",
+        "tasting_template": "TASTING SHEET",
+        "price_template": "Price list"
+      }
+    }
+
+catalog_name picks a catalog file by name; without it the most recently
+modified xlsx in the folder is used. With "catalog_format": "sheet" the
+catalog is a native Google Sheet instead (the latest one, or the one
+matching catalog_name), exported as CSV: its first tab, or the tab whose
+gid is given as catalog_tab.
+
+The file is parsed once and reloaded only when its mtime changes, so
+lookups on the request path cost a stat, not a read and parse.
+"""
+
+import json
+import os
+import threading
+
+CONFIG_FILE = os.getenv('FOLDERS_CONFIG', 'folders.json')
+DEFAULT_FOLDER = os.getenv('DEFAULT_FOLDER', 'demo')
+
+DEFAULT_FOLDERS = {
+    'demo': {
+        'folder': 'Automation Demo Folder',
+        'tasting_template': 'TASTING SHEET',
+        'price_template': 'Price list'
+    },
+    'dan_wine': {
+        'folder': 'dan_wine',
+        'tasting_template': 'template',
+        'catalog_name': 'product_data'
+    }
+}
+
+
+_lock = threading.Lock()
+_loaded = {'mtime': None, 'folders': DEFAULT_FOLDERS}  # mtime None: defaults (no file)
+
+
+def load_folders():
+    """Folder configuration (file if present, otherwise the defaults); don't modify the result"""
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime == _loaded['mtime']:
+        return _loaded['folders']
+
+    with _lock:
+        if mtime != _loaded['mtime']:
+            folders = DEFAULT_FOLDERS
+            if mtime is not None:
+                with open(CONFIG_FILE, 'r') as f:
+                    folders = json.load(f)
+            _loaded.update(mtime=mtime, folders=folders)
+        return _loaded['folders']
+
+
+def get_folder(key=None):
+    """Configuration for one folder key (the default folder when key is None)"""
+    folders = load_folders()
+    key = key or DEFAULT_FOLDER
+    if key not in folders:
+        raise ValueError(f"Unknown folder '{key}'. Configured: {', '.join(sorted(folders))}")
+    return dict(folders[key], key=key)
@@ -1,172 +1,64 @@
 """Generate wine tasting sheet for specific row indices"""
 
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
 from docx import Document
+from docx.oxml import parse_xml
 from docx.shared import Pt
-import pandas as pd
+from lxml import etree
+import atexit
+import hashlib
 import io
 import os
 import logging
 import sys
+import time
 from datetime import datetime
 import re
+import argparse
+import zipfile
+from catalog import read_catalog, build_display_fields
+from folders import get_folder
+from shared_catalog import attach
+from render_cache import template_cache, prune as prune_render_cache
+from drive import report_call_stats
+from storage import open_storage
+from tasting_blocks import copy_paragraph_with_formatting, split_template, render_wine_blocks
+from sharded_render import SHARD_SIZE, WINES_PER_DOCUMENT, generate_document_sharded
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
-SCOPES = ['https://www.googleapis.com/auth/drive']
-
-def authenticate():
-    """Load credentials from token.json"""
-    creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    return build('drive', 'v3', credentials=creds)
-
-def find_folder(service, folder_name):
-    """Find folder by name"""
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder'"
-    results = service.files().list(q=query, fields='files(id, name)').execute()
-    folders = results.get('files', [])
-    return folders[0]['id'] if folders else None
-
-def get_file(service, folder_id, file_name):
-    """Get file info from folder"""
-    query = f"'{folder_id}' in parents and name contains '{file_name}'"
-    results = service.files().list(q=query, fields='files(id, name, mimeType)').execute()
-    files = results.get('files', [])
-    return files[0] if files else None
-
-def get_latest_xlsx(service, folder_id):
-    """Get the most recently modified .xlsx file in folder"""
-    query = f"'{folder_id}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-    results = service.files().list(
-        q=query,
-        fields='files(id, name, mimeType, modifiedTime)',
-        orderBy='modifiedTime desc'
-    ).execute()
-    files = results.get('files', [])
-    return files[0] if files else None
-
-def download_file(service, file_id, mime_type):
-    """Download or export file"""
-    fh = io.BytesIO()
-
-    if mime_type == 'application/vnd.google-apps.document':
-        request = service.files().export_media(
-            fileId=file_id,
-            mimeType='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-        )
-    else:
-        request = service.files().get_media(fileId=file_id)
-
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-
-    fh.seek(0)
-    return fh
-
-def replace_placeholders(text, row, wine_num):
-    """Replace quoted placeholders with actual data"""
-    lq = chr(8220)
-    rq = chr(8221)
-
-    original_text = text
-
-    replacements = {
-        f'{lq}PRODUCER{rq}': str(row['PRODUCER']),
-        f'{lq}REGION_APPELLATION{rq}': str(row['REGION_APPELLATION']),
-        f'{lq}CUVEE_NAME{rq}': str(row['CUVEE_NAME']),
-        f'{lq}VINTAGE{rq}': str(int(row['VINTAGE'])) if pd.notna(row['VINTAGE']) and str(row['VINTAGE']).replace('.','').isdigit() else str(row['VINTAGE']) if pd.notna(row['VINTAGE']) else '',
-        f'{lq}BLEND_DETAILS{rq}': str(row['BLEND_DETAILS']),
-        f'{lq}PACKAGING{rq}': str(row['PACKAGING']),
-        f'{lq}STANDARD_PRICE{rq}': f"${row['STANDARD_PRICE']}"
-    }
-
-    if pd.notna(row['DISCOUNT_PRICE']):
-        replacements[f', {lq}DISCOUNTED_PRICE{rq}**'] = f", ${row['DISCOUNT_PRICE']}**"
-    else:
-        replacements[f', {lq}DISCOUNTED_PRICE{rq}**'] = ""
-
-    for placeholder, value in replacements.items():
-        if placeholder in text:
-            text = text.replace(placeholder, value)
-
-    if lq + 'PRODUCER' in original_text:
-        logger.info(f"\n--- Wine #{wine_num}: {row['PRODUCER']} ---")
-        logger.info(f"  Before: {original_text}")
-        logger.info(f"  After:  {text}")
-
-    return text
-
-def copy_paragraph_with_formatting(template_para, doc, row, wine_num):
-    """Copy paragraph preserving all formatting and replace placeholders"""
-    new_para = doc.add_paragraph()
-    new_para.style = template_para.style
-    new_para.paragraph_format.alignment = template_para.paragraph_format.alignment
-
-    for run in template_para.runs:
-        new_run = new_para.add_run()
-        new_run.text = replace_placeholders(run.text, row, wine_num)
-
-        new_run.bold = run.bold
-        new_run.italic = run.italic
-        new_run.underline = run.underline
-        new_run.font.name = run.font.name
-        new_run.font.size = run.font.size
-        new_run.font.color.rgb = run.font.color.rgb
+ZIP_TIMESTAMP = (1980, 1, 1, 0, 0, 0)  # earliest time a zip entry can carry
 
-    return new_para
-
-def generate_document(template_handle, sheet_handle, row_indices):
-    """Generate filled document from template and specific rows"""
+def generate_document(template_handle, wines):
+    """Generate filled document from template and precomputed wine display fields"""
+    cache = template_cache(template_handle.getvalue(), 'tasting')
     doc = Document(template_handle)
     logger.info(f"\n=== TEMPLATE LOADED ===")
+    logger.info(f"Selected {len(wines)} rows: {[wine['row'] for wine in wines]}")
 
-    df = pd.read_excel(sheet_handle)
-    logger.info(f"\n=== SHEET DATA ===")
-    logger.info(f"Total rows in sheet: {len(df)}")
-
-    # Filter to specified row indices
-    df = df.iloc[row_indices]
-    logger.info(f"Selected {len(df)} rows: {row_indices}")
-
-    logger.info(f"\n=== PROCESSING {len(df)} WINES ===")
-
-    # Get template paragraphs (handle templates with different lengths)
-    if len(doc.paragraphs) < 5:
-        wine_template_paras = doc.paragraphs[1:min(5, len(doc.paragraphs))]
-    else:
-        wine_template_paras = [doc.paragraphs[i] for i in range(1, 5)]
-
-    footer_idx = min(14, len(doc.paragraphs) - 1) if len(doc.paragraphs) > 14 else len(doc.paragraphs) - 1
-    footer_para_template = doc.paragraphs[footer_idx] if len(doc.paragraphs) > 0 else None
+    logger.info(f"\n=== PROCESSING {len(wines)} WINES ===")
 
-    # Delete placeholder content
-    for i in range(len(doc.paragraphs) - 1, 0, -1):
-        p = doc.paragraphs[i]
-        p._element.getparent().remove(p._element)
+    wine_template_paras, footer_para_template = split_template(doc)
 
     # Process each wine
-    for wine_num, (idx, row) in enumerate(df.iterrows(), 1):
-        for template_para in wine_template_paras:
-            copy_paragraph_with_formatting(template_para, doc, row, wine_num)
-
-        doc.add_paragraph()
-        doc.add_paragraph()
+    render_wine_blocks(doc, wine_template_paras, wines, cache=cache)
+    if cache is not None:
+        logger.info(f"Wine blocks: {cache.summary()}")
 
     # Add footer if template has one
     if footer_para_template:
-        copy_paragraph_with_formatting(footer_para_template, doc, df.iloc[0], 0)
+        copy_paragraph_with_formatting(footer_para_template, doc, wines[0], 0)
 
     logger.info(f"\n=== DOCUMENT COMPLETE ===")
     return doc
 
-def generate_price_list(template_handle, df):
-    """Generate price list from template and data"""
+def generate_price_list(template_handle, wines):
+    """Generate price list from template and precomputed wine display fields
+
+    Rows are cached like wine blocks (see render_wine_blocks).
+    """
+    cache = template_cache(template_handle.getvalue(), 'price')
     doc = Document(template_handle)
     logger.info(f"\n=== PRICE LIST TEMPLATE LOADED ===")
 
@@ -182,122 +74,218 @@ def generate_price_list(template_handle, df):
         table._element.remove(table.rows[i]._element)
 
     # Add a row for each wine
-    for idx, row in df.iterrows():
+    for wine in wines:
+        values = (wine['producer_line'], wine['standard_price'], wine['discount_price'])
+        if cache is not None:
+            fragments = cache.get(values)
+            if fragments is not None:
+                table._tbl.append(parse_xml(fragments[0]))
+                continue
+
         new_row = table.add_row()
 
-        # Column 0: Producer, Cuvee, Vintage, Blend, Region
-        producer_cell = new_row.cells[0]
-        producer_text = f"{row['PRODUCER']}\n"
-        producer_text += f"{row['CUVEE_NAME']}"
-        if pd.notna(row['VINTAGE']):
-            vintage_str = str(int(row['VINTAGE'])) if str(row['VINTAGE']).replace('.','').isdigit() else str(row['VINTAGE'])
-            producer_text += f" {vintage_str}"
-        producer_text += f"\n({row['BLEND_DETAILS']})\n"
-        producer_text += f"{row['REGION_APPELLATION']}"
-        producer_cell.text = producer_text
+        # Column 0: Producer, Cuvee + Vintage, (Blend), Region
+        new_row.cells[0].text = wine['producer_line']
 
         # Column 1: Standard Price
-        new_row.cells[1].text = f"${row['STANDARD_PRICE']}"
-
-        # Column 2: Discount Price
-        if pd.notna(row['DISCOUNT_PRICE']):
-            new_row.cells[2].text = f"${row['DISCOUNT_PRICE']}"
-        else:
-            new_row.cells[2].text = ""
+        new_row.cells[1].text = wine['standard_price']
 
-    logger.info(f"Added {len(df)} wines to price list")
-    return doc
+        # Column 2: Discount Price (empty when there is no discount)
+        new_row.cells[2].text = wine['discount_price']
 
-def get_timestamped_filename(service, folder_id, base_name, extension='.docx'):
-    """Generate timestamped filename with version number"""
-    today = datetime.now().strftime('%Y-%m-%d')
+        if cache is not None:
+            cache.put(values, [etree.tostring(new_row._tr)])
 
-    # List existing files in folder with same date and base name
-    query = f"'{folder_id}' in parents and name contains '{today}' and name contains '{base_name}'"
-    results = service.files().list(q=query, fields='files(name)').execute()
-    existing_files = results.get('files', [])
+    logger.info(f"Added {len(wines)} wines to price list")
+    if cache is not None:
+        logger.info(f"Price list rows: {cache.summary()}")
+    return doc
 
-    # Find highest version number
-    version = 1
+def latest_version(existing_files, today):
+    """Highest _vN among the day's files (0 when there are none)"""
+    version = 0
     for file in existing_files:
-        # Match pattern: base_name_YYYY-MM-DD_vN.docx
+        # Match pattern: base_name_YYYY-MM-DD_vN.docx (or _vN_partM.docx)
         match = re.search(rf'{today}_v(\d+)', file['name'])
         if match:
-            file_version = int(match.group(1))
-            if file_version >= version:
-                version = file_version + 1
-
-    return f"{base_name}_{today}_v{version}{extension}"
-
-def upload_document(service, folder_id, file_path):
-    """Upload document to Drive"""
-    file_metadata = {
-        'name': os.path.basename(file_path),
-        'parents': [folder_id]
-    }
-    media = MediaFileUpload(file_path, mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-    file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-    return file.get('id')
+            version = max(version, int(match.group(1)))
+    return version
+
+def versioned_filenames(base_name, today, version, parts, extension='.docx'):
+    """Filenames of one version; paginated output gets _partN suffixes"""
+    if parts == 1:
+        return [f"{base_name}_{today}_v{version}{extension}"]
+    return [f"{base_name}_{today}_v{version}_part{n}{extension}" for n in range(1, parts + 1)]
+
+def document_bytes(doc, today):
+    """Serialize a document reproducibly: same content, same bytes
+
+    python-docx stamps every zip entry with the current time. Entries are
+    rewritten with a fixed timestamp, and the core properties' dates are
+    pinned to the generation day, so regenerating an unchanged sheet gives
+    an identical file (and md5) for the rest of the day.
+    """
+    props = doc.core_properties
+    props.created = props.modified = datetime.strptime(today, '%Y-%m-%d')
+    props.revision = 1
+
+    raw = io.BytesIO()
+    doc.save(raw)
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(raw) as source, zipfile.ZipFile(output, 'w') as target:
+        for info in source.infolist():
+            entry = zipfile.ZipInfo(info.filename, date_time=ZIP_TIMESTAMP)
+            entry.compress_type = zipfile.ZIP_DEFLATED
+            entry.external_attr = info.external_attr
+            target.writestr(entry, source.read(info.filename))
+    return output.getvalue()
+
+def find_unchanged(existing_files, filenames, contents):
+    """The stored files named filenames if each one's md5Checksum matches contents, else None"""
+    by_name = {file['name']: file for file in existing_files}
+    files = [by_name.get(name) for name in filenames]
+    for file, data in zip(files, contents):
+        if file is None or file.get('md5Checksum') != hashlib.md5(data).hexdigest():
+            return None
+    return files
+
+def plan_versions(existing_files, base_name, today, contents):
+    """Filenames for the documents, plus the latest same-day version's stored files
+    when they are byte-identical (None when a new version is needed)"""
+    latest = latest_version(existing_files, today)
+    unchanged = find_unchanged(existing_files, versioned_filenames(base_name, today, latest, len(contents)), contents)
+    if unchanged:
+        return [file['name'] for file in unchanged], unchanged
+    return versioned_filenames(base_name, today, latest + 1, len(contents)), None
+
+def save_documents(directory, filenames, contents):
+    """Write serialized documents into directory; returns their paths"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for filename, data in zip(filenames, contents):
+        path = os.path.join(directory, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+    return paths
+
+def upload_documents(storage, folder_id, paths, unchanged, label):
+    """Upload a new version, or reuse the identical one already stored; returns the file ids"""
+    if unchanged:
+        for file in unchanged:
+            print(f"✓ Unchanged {label}: {file['name']} ({file['id']})")
+        return [file['id'] for file in unchanged]
+
+    file_ids = [storage.write(folder_id, path) for path in paths]
+    print(f"✓ Uploaded {label} to {storage.label}")
+    return file_ids
 
 if __name__ == '__main__':
-    # Get row indices from command line args
-    if len(sys.argv) < 2:
-        print("Usage: python generate_selected_wines.py ROW1 ROW2 ...")
-        sys.exit(1)
-
-    row_indices = [int(arg) for arg in sys.argv[1:]]
-
-    service = authenticate()
-    print("✓ Authenticated")
-
-    folder_id = find_folder(service, 'Automation Demo Folder')
-    print("✓ Found Automation Demo Folder")
-
-    # Download tasting sheet template
-    template_info = get_file(service, folder_id, 'TASTING SHEET')
-    template_handle = download_file(service, template_info['id'], template_info['mimeType'])
-    print("✓ Downloaded tasting sheet template")
-
-    # Download price list template
-    price_template_info = get_file(service, folder_id, 'Price list')
-    price_template_handle = download_file(service, price_template_info['id'], price_template_info['mimeType'])
-    print("✓ Downloaded price list template")
-
-    # Download product data
-    sheet_info = get_latest_xlsx(service, folder_id)
-    if not sheet_info:
-        print("✗ No Excel files found in folder")
-        sys.exit(1)
-    print(f"✓ Found latest Excel: {sheet_info['name']}")
-    sheet_handle = download_file(service, sheet_info['id'], sheet_info['mimeType'])
-    print("✓ Downloaded product data")
-
-    # Read full dataframe
-    df_full = pd.read_excel(sheet_handle)
-    df_selected = df_full.iloc[row_indices]
-
-    # Generate tasting sheet
-    sheet_handle.seek(0)  # Reset for reading again
-    tasting_doc = generate_document(template_handle, sheet_handle, row_indices)
-    print("✓ Generated tasting sheet")
-
-    # Generate price list
-    price_doc = generate_price_list(price_template_handle, df_selected)
-    print("✓ Generated price list")
-
-    # Save with timestamped filenames
-    tasting_filename = get_timestamped_filename(service, folder_id, 'Tasting_Sheet')
-    price_filename = get_timestamped_filename(service, folder_id, 'Price_List')
+    parser = argparse.ArgumentParser(description='Generate tasting sheet and price list for catalog rows')
+    parser.add_argument('rows', nargs='+', type=int, help='catalog row indices')
+    parser.add_argument('--folder', default=None, help='configured folder key (see folders.py)')
+    parser.add_argument('--catalog-revision', default=None,
+                        help='catalog revision the rows refer to; mapped from shared memory when published')
+    parser.add_argument('--download', default=None, metavar='DIR',
+                        help='write the documents into DIR and announce them before any upload')
+    parser.add_argument('--skip-upload', action='store_true', help="don't upload to storage")
+    args = parser.parse_args()
+    atexit.register(report_call_stats)  # merged into the API's Drive stats (see drive.CALL_STATS_PREFIX)
+
+    row_indices = args.rows
+    folder = get_folder(args.folder)
+
+    storage = open_storage()
+    print(f"✓ Connected to {storage.label}")
+
+    folder_id = storage.find_folder(folder['folder'])
+    print(f"✓ Found {folder['folder']}")
+
+    # Every other lookup is independent (one batch round trip on Drive)
+    today = datetime.now().strftime('%Y-%m-%d')
+    found = storage.find_generation_files(folder_id, folder, today)
+
+    # Rows from a published snapshot are mapped, not downloaded and parsed again
+    shared = attach(folder['key'], args.catalog_revision) if args.catalog_revision else None
+
+    # Download templates and product data concurrently (one download's latency, not three)
+    template_info = found['tasting_template']
+    sheet_info = found['catalog']
+    if shared is None:
+        if not sheet_info:
+            print("✗ No Excel files found in folder")
+            sys.exit(1)
+        print(f"✓ Found latest Excel: {sheet_info['name']}")
+
+    downloads = {'tasting_template': template_info}
+    if shared is None:
+        downloads['catalog'] = sheet_info
+    if folder.get('price_template'):
+        downloads['price_template'] = found['price_template']
+
+    download_start = time.perf_counter()
+    handles, timings = storage.read_many(downloads)
+    download_seconds = time.perf_counter() - download_start
+    template_handle = handles['tasting_template']
+    price_template_handle = handles.get('price_template')
+    details = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
+    print(f"✓ Downloaded {len(timings)} file(s) in {download_seconds:.2f}s ({details})")
+
+    if shared is not None:
+        logger.info(f"Total rows in shared catalog: {len(shared)}")
+        df_selected = shared.take(row_indices)
+    else:
+        # Read the catalog once (pruned columns, typed) and select the requested rows
+        df_full = read_catalog(handles['catalog'])
+        logger.info(f"Total rows in sheet: {len(df_full)}")
+        df_selected = df_full.iloc[row_indices]
 
-    tasting_doc.save(tasting_filename)
-    print(f"✓ Saved tasting sheet: {tasting_filename}")
+    # Compute all display strings once; both renderers share them
+    wines = build_display_fields(df_selected)
 
-    price_doc.save(price_filename)
-    print(f"✓ Saved price list: {price_filename}")
+    # Generate tasting sheet (sharded across processes for very large selections)
+    if len(wines) > SHARD_SIZE or WINES_PER_DOCUMENT:
+        tasting_docs = generate_document_sharded(template_handle.getvalue(), wines)
+    else:
+        tasting_docs = [generate_document(template_handle, wines)]
+    print("✓ Generated tasting sheet")
 
-    # Upload both to Drive
-    tasting_id = upload_document(service, folder_id, tasting_filename)
-    print(f"✓ Uploaded tasting sheet to Drive")
+    # Generate price list
+    price_doc = None
+    if price_template_handle:
+        price_doc = generate_price_list(price_template_handle, wines)
+        print("✓ Generated price list")
+
+    # Done with the templates and catalog (local reads are memory-mapped)
+    for handle in handles.values():
+        handle.close()
+
+    # Serialize reproducibly; an unchanged document reuses the latest same-day version
+    outputs = [('tasting sheet', 'Tasting_Sheet', found['tasting_versions'], tasting_docs)]
+    if price_doc:
+        outputs.append(('price list', 'Price_List', found['price_versions'], [price_doc]))
+
+    planned = []
+    for label, base_name, existing_files, docs in outputs:
+        contents = [document_bytes(doc, today) for doc in docs]
+        filenames, unchanged = plan_versions(existing_files, base_name, today, contents)
+        paths = []
+        if args.download or not unchanged:
+            paths = save_documents(args.download or '.', filenames, contents)
+            for filename in filenames:
+                if args.download:
+                    # The API turns these lines into download events (see jobs.DOWNLOAD_PREFIX)
+                    print(f"✓ Ready for download: {filename}", flush=True)
+                else:
+                    print(f"✓ Saved {label}: {filename}")
+        planned.append((label, paths, unchanged))
+
+    # Downloaded documents are already with the client; the upload happens behind it
+    if args.skip_upload:
+        print("✓ Skipped upload")
+    else:
+        for label, paths, unchanged in planned:
+            upload_documents(storage, folder_id, paths, unchanged, label)
 
-    price_id = upload_document(service, folder_id, price_filename)
-    print(f"✓ Uploaded price list to Drive")
+    prune_render_cache()
@@ -0,0 +1,26 @@
+"""Production server settings: gunicorn -c gunicorn.conf.py app:app
+
+One gevent worker serves every request cooperatively. Progress streams
+spend their life waiting on job events, so each one costs a greenlet, not a
+thread; generation itself runs in subprocesses and catalog parsing in
+gevent's OS thread pool (jobs.offload).
+
+A single worker is deliberate: catalog snapshots and the job registry live
+in process memory, and a reconnecting client must reach the worker that
+owns its job.
+"""
+
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_WORKERS', '1'))
+worker_class = 'gevent'
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+
+# Streams stay open for a whole generation; keepalive comments keep proxies happy
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
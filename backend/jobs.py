@@ -0,0 +1,405 @@
+"""Generation jobs and their progress events
+
+Each /api/generate-sheet request starts one job: a search_and_generate.py
+subprocess (the CPU-heavy rendering never runs in the API process) whose
+output a pump thread turns into a list of events. SSE responses only wait
+on a job's condition for new events, so under the gevent worker (see
+gunicorn.conf.py) an open progress stream is a parked greenlet rather than
+a blocked OS thread, and hundreds of them fit in one small worker.
+
+Finished jobs are kept for JOB_RETENTION_SECONDS so a client that
+reconnects can replay the stream from /api/jobs/<id>/events.
+
+A job is cancelled explicitly (/api/jobs/<id>/cancel) or when its last
+stream disconnects and nobody reattaches within JOB_DISCONNECT_GRACE_SECONDS.
+The subprocess runs in its own process group, so cancelling signals the
+whole pipeline (search, generation, render workers) at once.
+
+Admission control: at most GENERATION_CONCURRENCY pipelines run at once,
+and a new one is only started while MemAvailable stays above
+GENERATION_MIN_AVAILABLE_MB (unless nothing is running). Everything else
+waits in a bounded queue served round-robin across clients, so one client
+submitting many jobs can't starve the others. Queued streams get position
+events; once the queue is full submit_job() raises QueueFull with a retry
+hint.
+
+Direct-download jobs write their documents into the job's output
+directory and announce each one with a DOWNLOAD_PREFIX line, which becomes
+a {'download': filename} event. Once something has been delivered, a
+disconnect no longer cancels the job, so its deferred Drive upload
+finishes; the directory is removed with the job.
+
+The pipeline's Drive call outcomes arrive as one drive.CALL_STATS_PREFIX
+line, merged into the API's drive.call_stats (for /api/ready) rather
+than published as an event.
+"""
+
+import math
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from drive import CALL_STATS_PREFIX, call_stats
+
+RETENTION_SECONDS = float(os.getenv('JOB_RETENTION_SECONDS', '600'))
+KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
+DISCONNECT_GRACE_SECONDS = float(os.getenv('JOB_DISCONNECT_GRACE_SECONDS', '5'))
+KILL_AFTER_SECONDS = 10  # SIGKILL the group if SIGTERM hasn't ended it by then
+
+MAX_RUNNING = int(os.getenv('GENERATION_CONCURRENCY', '2'))
+MAX_QUEUED = int(os.getenv('GENERATION_QUEUE_SIZE', '20'))
+MAX_QUEUED_PER_CLIENT = int(os.getenv('GENERATION_QUEUE_PER_CLIENT', '3'))
+MIN_AVAILABLE_MB = float(os.getenv('GENERATION_MIN_AVAILABLE_MB', '400'))
+
+RECENT_OUTCOMES = 20  # finished generations kept for queue_stats' failure count
+
+DOWNLOAD_PREFIX = '✓ Ready for download: '  # printed by generate_selected_wines --download
+
+_lock = threading.Lock()  # guards _jobs, _queues, _running, _average_seconds and _outcomes
+_jobs = {}  # job id -> Job
+_queues = OrderedDict()  # client -> deque of queued jobs, next client to serve first
+_running = set()
+_average_seconds = 30.0  # moving average of generation time, for retry hints
+_outcomes = deque(maxlen=RECENT_OUTCOMES)  # (finished_at, success) of recent uncancelled jobs
+
+
+class QueueFull(Exception):
+    """The generation queue (or this client's share of it) is full"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Job:
+    """One generation subprocess and the events it has produced so far"""
+
+    def __init__(self, command, cwd=None, client=None, output_dir=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.cwd = cwd
+        self.client = client
+        self.output_dir = output_dir
+        self.files = []  # documents announced in output_dir
+        self.state = 'queued'  # queued -> running -> done
+        self.position = None
+        self.started_at = None
+        self.events = []
+        self.done = False
+        self.finished_at = None
+        self.condition = threading.Condition()
+        self.process = None
+        self.listeners = 0
+        self.cancelled = False
+
+    def publish(self, event):
+        """Append an event and wake every stream waiting on this job"""
+        with self.condition:
+            self.events.append(event)
+            if event.get('done'):
+                self.done = True
+                self.finished_at = time.time()
+            self.condition.notify_all()
+
+    def wait_events(self, after, timeout):
+        """Events after index `after`, waiting up to timeout for new ones"""
+        with self.condition:
+            if len(self.events) <= after and not self.done:
+                self.condition.wait(timeout)
+            return self.events[after:], self.done
+
+    def stream(self, after=0):
+        """Yield events as they arrive (None on keepalive timeouts) until the job is done
+
+        Closing the generator (the client went away) detaches the listener;
+        the job is cancelled if no stream is left after the grace period.
+        """
+        with self.condition:
+            self.listeners += 1
+        try:
+            while True:
+                events, done = self.wait_events(after, KEEPALIVE_SECONDS)
+                after += len(events)
+                for event in events:
+                    yield event
+                if done and not events:
+                    return
+                if not events:
+                    yield None
+        finally:
+            with self.condition:
+                self.listeners -= 1
+                abandoned = self.listeners == 0 and not self.done
+            if abandoned:
+                timer = threading.Timer(DISCONNECT_GRACE_SECONDS, self._cancel_if_abandoned)
+                timer.daemon = True
+                timer.start()
+
+    def _cancel_if_abandoned(self):
+        """Cancel unless a stream reattached during the grace period (or documents
+        were already delivered and only the upload is left)"""
+        with self.condition:
+            abandoned = self.listeners == 0 and not self.files
+        if abandoned:
+            self.cancel()
+
+    def _signal(self, signum):
+        """Send a signal to the job's whole process group"""
+        try:
+            os.killpg(self.process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def cancel(self):
+        """Stop the pipeline; returns False if the job had already finished"""
+        with self.condition:
+            if self.done or self.cancelled:
+                return False
+            self.cancelled = True
+            started = self.process is not None
+        if _withdraw(self):
+            self._finish({'done': True, 'success': False, 'cancelled': True, 'error': 'Generation cancelled'})
+            return True
+        if started:
+            self._terminate()
+        # otherwise it's being admitted right now; start() sees the flag once the process exists
+        return True
+
+    def _terminate(self):
+        """SIGTERM the pipeline, and SIGKILL it if it's still running KILL_AFTER_SECONDS later"""
+        self._signal(signal.SIGTERM)
+        timer = threading.Timer(KILL_AFTER_SECONDS, self._kill_if_running)
+        timer.daemon = True
+        timer.start()
+
+    def _kill_if_running(self):
+        """Last resort for a pipeline that ignored SIGTERM"""
+        if not self.done:
+            self._signal(signal.SIGKILL)
+
+    def _pump(self):
+        """Read the subprocess output into events (runs on its own thread/greenlet)"""
+        process = self.process
+        for line in iter(process.stdout.readline, ''):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(CALL_STATS_PREFIX):
+                call_stats.merge(line)
+                continue
+            event = {'message': line}
+            if line.startswith(DOWNLOAD_PREFIX) and self.output_dir:
+                event['download'] = line[len(DOWNLOAD_PREFIX):]
+                self.files.append(event['download'])
+            self.publish(event)
+
+        process.wait()
+        if self.cancelled:
+            self._finish({'done': True, 'success': False, 'cancelled': True, 'error': 'Generation cancelled'})
+        elif process.returncode == 0:
+            self._finish({'done': True, 'success': True})
+        else:
+            self._finish({'done': True, 'success': False, 'error': process.stderr.read()})
+
+    def _finish(self, event):
+        """Publish the final event and hand the slot to the next queued job"""
+        self.state = 'done'
+        self.publish(event)
+        _release(self, event.get('success', False))
+
+    def set_position(self, position):
+        """Tell the job's streams where it stands in the queue (only when it changes)"""
+        if position != self.position:
+            self.position = position
+            self.publish({
+                'queued': True,
+                'position': position,
+                'message': f"⏳ Waiting for a free slot (position {position} in queue)"
+            })
+
+    def start(self):
+        """Launch the subprocess and its pump (called once the job is admitted)"""
+        if self.cancelled:
+            self._finish({'done': True, 'success': False, 'cancelled': True, 'error': 'Generation cancelled'})
+            return self
+        self.started_at = time.time()
+        process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            cwd=self.cwd,
+            start_new_session=True  # own process group, see cancel()
+        )
+        with self.condition:
+            self.process = process
+            cancelled = self.cancelled
+        threading.Thread(target=self._pump, daemon=True).start()
+        if cancelled:
+            self._terminate()  # cancel() ran while the process was starting and left it to us
+        return self
+
+
+def _prune():
+    """Forget finished jobs older than the retention window (and their output)"""
+    cutoff = time.time() - RETENTION_SECONDS
+    with _lock:
+        expired = [j for j in _jobs.values() if j.done and j.finished_at < cutoff]
+        for job in expired:
+            del _jobs[job.id]
+    for job in expired:
+        if job.output_dir:
+            shutil.rmtree(job.output_dir, ignore_errors=True)
+
+
+def available_memory_mb():
+    """MemAvailable from /proc/meminfo in MB (None where it isn't available)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _memory_ok():
+    """Whether there's room for one more generation pipeline"""
+    available = available_memory_mb()
+    return available is None or available >= MIN_AVAILABLE_MB
+
+
+def _fair_order():
+    """Queued jobs in the order they'll be admitted (round-robin across clients)"""
+    order = []
+    queues = list(_queues.values())
+    depth = max((len(q) for q in queues), default=0)
+    for i in range(depth):
+        order.extend(q[i] for q in queues if i < len(q))
+    return order
+
+
+def _schedule():
+    """Admit queued jobs while there are free slots and memory, then update positions"""
+    admitted = []
+    with _lock:
+        while _queues and len(_running) < MAX_RUNNING:
+            if _running and not _memory_ok():
+                break
+            client, queue = next(iter(_queues.items()))
+            job = queue.popleft()
+            if queue:
+                _queues.move_to_end(client)
+            else:
+                del _queues[client]
+            job.state = 'running'
+            _running.add(job)
+            admitted.append(job)
+        order = _fair_order()
+
+    for job in admitted:
+        try:
+            job.start()
+        except Exception as e:
+            job._finish({'done': True, 'success': False, 'error': str(e)})
+    for position, job in enumerate(order, 1):
+        job.set_position(position)
+
+
+def _withdraw(job):
+    """Remove a job from the queue; False if it was already admitted"""
+    with _lock:
+        queue = _queues.get(job.client)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del _queues[job.client]
+    _schedule()
+    return True
+
+
+def _release(job, success):
+    """Free a finished job's slot, record its outcome and admit the next one"""
+    global _average_seconds
+    with _lock:
+        if job not in _running:
+            return
+        _running.discard(job)
+        if not job.cancelled:
+            _outcomes.append((job.finished_at, success))
+        if job.started_at and not job.cancelled:
+            _average_seconds = 0.8 * _average_seconds + 0.2 * (time.time() - job.started_at)
+    _schedule()
+
+
+def retry_after_seconds(queued):
+    """Rough wait until a slot frees up for a queue of this length"""
+    return max(1, math.ceil(_average_seconds * (queued + 1) / max(MAX_RUNNING, 1)))
+
+
+def submit_job(command, cwd=None, client=None, output_dir=None):
+    """Queue a generation for a client; it starts as soon as admission allows
+
+    Raises QueueFull when the queue, or the client's share of it, is full.
+    """
+    _prune()
+    with _lock:
+        queued = sum(len(q) for q in _queues.values())
+        if queued >= MAX_QUEUED:
+            raise QueueFull('Too many generations in progress, please retry shortly',
+                            retry_after_seconds(queued))
+        if len(_queues.get(client, ())) >= MAX_QUEUED_PER_CLIENT:
+            raise QueueFull('You already have generations waiting, please retry once they start',
+                            retry_after_seconds(queued))
+        job = Job(command, cwd, client, output_dir)
+        _jobs[job.id] = job
+        _queues.setdefault(client, deque()).append(job)
+    _schedule()
+    return job
+
+
+def queue_stats():
+    """Running and queued generation counts against their limits, plus recent outcomes"""
+    with _lock:
+        succeeded = [finished_at for finished_at, success in _outcomes if success]
+        return {
+            'running': len(_running),
+            'queued': sum(len(q) for q in _queues.values()),
+            'max_running': MAX_RUNNING,
+            'max_queued': MAX_QUEUED,
+            'utilization': round(len(_running) / MAX_RUNNING, 2) if MAX_RUNNING else None,
+            'average_seconds': round(_average_seconds, 1),
+            'recent': len(_outcomes),
+            'recent_failures': len(_outcomes) - len(succeeded),
+            'last_success_at': succeeded[-1] if succeeded else None
+        }
+
+
+def get_job(job_id):
+    """A running or recently finished job, or None"""
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def offload(func, *args):
+    """Run CPU-bound work off the event loop
+
+    Under gevent a long pandas/index build in a greenlet would stall every
+    other stream, so it goes to gevent's pool of real OS threads. Without
+    gevent (the development server) threads are already real; call directly.
+    """
+    try:
+        from gevent import monkey, get_hub
+    except ImportError:
+        return func(*args)
+    if not monkey.is_module_patched('threading'):
+        return func(*args)
+    return get_hub().threadpool.apply(func, args)
@@ -0,0 +1,285 @@
+"""Append-only segmented logs with rotation, compaction and retention
+
+Each log (sessions, feedback) is a directory of JSON-lines segments:
+
+    logs/<name>/active.jsonl              the only file writers touch
+    logs/<name>/segment-<time>.jsonl      rotated, waiting for compaction
+    logs/<name>/segment-<time>.jsonl.gz   compacted archive
+
+A write appends one line to active.jsonl under a file lock, so its cost
+doesn't grow with history. The active segment is rotated once it passes
+LOG_SEGMENT_MB or LOG_SEGMENT_HOURS. Closed segments are gzipped in the
+background (maintain(), run periodically by the API or from cron via
+`python log_store.py`), and archives older than LOG_RETENTION_DAYS are
+deleted. Readers iterate every retained segment oldest first.
+
+History from the old single-file logs (session_log.json, feedback_log.json)
+is read before the segments. Those files are moved from where they used to
+be written (LEGACY_LOG_DIR, the working directory) into LOG_DIR on first
+use, and the id counter starts after the highest id they and the segments
+hold, so new ids never collide with old ones.
+"""
+
+import fcntl
+import gzip
+import itertools
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+LOG_DIR = os.getenv('LOG_DIR', 'logs')
+SEGMENT_BYTES = int(float(os.getenv('LOG_SEGMENT_MB', '4')) * 1024 * 1024)
+SEGMENT_SECONDS = float(os.getenv('LOG_SEGMENT_HOURS', '24')) * 3600
+RETENTION_DAYS = float(os.getenv('LOG_RETENTION_DAYS', '365'))
+MAINTENANCE_SECONDS = float(os.getenv('LOG_MAINTENANCE_SECONDS', '300'))
+LEGACY_DIR = os.getenv('LEGACY_LOG_DIR', '.')
+
+ACTIVE = 'active.jsonl'
+READ_CHUNK = 64 * 1024
+
+
+class SegmentedLog:
+    """One named log: append records, rotate, compact, expire, read back"""
+
+    def __init__(self, name, directory=None, legacy=None):
+        self.name = name
+        self.directory = os.path.join(directory or LOG_DIR, name)
+        self.legacy = legacy  # (file name, array key) of the log's pre-segmentation history
+
+    @property
+    def active_path(self):
+        return os.path.join(self.directory, ACTIVE)
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock shared by every process writing this log"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _max_id(self):
+        """Highest record id in the legacy history and the segments (0 when there are none)"""
+        records = self.iter_records()
+        if self.legacy:
+            records = itertools.chain(iter_legacy(*self.legacy), records)
+        return max((r['id'] for r in records if isinstance(r.get('id'), int)), default=0)
+
+    def next_id(self):
+        """Next integer record id (a small counter file, not a scan of history)"""
+        with self._locked():
+            path = os.path.join(self.directory, 'next_id')
+            try:
+                with open(path) as f:
+                    value = int(f.read().strip() or 1)
+            except FileNotFoundError:
+                # First id of this log: continue after everything already recorded
+                value = self._max_id() + 1
+            with open(path, 'w') as f:
+                f.write(str(value + 1))
+            return value
+
+    def _needs_rotation(self):
+        try:
+            stat = os.stat(self.active_path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size >= SEGMENT_BYTES:
+            return True
+        # The segment-opened marker holds the time of the first write
+        try:
+            opened = os.stat(os.path.join(self.directory, '.opened')).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - opened >= SEGMENT_SECONDS
+
+    def _rotate(self):
+        """Close the active segment (caller holds the lock)"""
+        if not os.path.exists(self.active_path):
+            return
+        stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+        os.rename(self.active_path, os.path.join(self.directory, f'segment-{stamp}.jsonl'))
+        try:
+            os.remove(os.path.join(self.directory, '.opened'))
+        except FileNotFoundError:
+            pass
+
+    def append(self, record):
+        """Append one record to the active segment, rotating it first if it's due"""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._locked():
+            if self._needs_rotation():
+                self._rotate()
+            if not os.path.exists(self.active_path):
+                open(os.path.join(self.directory, '.opened'), 'w').close()
+            with open(self.active_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def segments(self):
+        """Retained segment files, oldest first (archives, closed segments, active)"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        closed = sorted(n for n in names if n.startswith('segment-'))
+        paths = [os.path.join(self.directory, n) for n in closed]
+        if ACTIVE in names:
+            paths.append(self.active_path)
+        return paths
+
+    def iter_records(self):
+        """Every retained record, oldest first, one line in memory at a time"""
+        for path in self.segments():
+            try:
+                handle = gzip.open(path, 'rt', encoding='utf-8') if path.endswith('.gz') else \
+                    open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:
+                # Compacted (or rotated) since we listed the directory
+                path = path + '.gz' if not path.endswith('.gz') else path
+                if not os.path.exists(path):
+                    continue
+                handle = gzip.open(path, 'rt', encoding='utf-8')
+            with handle:
+                for line in handle:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final line of a crashed writer
+
+    def compact(self):
+        """Gzip closed segments (and rotate an active segment that's overdue)"""
+        with self._locked():
+            if self._needs_rotation():
+                self._rotate()
+
+        for path in self.segments():
+            if not path.endswith('.jsonl') or path == self.active_path:
+                continue
+            tmp = f'{path}.gz.{os.getpid()}.tmp'
+            try:
+                with open(path, 'rb') as source, gzip.open(tmp, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                shutil.copystat(path, tmp)  # keep the mtime retention goes by
+                os.rename(tmp, f'{path}.gz')
+                os.remove(path)
+            except FileNotFoundError:
+                # Another process compacted it first
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def expire(self, days=None):
+        """Delete archives last written more than `days` ago"""
+        days = RETENTION_DAYS if days is None else days
+        if days <= 0:
+            return
+        cutoff = time.time() - days * 86400
+        for path in self.segments():
+            if path != self.active_path and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def maintain(self):
+        """Compaction plus retention"""
+        self.compact()
+        self.expire()
+
+
+def iter_json_array(path, key, chunk_size=READ_CHUNK):
+    """Yield the items of a {key: [...]} JSON file one at a time
+
+    Reads the file in chunks and decodes one array element at a time, so
+    only the current item (plus one chunk) is ever held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        # Skip to the start of the sessions array
+        while True:
+            match = re.search(rf'"{key}"\s*:\s*\[', buffer)
+            if match:
+                buffer = buffer[match.end():]
+                break
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer = buffer[-32:] + chunk
+
+        eof = False
+        while True:
+            buffer = buffer.lstrip(' \t\r\n,')
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    return  # truncated file: stop at the last complete item
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def legacy_path(file_name):
+    """Path of a pre-segmentation log in LOG_DIR, moved there from LEGACY_LOG_DIR if it's still there"""
+    path = os.path.join(LOG_DIR, file_name)
+    old_path = os.path.join(LEGACY_DIR, file_name)
+    if not os.path.exists(path) and os.path.isfile(old_path) and \
+            os.path.abspath(old_path) != os.path.abspath(path):
+        os.makedirs(LOG_DIR, exist_ok=True)
+        try:
+            shutil.move(old_path, path)
+        except FileNotFoundError:
+            pass  # another process moved it first
+    return path
+
+
+def iter_legacy(file_name, key):
+    """Items of a pre-segmentation {key: [...]} log (nothing if there is none)"""
+    path = legacy_path(file_name)
+    if os.path.isfile(path):
+        yield from iter_json_array(path, key)
+
+
+def maintain_all():
+    """Maintain every log under LOG_DIR"""
+    if not os.path.isdir(LOG_DIR):
+        return
+    for name in sorted(os.listdir(LOG_DIR)):
+        if os.path.isdir(os.path.join(LOG_DIR, name)):
+            SegmentedLog(name).maintain()
+
+
+def start_maintenance(run=maintain_all, interval=None):
+    """Run maintenance in a daemon thread every `interval` seconds"""
+    interval = MAINTENANCE_SECONDS if interval is None else interval
+
+    def loop():
+        while True:
+            try:
+                run()
+            except OSError as e:
+                print(f"Log maintenance failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    maintain_all()
+    print(f"✓ Compacted and expired logs in {LOG_DIR}")
@@ -0,0 +1,78 @@
+"""On-disk cache of rendered document fragments
+
+A wine block in the tasting sheet (or a row of the price list) depends only
+on the template and the wine's display strings, and the same popular wines
+appear in most sheets. Each rendered block is stored as its serialized body
+XML elements, keyed by (template revision, row content hash):
+
+    <dir>/<key[:2]>/<key>    the block's elements, NUL-separated
+
+The template revision is a digest of the template bytes, so editing the
+template (or switching folders) never serves stale blocks. Entries are
+written atomically and shared by every generation process; the least
+recently used ones are pruned once the cache passes RENDER_CACHE_MB.
+With SHARED_CACHE_URL the entries live in the shared cache tier instead
+(see shared_cache), so replicas reuse each other's blocks; a Redis tier is
+bounded by the server's own memory policy.
+"""
+
+import hashlib
+import json
+import os
+
+from shared_cache import FileCache, cache_for
+
+CACHE_DIR = os.getenv('RENDER_CACHE_DIR', 'render_cache')  # empty disables the cache
+CACHE_BYTES = int(float(os.getenv('RENDER_CACHE_MB', '256')) * 1024 * 1024)
+
+SEPARATOR = b'\0'  # never appears in XML
+
+
+class RenderCache:
+    """Fragments rendered from one template, looked up by a row's display values"""
+
+    def __init__(self, template_bytes, kind, directory=None):
+        self.store = FileCache(directory, fanout=True) if directory else store()
+        self.prefix = f"{kind}:{hashlib.sha1(template_bytes).hexdigest()}:"
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, values):
+        content = json.dumps(list(values), ensure_ascii=False)
+        return hashlib.sha1((self.prefix + content).encode('utf-8')).hexdigest()
+
+    def get(self, values):
+        """Cached fragments for a row, or None"""
+        data = self.store.get(self._key(values))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data.split(SEPARATOR)
+
+    def put(self, values, fragments):
+        """Store a row's fragments (best effort: a read-only or full disk just skips caching)"""
+        self.store.put(self._key(values), SEPARATOR.join(fragments))
+
+    def summary(self):
+        return f"{self.hits} cached, {self.misses} rendered"
+
+
+def store():
+    """This process's render cache tier (None when caching is disabled)"""
+    return cache_for('render', CACHE_DIR, fanout=True) if CACHE_DIR else None
+
+
+def template_cache(template_bytes, kind):
+    """RenderCache for a template, or None when caching is disabled"""
+    if store() is None:
+        return None
+    return RenderCache(template_bytes, kind)
+
+
+def prune(max_bytes=None, directory=None):
+    """Delete least recently used entries until the cache fits in max_bytes"""
+    max_bytes = CACHE_BYTES if max_bytes is None else max_bytes
+    cache = FileCache(directory, fanout=True) if directory else store()
+    if isinstance(cache, FileCache) and os.path.isdir(cache.directory):
+        cache.prune(max_bytes)
@@ -0,0 +1,203 @@
+"""Query parsing and wine matching shared by the API and the generation pipeline
+
+Query grammar (terms are OR'd together, filters narrow the result):
+
+    scopa                       word: producer, falling back to cuvee
+                                (a word prefix, so 'pep' finds 'pepiere')
+    "domaine de la pepiere"     quoted phrase, matched as whole words in order
+    both scopa / all realce     legacy quantifiers, same as the bare word
+    producer:"X"  cuvee:X       term restricted to one field
+    region:"Rioja"              region/appellation filter (several are OR'd)
+    vintage:2018..2021          vintage range (also 2018.., ..2019, 2018)
+    price<40  price:20..40      standard price range (<, <=, >, >=, :, =)
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from search_index import EMPTY, text_rows, substring_rows, range_rows
+
+FILLERS = ['the', 'from', 'by', 'a', 'an', 'and']
+QUANTIFIERS = ['both', 'all']
+
+FIELD_ALIASES = {
+    'producer': 'producer',
+    'cuvee': 'cuvee',
+    'region': 'region',
+    'appellation': 'region',
+    'vintage': 'vintage',
+    'year': 'vintage',
+    'price': 'price'
+}
+RANGE_FIELDS = ['vintage', 'price']
+
+TOKEN_RE = re.compile(r'''
+    (?P<field>[a-z_]+)\s*(?P<op><=|>=|<|>|:|=)\s*(?P<value>"[^"]*"|[^\s"<>=][^\s"]*)?
+  | "(?P<phrase>[^"]*)"
+  | (?P<word>[^\s"]+)
+''', re.VERBOSE | re.IGNORECASE)
+
+
+def _number(value, field):
+    """Parse a vintage or price bound ('$40' and '40' both work)"""
+    try:
+        return float(value.replace('$', '').replace(',', ''))
+    except ValueError:
+        raise ValueError(f"Invalid {field} value: '{value}'")
+
+
+def _range_filter(field, op, value):
+    """Turn 'price<40' or 'vintage:2018..2021' into a range filter"""
+    if value.strip('.') == '':
+        raise ValueError(f"Missing value for {field}")
+    label = f"{field}{op}{value}"
+    if op in ('<', '<='):
+        return {'field': field, 'low': None, 'high': _number(value, field),
+                'low_inclusive': True, 'high_inclusive': op == '<=', 'label': label}
+    if op in ('>', '>='):
+        return {'field': field, 'low': _number(value, field), 'high': None,
+                'low_inclusive': op == '>=', 'high_inclusive': True, 'label': label}
+
+    if '..' in value:
+        low, high = value.split('..', 1)
+    else:
+        low = high = value
+    return {'field': field,
+            'low': _number(low, field) if low else None,
+            'high': _number(high, field) if high else None,
+            'low_inclusive': True, 'high_inclusive': True, 'label': label}
+
+
+def parse_query(query):
+    """Parse a query into text terms, region filters and range filters"""
+    parsed = {'terms': [], 'regions': [], 'ranges': []}
+
+    for match in TOKEN_RE.finditer(query):
+        field = (match.group('field') or '').lower()
+
+        if field in FIELD_ALIASES:
+            field = FIELD_ALIASES[field]
+            op = match.group('op')
+            value = (match.group('value') or '').strip('"').strip()
+            if field in RANGE_FIELDS:
+                parsed['ranges'].append(_range_filter(field, op, value))
+            elif op not in (':', '='):
+                raise ValueError(f"'{op}' only works with vintage and price")
+            elif not value:
+                continue
+            elif field == 'region':
+                parsed['regions'].append(value)
+            else:
+                parsed['terms'].append({'text': value, 'field': field, 'prefix': False, 'label': f'{field}:"{value}"'})
+
+        elif match.group('phrase') is not None:
+            phrase = match.group('phrase').strip()
+            if phrase:
+                parsed['terms'].append({'text': phrase, 'field': None, 'prefix': False, 'label': f'"{phrase}"'})
+
+        else:
+            # Unknown 'name:value' tokens are just words
+            word = match.group(0).lower()
+            if word not in FILLERS and word not in QUANTIFIERS:
+                parsed['terms'].append({'text': word, 'field': None, 'prefix': True, 'label': word})
+
+    return parsed
+
+
+def describe_query(parsed):
+    """Human-readable list of everything a parsed query searches for"""
+    labels = [term['label'] for term in parsed['terms']]
+    labels += [f'region:"{region}"' for region in parsed['regions']]
+    labels += [r['label'] for r in parsed['ranges']]
+    return labels
+
+
+def _field_rows(index, field, text):
+    """Exact whole-word match on a field, falling back to a substring scan"""
+    rows = text_rows(index, field, text)
+    if len(rows) == 0:
+        rows = substring_rows(index, field, text)
+    return rows
+
+
+def _filter_rows(index, parsed):
+    """Rows allowed by the region and range filters (None = no filter)"""
+    allowed = None
+
+    if parsed['regions']:
+        allowed = EMPTY
+        for region in parsed['regions']:
+            allowed = np.union1d(allowed, _field_rows(index, 'region', region))
+
+    for r in parsed['ranges']:
+        rows = range_rows(index, r['field'], r['low'], r['high'], r['low_inclusive'], r['high_inclusive'])
+        allowed = rows if allowed is None else np.intersect1d(allowed, rows, assume_unique=True)
+
+    return allowed
+
+
+def run_query(index, parsed):
+    """Evaluate a parsed query against the search index
+
+    Returns one {'term', 'rows', 'fuzzy'} dict per text term (in query
+    order) with rows as catalog positions. fuzzy says the producer match
+    came up empty and the cuvee or substring fallback was used. A query
+    with only filters returns a single entry for the filters.
+    """
+    allowed = _filter_rows(index, parsed)
+
+    if not parsed['terms']:
+        if allowed is None:
+            return []
+        label = ' '.join(describe_query(parsed))
+        return [{'term': label, 'rows': allowed, 'fuzzy': False}]
+
+    results = []
+    for term in parsed['terms']:
+        fuzzy = False
+        if term['field']:
+            rows = _field_rows(index, term['field'], term['text'])
+        else:
+            rows = text_rows(index, 'producer', term['text'], term['prefix'])
+            if len(rows) == 0:
+                fuzzy = True
+                rows = text_rows(index, 'cuvee', term['text'], term['prefix'])
+            if len(rows) == 0:
+                rows = np.union1d(
+                    substring_rows(index, 'producer', term['text']),
+                    substring_rows(index, 'cuvee', term['text'])
+                )
+
+        if allowed is not None:
+            rows = np.intersect1d(rows, allowed, assume_unique=True)
+        results.append({'term': term['label'], 'rows': rows, 'fuzzy': fuzzy})
+
+    return results
+
+
+def matched_rows(results):
+    """Flatten run_query results into row positions (in match order, duplicates kept)"""
+    rows = []
+    for result in results:
+        rows.extend(int(r) for r in result['rows'])
+    return rows
+
+
+def wine_summary(df, rows):
+    """JSON-ready summary of catalog rows for previews"""
+    selected = df.iloc[rows]
+    summary = pd.DataFrame({
+        'key': selected['KEY'],
+        'row': selected.index,
+        'producer': selected['PRODUCER'],
+        'cuvee': selected['CUVEE_NAME'],
+        'vintage': selected['VINTAGE'],
+        'region': selected['REGION_APPELLATION'],
+        'packaging': selected['PACKAGING'],
+        'standard_price': selected['STANDARD_PRICE'],
+        'discount_price': selected['DISCOUNT_PRICE']
+    })
+    summary = summary.astype(object).where(summary.notna(), None)
+    return summary.to_dict('records')
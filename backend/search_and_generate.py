@@ -1,151 +1,153 @@
 """Search for wines and generate tasting sheet based on natural language query"""
 
+import os
 import sys
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import io
-import pandas as pd
+import json
+import signal
+import argparse
+import atexit
 import subprocess
+import tempfile
+import pandas as pd
+from catalog import read_catalog
+from folders import get_folder
+from drive import CALL_STATS_PREFIX, call_stats, report_call_stats
+from storage import open_storage
+from search import parse_query, describe_query, run_query
+from search_index import build_search_index
+from shared_catalog import attach
 from session_logger import start_session, log_message, end_session
 
-SCOPES = ['https://www.googleapis.com/auth/drive']
+class GenerationCancelled(Exception):
+    """The API cancelled this job (client disconnected or asked to cancel)"""
+
+# SIGTERM is deferred while the session log is being written so it can't be truncated
+_cancel = {'requested': False, 'deferred': False}
+
+def handle_sigterm(signum, frame):
+    """Turn the API's SIGTERM into GenerationCancelled at a safe point"""
+    _cancel['requested'] = True
+    if not _cancel['deferred']:
+        raise GenerationCancelled()
+
+def wine_line(row):
+    """'Producer - Cuvee (Vintage)' for the progress log; non-vintage wines read NV"""
+    vintage = row['VINTAGE'] if pd.notna(row['VINTAGE']) else 'NV'
+    return f"  • {row['PRODUCER']} - {row['CUVEE_NAME']} ({vintage})"
 
 def log_and_print(message, session_id=None):
     """Print message and log it"""
-    print(message)
-    sys.stdout.flush()
-    if session_id:
-        log_message(session_id, message)
-
-def authenticate():
-    creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    return build('drive', 'v3', credentials=creds)
-
-def find_folder(service, folder_name):
-    query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder'"
-    results = service.files().list(q=query, fields='files(id, name)').execute()
-    folders = results.get('files', [])
-    return folders[0]['id'] if folders else None
-
-def get_latest_xlsx(service, folder_id):
-    """Get the most recently modified .xlsx file in folder"""
-    query = f"'{folder_id}' in parents and mimeType='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'"
-    results = service.files().list(
-        q=query,
-        fields='files(id, name, mimeType, modifiedTime)',
-        orderBy='modifiedTime desc'
-    ).execute()
-    files = results.get('files', [])
-    return files[0] if files else None
-
-def download_xlsx(service, file_id):
-    request = service.files().get_media(fileId=file_id)
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
-    fh.seek(0)
-    return fh
-
-def search_producer(df, term):
-    """Search for producer by term (case-insensitive, partial match)"""
-    matches = df[df['PRODUCER'].str.contains(term, case=False, na=False)]
-    return matches
-
-def parse_query(query):
-    """Parse natural language query into producer terms"""
-    # Remove common filler words
-    fillers = ['the', 'from', 'by', 'a', 'an']
-    words = query.lower().split()
-
-    # Extract producers by looking for 'both X' or 'all X' patterns
-    producers = []
-    i = 0
-    while i < len(words):
-        word = words[i]
-
-        # Handle "both X" or "all X"
-        if word in ['both', 'all'] and i + 1 < len(words):
-            next_word = words[i + 1]
-            if next_word not in ['and']:
-                producers.append(next_word)
-                i += 2
-                continue
-
-        # Handle standalone terms (not filler, not 'and')
-        if word not in fillers and word != 'and':
-            producers.append(word)
-
-        i += 1
-
-    return producers
+    _cancel['deferred'] = True
+    try:
+        print(message)
+        sys.stdout.flush()
+        if session_id:
+            log_message(session_id, message)
+    finally:
+        _cancel['deferred'] = False
+    if _cancel['requested']:
+        raise GenerationCancelled()
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print("Usage: python search_and_generate.py <query>")
+    parser = argparse.ArgumentParser(description='Search the catalog and generate documents')
+    parser.add_argument('query', nargs='*', help='search query')
+    parser.add_argument('--keys-json', default=None,
+                        help='JSON list of confirmed row keys (from /api/search); skips the search')
+    parser.add_argument('--folder', default=None, help='configured folder key (see folders.py)')
+    parser.add_argument('--download', default=None, metavar='DIR',
+                        help='write the documents into DIR for direct download (announced as soon as they exist)')
+    parser.add_argument('--skip-upload', action='store_true', help="don't upload to storage (Drive or the local directory)")
+    args = parser.parse_args()
+
+    if not args.query and args.keys_json is None:
+        parser.print_usage()
         sys.exit(1)
 
-    query = ' '.join(sys.argv[1:])
+    query = ' '.join(args.query)
+    confirmed_keys = json.loads(args.keys_json) if args.keys_json is not None else None
+
+    atexit.register(report_call_stats)  # ours plus the generation child's, for the API (see jobs)
 
-    # Start logging session
-    session_id = start_session(query)
+    # Start logging session (a cancel arriving meanwhile is raised by the first log line)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    _cancel['deferred'] = True
+    try:
+        session_id = start_session(query)
+    finally:
+        _cancel['deferred'] = False
 
     try:
-        # Authenticate
-        log_and_print("🔐 Authenticating with Google Drive...", session_id)
-        service = authenticate()
-        log_and_print("✓ Authentication successful", session_id)
+        # Authenticate (Drive) or open the local storage directory
+        log_and_print("🔐 Connecting to storage...", session_id)
+        storage = open_storage()
+        log_and_print(f"✓ Connected to {storage.label}", session_id)
 
         # Find folder
-        log_and_print("📁 Finding Automation Demo Folder...", session_id)
-        folder_id = find_folder(service, 'Automation Demo Folder')
+        folder = get_folder(args.folder)
+        log_and_print(f"📁 Finding {folder['folder']}...", session_id)
+        folder_id = storage.find_folder(folder['folder'])
         log_and_print("✓ Folder found", session_id)
 
-        # Download product data (latest xlsx)
+        # Download product data (latest xlsx, or the folder's named catalog)
         log_and_print("📥 Finding latest Excel file...", session_id)
-        file_info = get_latest_xlsx(service, folder_id)
+        file_info = storage.find_catalog(folder_id, folder)
         if not file_info:
             log_and_print("❌ No Excel files found in folder!", session_id)
             end_session(session_id, success=False, error="No Excel files found")
             sys.exit(1)
         log_and_print(f"✓ Found: {file_info['name']}", session_id)
-        file_handle = download_xlsx(service, file_info['id'])
-        log_and_print("✓ Product data downloaded", session_id)
-
-        # Read Excel file
-        log_and_print("📖 Reading product data...", session_id)
-        df = pd.read_excel(file_handle)
-        log_and_print(f"✓ Loaded {len(df)} products", session_id)
+        # The API publishes each catalog revision it loads; map it instead of re-parsing when current
+        revision = f"{file_info['id']}@{file_info['modifiedTime']}"
+        shared = attach(folder['key'], revision)
+        if shared is not None:
+            log_and_print(f"✓ Using shared catalog snapshot ({len(shared)} products)", session_id)
+            take = shared.take
+            index = shared.index
+        else:
+            with storage.read(file_info) as file_handle:
+                log_and_print("✓ Product data downloaded", session_id)
 
-        # Parse query
-        log_and_print(f"🔍 Parsing query: '{query}'", session_id)
-        producer_terms = parse_query(query)
-        log_and_print(f"✓ Searching for: {', '.join(producer_terms)}", session_id)
+                # Read Excel file
+                log_and_print("📖 Reading product data...", session_id)
+                df = read_catalog(file_handle)
+            log_and_print(f"✓ Loaded {len(df)} products", session_id)
+            take = lambda rows: df.iloc[list(rows)]
+            index = None
 
         all_rows = []
 
-        for term in producer_terms:
-            log_and_print(f"🔎 Searching for '{term}'...", session_id)
-            matches = search_producer(df, term)
-
-            if len(matches) == 0:
-                log_and_print(f"  → No exact match, trying fuzzy search...", session_id)
-                # Try fuzzy search for similar names
-                for idx, row in df.iterrows():
-                    producer = str(row['PRODUCER']).lower()
-                    cuvee = str(row['CUVEE_NAME']).lower()
-                    if term in producer or term in cuvee:
-                        matches = pd.concat([matches, df.iloc[[idx]]])
-
-            if len(matches) > 0:
-                log_and_print(f"✓ Found {len(matches)} wine(s) for '{term}':", session_id)
-                for idx, row in matches.iterrows():
-                    log_and_print(f"  • {row['PRODUCER']} - {row['CUVEE_NAME']} ({row['VINTAGE']})", session_id)
-                    all_rows.append(idx)
-            else:
-                log_and_print(f"✗ No matches for '{term}'", session_id)
+        if confirmed_keys is not None:
+            log_and_print(f"✓ Using {len(confirmed_keys)} confirmed wine(s)", session_id)
+            rows_by_key = shared.rows_for_keys(confirmed_keys) if shared is not None else dict(zip(df['KEY'], df.index))
+            for key in confirmed_keys:
+                if key in rows_by_key:
+                    row = take([rows_by_key[key]]).iloc[0]
+                    log_and_print(wine_line(row), session_id)
+                    all_rows.append(rows_by_key[key])
+                else:
+                    log_and_print(f"✗ No longer in catalog: {key}", session_id)
+        else:
+            # Parse query
+            log_and_print(f"🔍 Parsing query: '{query}'", session_id)
+            parsed = parse_query(query)
+            log_and_print(f"✓ Searching for: {', '.join(describe_query(parsed))}", session_id)
+
+            if index is None:
+                index = build_search_index(df)
+            for result in run_query(index, parsed):
+                term = result['term']
+                matches = take(result['rows'])
+                log_and_print(f"🔎 Searching for '{term}'...", session_id)
+                if result['fuzzy']:
+                    log_and_print(f"  → No exact match, trying fuzzy search...", session_id)
+
+                if len(matches) > 0:
+                    log_and_print(f"✓ Found {len(matches)} wine(s) for '{term}':", session_id)
+                    for idx, row in matches.iterrows():
+                        log_and_print(wine_line(row), session_id)
+                        all_rows.append(idx)
+                else:
+                    log_and_print(f"✗ No matches for '{term}'", session_id)
 
         if not all_rows:
             log_and_print("❌ No wines found!", session_id)
@@ -154,29 +156,61 @@ if __name__ == '__main__':
 
         # Generate documents (tasting sheet + price list)
         log_and_print(f"\n📝 Generating documents for {len(all_rows)} wines...", session_id)
-        result = subprocess.run(
-            [sys.executable, 'generate_selected_wines.py'] + [str(r) for r in all_rows],
-            capture_output=True,
-            text=True
-        )
-
-        if result.returncode == 0:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'generate_selected_wines.py'),
+                   '--folder', folder['key'], '--catalog-revision', revision]
+        if args.download:
+            command += ['--download', args.download]
+        if args.skip_upload:
+            command += ['--skip-upload']
+        # stderr (the renderer's log) goes to a file so a full pipe can't stall the child
+        with tempfile.TemporaryFile(mode='w+') as stderr:
+            process = subprocess.Popen(command + [str(r) for r in all_rows],
+                                       stdout=subprocess.PIPE, stderr=stderr, text=True, bufsize=1)
+            output = []
+            for line in process.stdout:
+                if line.startswith(CALL_STATS_PREFIX):
+                    call_stats.merge(line)
+                    continue
+                output.append(line)
+                # Downloads are announced while the Drive upload is still running
+                if line.startswith('✓ Ready for download:'):
+                    log_and_print(line.rstrip('\n'), session_id)
+            process.wait()
+            stderr.seek(0)
+            error_output = stderr.read()
+
+        if process.returncode == 0:
             log_and_print("✓ Tasting sheet generated!", session_id)
             log_and_print("✓ Price list generated!", session_id)
             # Parse output to show filenames
-            for line in result.stdout.split('\n'):
+            for line in output:
+                line = line.rstrip('\n')
                 if 'Saved tasting sheet:' in line or 'Saved price list:' in line:
                     filename = line.split(': ')[-1]
                     log_and_print(f"  → {filename}", session_id)
-            log_and_print("✓ Both documents uploaded to Google Drive", session_id)
+                elif 'Unchanged tasting sheet:' in line or 'Unchanged price list:' in line:
+                    filename = line.split(': ')[-1]
+                    log_and_print(f"  → {filename} (unchanged, existing file reused)", session_id)
+            if args.skip_upload:
+                log_and_print("✓ Upload skipped", session_id)
+            else:
+                log_and_print(f"✓ Both documents are in {storage.label}", session_id)
             log_and_print("\n🎉 Done!", session_id)
             end_session(session_id, success=True)
         else:
-            error_msg = f"❌ Error: {result.stderr}"
+            error_msg = f"❌ Error: {error_output}"
             log_and_print(error_msg, session_id)
-            end_session(session_id, success=False, error=result.stderr)
+            end_session(session_id, success=False, error=error_output)
             sys.exit(1)
 
+    except GenerationCancelled:
+        # The generation child shares our process group and got the same signal
+        _cancel['deferred'] = True
+        print("🛑 Generation cancelled")
+        sys.stdout.flush()
+        end_session(session_id, success=False, error="Cancelled", cancelled=True)
+        sys.exit(1)
+
     except Exception as e:
         error_msg = f"❌ Exception: {str(e)}"
         log_and_print(error_msg, session_id)
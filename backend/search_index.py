@@ -0,0 +1,132 @@
+"""Precomputed search indexes over one catalog revision
+
+Text fields get token postings (normalized token -> sorted row ids) plus a
+sorted token list for prefix expansion of bare query words. Vintage and price get sorted
+value arrays so a range predicate is two binary searches.
+"""
+
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from typeahead import normalize_name
+
+TEXT_FIELDS = {
+    'producer': 'PRODUCER',
+    'cuvee': 'CUVEE_NAME',
+    'region': 'REGION_APPELLATION'
+}
+RANGE_FIELDS = {
+    'vintage': 'VINTAGE',
+    'price': 'STANDARD_PRICE'
+}
+
+EMPTY = np.array([], dtype=np.int64)
+
+
+def _build_text_field(values):
+    """Normalized values and token postings for one text column"""
+    normalized = np.array([normalize_name(v) if pd.notna(v) else '' for v in values], dtype=object)
+
+    postings = {}
+    for row, value in enumerate(normalized):
+        for token in set(value.split()):
+            postings.setdefault(token, []).append(row)
+
+    return {
+        'normalized': normalized,
+        'tokens': sorted(postings),
+        'postings': {token: np.array(rows, dtype=np.int64) for token, rows in postings.items()}
+    }
+
+
+def _build_range_field(values):
+    """Rows sorted by numeric value (non-numeric values such as 'NV' are left out)"""
+    numeric = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype='float64')
+    rows = np.flatnonzero(~np.isnan(numeric))
+    order = np.argsort(numeric[rows], kind='stable')
+    return {'values': numeric[rows][order], 'rows': rows[order]}
+
+
+def build_search_index(df):
+    """Build every index for one catalog revision (row ids are positions in df)"""
+    return {
+        'size': len(df),
+        'text': {field: _build_text_field(df[column].to_numpy()) for field, column in TEXT_FIELDS.items()},
+        'range': {field: _build_range_field(df[column].to_numpy()) for field, column in RANGE_FIELDS.items()}
+    }
+
+
+def _token_rows(field_index, token, prefix=False):
+    """Rows with the token (or, with prefix, with any token starting with it)"""
+    if not prefix:
+        return field_index['postings'].get(token, EMPTY)
+    tokens = field_index['tokens']
+    lo = bisect_left(tokens, token)
+    hi = bisect_left(tokens, token + '\uffff')
+    if hi - lo == 1:
+        return field_index['postings'][tokens[lo]]
+    if lo == hi:
+        return EMPTY
+    return np.unique(np.concatenate([field_index['postings'][t] for t in tokens[lo:hi]]))
+
+
+def _contains_phrase(words, tokens, prefix):
+    """Whether tokens appear consecutively in words (the last one as a prefix with prefix)"""
+    *head, last = tokens
+    for start in range(len(words) - len(tokens) + 1):
+        if words[start:start + len(head)] == head:
+            word = words[start + len(head)]
+            if word == last or (prefix and word.startswith(last)):
+                return True
+    return False
+
+
+def text_rows(index, field, text, prefix=False):
+    """Rows whose field contains text as whole words in order
+
+    With prefix (bare query words), the last word may be partial.
+    """
+    field_index = index['text'][field]
+    tokens = normalize_name(text).split()
+    if not tokens:
+        return EMPTY
+
+    candidates = _token_rows(field_index, tokens[-1], prefix)
+    for token in tokens[:-1]:
+        if len(candidates) == 0:
+            break
+        candidates = np.intersect1d(candidates, _token_rows(field_index, token), assume_unique=True)
+
+    if len(tokens) == 1 or len(candidates) == 0:
+        return candidates
+
+    # Postings only say every word is present; check they appear in order
+    normalized = field_index['normalized']
+    return np.array([r for r in candidates if _contains_phrase(normalized[r].split(), tokens, prefix)],
+                    dtype=np.int64)
+
+
+def substring_rows(index, field, text):
+    """Rows whose normalized field contains text anywhere (slow path for mid-word matches)"""
+    needle = normalize_name(text)
+    if not needle:
+        return EMPTY
+    normalized = index['text'][field]['normalized']
+    return np.flatnonzero(pd.Series(normalized).str.contains(needle, regex=False).to_numpy())
+
+
+def range_rows(index, field, low=None, high=None, low_inclusive=True, high_inclusive=True):
+    """Rows whose value lies in the given range (None = unbounded)"""
+    field_index = index['range'][field]
+    values = field_index['values']
+
+    start = 0
+    if low is not None:
+        start = np.searchsorted(values, low, side='left' if low_inclusive else 'right')
+    end = len(values)
+    if high is not None:
+        end = np.searchsorted(values, high, side='right' if high_inclusive else 'left')
+
+    return np.sort(field_index['rows'][start:end])
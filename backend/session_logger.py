@@ -1,57 +1,87 @@
-"""Simple session logger for tracking queries and messages"""
+"""Simple session logger for tracking queries and messages
+
+Sessions are written as events to the segmented 'sessions' log (see
+log_store): one line per start, message and end, so logging never
+rewrites history. iter_sessions() folds the events back into session
+dicts for the viewers.
+"""
 
-import json
-import os
 from datetime import datetime
 
-LOG_FILE = 'session_log.json'
+from log_store import SegmentedLog, iter_legacy
 
-def load_log():
-    """Load existing log or create new one"""
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'r') as f:
-            return json.load(f)
-    return {'sessions': []}
+LOG_NAME = 'sessions'
+LEGACY_LOG_FILE = 'session_log.json'  # pre-segmented history (see log_store.legacy_path)
 
-def save_log(log_data):
-    """Save log to file"""
-    with open(LOG_FILE, 'w') as f:
-        json.dump(log_data, f, indent=2)
+_log = SegmentedLog(LOG_NAME, legacy=(LEGACY_LOG_FILE, 'sessions'))
 
 def start_session(query):
     """Start a new session"""
-    log = load_log()
-    session = {
-        'id': len(log['sessions']) + 1,
+    session_id = _log.next_id()
+    _log.append({
+        'event': 'start',
+        'id': session_id,
         'timestamp': datetime.now().isoformat(),
-        'query': query,
-        'messages': [],
-        'success': None,
-        'error': None
-    }
-    log['sessions'].append(session)
-    save_log(log)
-    return session['id']
+        'query': query
+    })
+    return session_id
 
 def log_message(session_id, message):
     """Add a message to the session"""
-    log = load_log()
-    for session in log['sessions']:
-        if session['id'] == session_id:
-            session['messages'].append({
-                'timestamp': datetime.now().isoformat(),
-                'message': message
+    _log.append({
+        'event': 'message',
+        'id': session_id,
+        'timestamp': datetime.now().isoformat(),
+        'message': message
+    })
+
+def end_session(session_id, success=True, error=None, cancelled=False):
+    """Mark session as complete (or cancelled by the client)"""
+    _log.append({
+        'event': 'end',
+        'id': session_id,
+        'success': success,
+        'error': error,
+        'cancelled': cancelled,
+        'completed_at': datetime.now().isoformat()
+    })
+
+def iter_sessions():
+    """Every retained session, legacy history first, then in order of completion
+
+    Only sessions still open at the current point of the event stream are
+    held in memory; unfinished ones are yielded last.
+    """
+    yield from iter_legacy(LEGACY_LOG_FILE, 'sessions')
+
+    open_sessions = {}
+    for record in _log.iter_records():
+        event = record.get('event')
+        session_id = record.get('id')
+        if event == 'start':
+            open_sessions[session_id] = {
+                'id': session_id,
+                'timestamp': record.get('timestamp'),
+                'query': record.get('query'),
+                'messages': [],
+                'success': None,
+                'error': None
+            }
+        elif session_id not in open_sessions:
+            continue  # its start was expired by retention
+        elif event == 'message':
+            open_sessions[session_id]['messages'].append({
+                'timestamp': record.get('timestamp'),
+                'message': record.get('message')
             })
-            break
-    save_log(log)
-
-def end_session(session_id, success=True, error=None):
-    """Mark session as complete"""
-    log = load_log()
-    for session in log['sessions']:
-        if session['id'] == session_id:
-            session['success'] = success
-            session['error'] = error
-            session['completed_at'] = datetime.now().isoformat()
-            break
-    save_log(log)
+        elif event == 'end':
+            session = open_sessions.pop(session_id)
+            session.update(
+                success=record.get('success'),
+                error=record.get('error'),
+                cancelled=record.get('cancelled', False),
+                completed_at=record.get('completed_at')
+            )
+            yield session
+
+    yield from open_sessions.values()
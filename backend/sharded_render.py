@@ -0,0 +1,101 @@
+"""Sharded, multi-process rendering of tasting sheets for very large selections"""
+
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from docx import Document
+from lxml import etree
+
+from tasting_blocks import split_template, render_wine_blocks, copy_paragraph_with_formatting, append_fragments
+from render_cache import template_cache
+
+logger = logging.getLogger(__name__)
+
+# Selections up to this size render in-process; pool startup isn't worth it below
+SHARD_SIZE = int(os.getenv('RENDER_SHARD_SIZE', '100'))
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0')) or os.cpu_count() or 1
+# Split output into several documents of at most N wines each (0 = one document)
+WINES_PER_DOCUMENT = int(os.getenv('RENDER_WINES_PER_DOCUMENT', '0'))
+
+
+def shard(items, size):
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def render_shard(template_bytes, wines, first_wine_num):
+    """Render one shard's wine blocks and return them as body XML fragments
+
+    Runs in a worker process: loads its own copy of the template, renders
+    into the emptied body (through the shared render cache) and serializes
+    every new element except sectPr.
+    """
+    doc = Document(io.BytesIO(template_bytes))
+    wine_template_paras, _ = split_template(doc)
+
+    body = doc.element.body
+    header_count = len(body) - (1 if body.sectPr is not None else 0)
+
+    render_wine_blocks(doc, wine_template_paras, wines, first_wine_num,
+                       cache=template_cache(template_bytes, 'tasting'))
+
+    return [
+        etree.tostring(element)
+        for element in body[header_count:]
+        if element is not body.sectPr
+    ]
+
+
+def assemble_document(template_bytes, wines, fragments):
+    """Build the final document from the template header, rendered fragments and footer"""
+    doc = Document(io.BytesIO(template_bytes))
+    _, footer_para_template = split_template(doc)
+
+    for shard_fragments in fragments:
+        append_fragments(doc, shard_fragments)
+
+    if footer_para_template:
+        copy_paragraph_with_formatting(footer_para_template, doc, wines[0], 0)
+
+    return doc
+
+
+def generate_document_sharded(template_bytes, wines, shard_size=SHARD_SIZE,
+                              workers=RENDER_WORKERS, wines_per_document=WINES_PER_DOCUMENT):
+    """Render the tasting sheet in shards across a process pool
+
+    Returns a list of documents: one, or several of at most
+    wines_per_document wines each when pagination is configured. Pages are
+    cut from the wine list first and sharded within, so every page but the
+    last holds exactly wines_per_document wines; numbering runs on across pages.
+    """
+    pages = shard(wines, wines_per_document) if wines_per_document else [wines]
+
+    # (page, shard wines, number of the shard's first wine) for every shard of every page
+    tasks = []
+    first_num = 1
+    for page_index, page in enumerate(pages):
+        for page_shard in shard(page, shard_size):
+            tasks.append((page_index, page_shard, first_num))
+            first_num += len(page_shard)
+    logger.info(f"\n=== RENDERING {len(wines)} WINES IN {len(tasks)} SHARD(S), {len(pages)} DOCUMENT(S) ===")
+
+    if len(tasks) <= 1 or workers <= 1:
+        fragments = [render_shard(template_bytes, s, n) for _, s, n in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            fragments = list(pool.map(
+                render_shard,
+                [template_bytes] * len(tasks),
+                [s for _, s, _ in tasks],
+                [n for _, _, n in tasks]
+            ))
+
+    return [
+        assemble_document(template_bytes, page, [
+            shard_fragments for (index, _, _), shard_fragments in zip(tasks, fragments) if index == page_index
+        ])
+        for page_index, page in enumerate(pages)
+    ]
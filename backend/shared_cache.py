@@ -0,0 +1,366 @@
+"""Cache tier for downloaded blobs, catalog snapshots and rendered fragments
+
+Three caches hold work that is expensive to redo and identical wherever it
+is done: Google Doc/Sheet exports (drive.fetch_file), parsed and indexed
+catalog snapshots (catalog_store) and rendered document fragments
+(render_cache). cache_for(namespace) picks where each one lives:
+
+    SHARED_CACHE_URL unset          local directories, one per cache (the
+                                    snapshot cache is off: shared_catalog
+                                    already covers processes on one host)
+    SHARED_CACHE_URL=/mnt/cache     FileCache in <path>/<namespace>, e.g. a
+                                    volume mounted into every replica
+    SHARED_CACHE_URL=redis://h:6379/0
+                                    RedisCache, any server speaking the
+                                    Redis protocol
+
+get_or_fill() is single-flight: the first replica to miss takes a lock on
+the entry and fills it, the others wait for the entry instead of doing the
+same download or parse. A filler that dies loses its lock (flock is
+released with the process, Redis locks expire after
+SHARED_CACHE_LOCK_SECONDS) and a waiter takes over.
+
+The cache is best effort: an unreachable Redis or a full disk turns into
+misses and skipped writes, never into a failed request. Nothing read back
+is unpickled or executed (snapshots are .npz arrays, exports and fragments
+are parsed as documents), but entries are served as they are, so keep the
+tier private to the backend, like SHARED_CATALOG_DIR.
+
+bench_cache.py checks a tier end to end against a local Redis stand-in.
+"""
+
+import fcntl
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlparse, unquote
+
+CACHE_URL = os.getenv('SHARED_CACHE_URL', '')
+LOCK_SECONDS = float(os.getenv('SHARED_CACHE_LOCK_SECONDS', '120'))
+TTL_SECONDS = float(os.getenv('SHARED_CACHE_TTL_HOURS', '168')) * 3600  # Redis entries (0 = no expiry)
+TIMEOUT_SECONDS = float(os.getenv('SHARED_CACHE_TIMEOUT', '5'))
+
+KEY_PREFIX = 'fantasma:'
+POLL_SECONDS = (0.05, 0.5)  # waiter poll interval, doubling from the first to the second
+
+
+class SharedCache:
+    """Interface of a cache tier: bytes by string key, plus per-key fill locks
+
+    Keys are filesystem-safe names. group names a set of entries that
+    replace each other (revisions of one file): storing one drops the rest.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, value, group=None):
+        raise NotImplementedError
+
+    def acquire(self, key):
+        """Try to take the fill lock for key: a token, or None if someone else holds it"""
+        raise NotImplementedError
+
+    def release(self, key, token):
+        raise NotImplementedError
+
+    def get_or_fill(self, key, fill, group=None):
+        """The cached value for key, calling fill() (which returns bytes) on one replica only"""
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        # Past the lock's expiry, so a dead filler's lock is taken over before giving up on it
+        deadline = time.time() + LOCK_SECONDS + 2 * POLL_SECONDS[1]
+        delay = POLL_SECONDS[0]
+        while True:
+            token = self.acquire(key)
+            if token is not None:
+                try:
+                    value = self.get(key)  # filled while we were waiting for the lock
+                    if value is None:
+                        value = fill()
+                        self.put(key, value, group)
+                    return value
+                finally:
+                    self.release(key, token)
+
+            time.sleep(delay)
+            delay = min(delay * 2, POLL_SECONDS[1])
+            value = self.get(key)
+            if value is not None:
+                return value
+            if time.time() > deadline:
+                return fill()  # the filler looks stuck; don't wait on it forever
+
+
+class FileCache(SharedCache):
+    """Entries as files in a directory: <dir>/<key>, or <dir>/<key[:2]>/<key> with fanout
+
+    Writes go to a temporary file renamed into place, so readers on any
+    replica see whole entries or nothing. Fill locks are flock()s on
+    <entry>.lock, removed on release. Reads bump the mtime, which prune()
+    goes by.
+    """
+
+    def __init__(self, directory, fanout=False):
+        self.directory = directory
+        self.fanout = fanout
+
+    def _path(self, key):
+        if self.fanout:
+            return os.path.join(self.directory, key[:2], key)
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # recency for pruning
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value, group=None):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if group is not None:
+            self._drop_group(os.path.dirname(path), group, os.path.basename(path))
+
+    def _drop_group(self, directory, group, keep):
+        """Remove the other entries of a group (they share the group as a name prefix)"""
+        for name in os.listdir(directory):
+            if name.startswith(group) and name != keep and not name.endswith(('.tmp', '.lock')):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def acquire(self, key):
+        path = self._path(key) + '.lock'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock = open(path, 'a')
+        except OSError:
+            return False  # can't lock here: fill without single-flight
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    def release(self, key, token):
+        if token:
+            # The entry is written by now, so a process that still locks the
+            # unlinked file finds it on its re-check and doesn't fill again
+            try:
+                os.remove(token.name)
+            except OSError:
+                pass
+            fcntl.flock(token, fcntl.LOCK_UN)
+            token.close()
+
+    def entries(self):
+        """(mtime, size, path) of every entry, for pruning"""
+        found = []
+        directories = [self.directory]
+        if self.fanout and os.path.isdir(self.directory):
+            directories = [entry.path for entry in os.scandir(self.directory) if entry.is_dir()]
+        for directory in directories:
+            try:
+                listing = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in listing:
+                if entry.name.endswith(('.tmp', '.lock')) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def prune(self, max_bytes):
+        """Delete least recently used entries until the directory fits in max_bytes"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+class RedisError(Exception):
+    """An error reply from the server"""
+
+
+# Delete the lock only if it's still ours (it may have expired and been taken since)
+RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class RedisCache(SharedCache):
+    """Entries in a Redis-protocol server under <KEY_PREFIX><namespace>:<key>
+
+    Speaks RESP directly over one socket per thread (no client library;
+    needs Redis 6.2 or a compatible server for SET ... GET).
+    Fill locks are SET NX PX keys holding a random token; a group keeps
+    its current key under <namespace>:group:<group> so the previous
+    revision can be deleted. Entries expire after SHARED_CACHE_TTL_HOURS;
+    size limits are the server's (maxmemory with an LRU policy).
+    """
+
+    def __init__(self, url, namespace):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.prefix = f"{KEY_PREFIX}{namespace}:"
+        self._local = threading.local()
+        self._down = False  # report an outage once, not on every lookup
+
+    def _connect(self):
+        conn = socket.create_connection((self.host, self.port), timeout=TIMEOUT_SECONDS)
+        self._local.conn = conn
+        self._local.reader = conn.makefile('rb')
+        if self.password:
+            self._send('AUTH', self.password)
+        if self.db:
+            self._send('SELECT', self.db)
+
+    def _read_reply(self):
+        reader = self._local.reader
+        line = reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by the cache server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply from the cache server: {line[:40]!r}")
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self._local.conn.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def command(self, *args):
+        """Send one command and return its reply (reconnecting once on a dropped connection)"""
+        for attempt in range(2):
+            try:
+                if getattr(self._local, 'conn', None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt:
+                    raise
+
+    def _close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+        self._local.conn = None
+
+    def _best_effort(self, *args):
+        """command(), with an unreachable or failing server treated as a miss (and reported once)"""
+        try:
+            reply = self.command(*args)
+        except (OSError, RedisError) as e:
+            if not self._down:
+                print(f"Shared cache unavailable ({self.host}:{self.port}): {e}", file=sys.stderr)
+            self._down = True
+            return None
+        self._down = False
+        return reply
+
+    def get(self, key):
+        return self._best_effort('GET', self.prefix + key)
+
+    def put(self, key, value, group=None):
+        expiry = ('PX', int(TTL_SECONDS * 1000)) if TTL_SECONDS > 0 else ()
+        if self._best_effort('SET', self.prefix + key, value, *expiry) is None:
+            return
+        if group is not None:
+            previous = self._best_effort('SET', f"{self.prefix}group:{group}", key, *expiry, 'GET')
+            if previous is not None and previous.decode() != key:
+                self._best_effort('DEL', self.prefix + previous.decode())
+
+    def acquire(self, key):
+        token = uuid.uuid4().hex
+        try:
+            reply = self.command('SET', f"{self.prefix}lock:{key}", token, 'NX', 'PX', int(LOCK_SECONDS * 1000))
+        except (OSError, RedisError):
+            return False  # no server to coordinate through: fill without single-flight
+        return token if reply == 'OK' else None
+
+    def release(self, key, token):
+        if token:
+            self._best_effort('EVAL', RELEASE_SCRIPT, 1, f"{self.prefix}lock:{key}", token)
+
+
+_lock = threading.Lock()
+_backends = {}  # (namespace, directory, fanout) -> backend, one per process
+
+
+def cache_for(namespace, directory=None, fanout=False):
+    """The cache tier for one namespace ('export', 'render', 'snapshot')
+
+    directory is where the cache lives without SHARED_CACHE_URL (None or
+    empty: no local cache, returns None). fanout spreads a FileCache over
+    256 subdirectories, for caches with many entries.
+    """
+    with _lock:
+        spec = (namespace, directory, fanout)
+        if spec not in _backends:
+            if CACHE_URL.startswith('redis://'):
+                backend = RedisCache(CACHE_URL, namespace)
+            elif CACHE_URL:
+                root = CACHE_URL[len('file://'):] if CACHE_URL.startswith('file://') else CACHE_URL
+                backend = FileCache(os.path.join(root, namespace), fanout)
+            else:
+                backend = FileCache(directory, fanout) if directory else None
+            _backends[spec] = backend
+        return _backends[spec]
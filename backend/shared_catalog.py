@@ -0,0 +1,421 @@
+"""Catalog snapshots published as memory-mapped files for worker processes
+
+The API process publishes every catalog revision it loads (see
+catalog_store) into SHARED_CATALOG_DIR, /dev/shm by default so the pages
+live in shared memory. Generation subprocesses attach with
+np.load(mmap_mode='r') instead of downloading and parsing the xlsx again:
+every process maps the same read-only pages, and a worker only decodes
+the handful of rows it actually renders.
+
+Layout, one directory per revision (Arrow-style columnar buffers stored as
+plain .npy files):
+
+    <dir>/<folder>/current                   active revision directory name
+    <dir>/<folder>/<revision>/manifest.json  row count, columns, revision
+    <dir>/<folder>/<revision>/<name>.data.npy, .offsets.npy, .valid.npy
+                                             strings: utf-8 bytes + offsets
+    <dir>/<folder>/<revision>/<name>.npy     numeric columns, index arrays
+
+The search index is stored the same way (tokens and normalized values as
+strings, postings as one row array plus per-token offsets), and
+attach() returns it in the shape search_index expects.
+
+pack_snapshot() / unpack_snapshot() put the same buffers (plus the
+typeahead and change summary) into one .npz payload for the shared cache
+tier. Loading it never unpickles anything, so a cache entry can at worst
+be wrong data, not code.
+"""
+
+import io
+import json
+import os
+import re
+import shutil
+import zipfile
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+from catalog import TEXT_COLUMNS, PRICE_COLUMNS, OPTIONAL_COLUMNS
+from search_index import TEXT_FIELDS, RANGE_FIELDS, EMPTY
+
+SHARED_DIR = os.getenv(
+    'SHARED_CATALOG_DIR',
+    '/dev/shm/fantasma_catalog' if os.path.isdir('/dev/shm') else 'shared_catalog'
+)
+
+STRING_COLUMNS = TEXT_COLUMNS + ['VINTAGE', 'KEY'] + OPTIONAL_COLUMNS
+
+
+def revision_dir_name(revision):
+    """Filesystem-safe directory name for a revision ('id@modifiedTime')"""
+    return re.sub(r'[^A-Za-z0-9_.@-]', '-', revision)
+
+
+def _map(directory, name):
+    """Map a .npy file read-only (as a plain ndarray view: memmap indexing is much slower)"""
+    return np.asarray(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+
+
+class MappedStrings:
+    """Read-only sequence of strings over mapped utf-8 bytes + offsets (None = missing)"""
+
+    def __init__(self, directory, name):
+        self.data = _map(directory, f'{name}.data')
+        self.offsets = _map(directory, f'{name}.offsets')
+        self.valid = _map(directory, f'{name}.valid')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if not self.valid.item(i):
+            return None
+        return self.data[self.offsets.item(i):self.offsets.item(i + 1)].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(list(self), dtype=object)
+
+    def take(self, rows):
+        """Decode only the given rows"""
+        return [self[r] for r in rows]
+
+
+class MappedPostings:
+    """token -> sorted row ids, backed by one mapped row array and per-token offsets"""
+
+    def __init__(self, tokens, rows, offsets):
+        self.tokens = tokens
+        self.rows = rows
+        self.offsets = offsets
+        self._next = 0  # prefix expansion asks for consecutive tokens; try the next one first
+
+    def _position(self, token):
+        i = self._next
+        if not (i < len(self.tokens) and self.tokens[i] == token):
+            i = bisect_left(self.tokens, token)
+        return i
+
+    def __getitem__(self, token):
+        i = self._position(token)
+        if i == len(self.tokens) or self.tokens[i] != token:
+            raise KeyError(token)
+        self._next = i + 1
+        return self.rows[self.offsets.item(i):self.offsets.item(i + 1)]
+
+    def __contains__(self, token):
+        i = self._position(token)
+        return i < len(self.tokens) and self.tokens[i] == token
+
+    def get(self, token, default=None):
+        try:
+            return self[token]
+        except KeyError:
+            return default
+
+
+class SortedKeys:
+    """Sequence view of catalog keys in sorted order (for bisect lookups)"""
+
+    def __init__(self, keys, order):
+        self.keys = keys
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.keys[self.order.item(i)]
+
+
+class SharedCatalog:
+    """A published catalog revision attached read-only from its mapped files"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.revision = self.manifest['revision']
+        self.columns = self.manifest['columns']
+
+        self._strings = {c: MappedStrings(directory, c) for c in self.columns if c in STRING_COLUMNS}
+        self._numbers = {c: self._load(c) for c in self.columns if c in PRICE_COLUMNS}
+        self._sorted_keys = SortedKeys(self._strings['KEY'], self._load('KEY.order'))
+
+        self.index = {
+            'size': len(self),
+            'text': {
+                field: {
+                    'normalized': MappedStrings(directory, f'index.{field}.normalized'),
+                    'tokens': MappedStrings(directory, f'index.{field}.tokens'),
+                }
+                for field in TEXT_FIELDS
+            },
+            'range': {
+                field: {
+                    'values': self._load(f'index.{field}.values'),
+                    'rows': self._load(f'index.{field}.rows')
+                }
+                for field in RANGE_FIELDS
+            }
+        }
+        for field, field_index in self.index['text'].items():
+            field_index['postings'] = MappedPostings(
+                field_index['tokens'],
+                self._load(f'index.{field}.postings'),
+                self._load(f'index.{field}.postings_offsets')
+            )
+
+    def _load(self, name):
+        return _map(self.directory, name)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def take(self, rows):
+        """DataFrame of just these rows, typed like read_catalog (index = row positions)"""
+        rows = [int(r) for r in rows]
+        data = {}
+        for column in self.columns:
+            if column in self._strings:
+                data[column] = pd.array(self._strings[column].take(rows), dtype='string')
+            else:
+                data[column] = np.asarray(self._numbers[column][rows], dtype='float64')
+        return pd.DataFrame(data, index=pd.Index(rows))
+
+    def rows_for_keys(self, keys):
+        """{key: row} for the keys present in this revision"""
+        found = {}
+        for key in keys:
+            i = bisect_left(self._sorted_keys, key)
+            if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+                found[key] = self._sorted_keys.order.item(i)
+        return found
+
+
+def _save(directory, name, array):
+    np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+
+
+def _encode_strings(values):
+    """Strings as {'data': utf-8 bytes, 'offsets': int64, 'valid': mask} arrays"""
+    valid = np.array([v is not None and not pd.isna(v) for v in values], dtype=bool)
+    encoded = [str(v).encode('utf-8') if ok else b'' for v, ok in zip(values, valid)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return {'data': np.frombuffer(b''.join(encoded), dtype=np.uint8), 'offsets': offsets, 'valid': valid}
+
+
+def _decode_strings(data, offsets, valid):
+    """Inverse of _encode_strings: a list of str (None where missing)"""
+    text = data.tobytes()
+    bounds = offsets.tolist()
+    return [text[bounds[i]:bounds[i + 1]].decode('utf-8') if ok else None for i, ok in enumerate(valid.tolist())]
+
+
+def _save_strings(directory, name, values):
+    """Write strings as utf-8 bytes + int64 offsets + validity mask"""
+    for part, array in _encode_strings(values).items():
+        _save(directory, f'{name}.{part}', array)
+
+
+def _write_revision(directory, snapshot):
+    """Write one snapshot's catalog columns and search index into directory"""
+    df = snapshot['df']
+    columns = [c for c in df.columns if c in STRING_COLUMNS or c in PRICE_COLUMNS]
+
+    for column in columns:
+        if column in STRING_COLUMNS:
+            _save_strings(directory, column, df[column].tolist())
+        else:
+            _save(directory, column, df[column].to_numpy(dtype='float64'))
+    _save(directory, 'KEY.order', np.argsort(df['KEY'].to_numpy(dtype=object), kind='stable').astype(np.int64))
+
+    index = snapshot['index']
+    for field, field_index in index['text'].items():
+        tokens = field_index['tokens']
+        postings = [field_index['postings'][t] for t in tokens]
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in postings], out=offsets[1:])
+        _save_strings(directory, f'index.{field}.normalized', list(field_index['normalized']))
+        _save_strings(directory, f'index.{field}.tokens', tokens)
+        _save(directory, f'index.{field}.postings', np.concatenate(postings) if postings else EMPTY)
+        _save(directory, f'index.{field}.postings_offsets', offsets)
+    for field, field_index in index['range'].items():
+        _save(directory, f'index.{field}.values', field_index['values'])
+        _save(directory, f'index.{field}.rows', field_index['rows'])
+
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump({'revision': snapshot['revision'], 'rows': len(df), 'columns': columns}, f)
+
+
+def publish(folder_key, snapshot):
+    """Publish a snapshot for worker processes and make it the folder's current revision
+
+    Written to a temp directory and renamed into place, so readers never see
+    a partial revision. Older revisions are removed; processes that still
+    have them mapped keep reading the unlinked pages until they exit.
+    """
+    folder_dir = os.path.join(SHARED_DIR, folder_key)
+    name = revision_dir_name(snapshot['revision'])
+    target = os.path.join(folder_dir, name)
+
+    if not os.path.isdir(target):
+        tmp = os.path.join(folder_dir, f'.{name}.{os.getpid()}.tmp')
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            _write_revision(tmp, snapshot)
+            os.rename(tmp, target)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(target):
+                raise
+
+    current_tmp = os.path.join(folder_dir, f'.current.{os.getpid()}.tmp')
+    with open(current_tmp, 'w') as f:
+        f.write(name)
+    os.replace(current_tmp, os.path.join(folder_dir, 'current'))
+
+    for entry in os.listdir(folder_dir):
+        if entry != name and not entry.startswith('.') and entry != 'current':
+            shutil.rmtree(os.path.join(folder_dir, entry), ignore_errors=True)
+
+
+def unpublish(folder_key):
+    """Remove a folder's published revisions (the API evicted its snapshot)
+
+    current goes first, so workers starting now fall back to downloading
+    the catalog; workers that already mapped the revision keep reading it.
+    """
+    folder_dir = os.path.join(SHARED_DIR, folder_key)
+    try:
+        os.remove(os.path.join(folder_dir, 'current'))
+    except OSError:
+        pass
+    shutil.rmtree(folder_dir, ignore_errors=True)
+
+
+def attach(folder_key, revision=None):
+    """Attach the folder's current published revision (None if there isn't one,
+    or if it isn't the requested revision)"""
+    folder_dir = os.path.join(SHARED_DIR, folder_key)
+    try:
+        with open(os.path.join(folder_dir, 'current')) as f:
+            name = f.read().strip()
+        if revision is not None and name != revision_dir_name(revision):
+            return None
+        return SharedCatalog(os.path.join(folder_dir, name))
+    except (OSError, ValueError, KeyError):
+        # Missing, or removed by a newer publish between reading current and mapping
+        return None
+
+
+def _put_strings(arrays, name, values):
+    for part, array in _encode_strings(values).items():
+        arrays[f'{name}.{part}'] = array
+
+
+def _get_strings(arrays, name):
+    return _decode_strings(arrays[f'{name}.data'], arrays[f'{name}.offsets'], arrays[f'{name}.valid'])
+
+
+def _put_postings(arrays, name, lists, dtype=np.int64):
+    """A list of int sequences as one concatenated array plus offsets"""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(rows) for rows in lists], out=offsets[1:])
+    arrays[f'{name}.rows'] = np.concatenate([np.asarray(rows, dtype=dtype) for rows in lists]) if lists else \
+        np.array([], dtype=dtype)
+    arrays[f'{name}.offsets'] = offsets
+
+
+def _get_postings(arrays, name):
+    rows, bounds = arrays[f'{name}.rows'], arrays[f'{name}.offsets'].tolist()
+    return [rows[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def pack_snapshot(snapshot):
+    """A snapshot's catalog, search index, typeahead and change summary as .npz bytes"""
+    df = snapshot['df']
+    columns = list(df.columns)
+    unknown = [c for c in columns if c not in STRING_COLUMNS and c not in PRICE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Can't pack catalog columns: {', '.join(unknown)}")
+
+    arrays = {}
+    for column in columns:
+        if column in STRING_COLUMNS:
+            _put_strings(arrays, f'df.{column}', df[column].tolist())
+        else:
+            arrays[f'df.{column}'] = df[column].to_numpy(dtype='float64')
+
+    index = snapshot['index']
+    for field, field_index in index['text'].items():
+        tokens = list(field_index['tokens'])
+        _put_strings(arrays, f'index.{field}.normalized', list(field_index['normalized']))
+        _put_strings(arrays, f'index.{field}.tokens', tokens)
+        _put_postings(arrays, f'index.{field}.postings', [field_index['postings'][t] for t in tokens])
+    for field, field_index in index['range'].items():
+        arrays[f'index.{field}.values'] = field_index['values']
+        arrays[f'index.{field}.rows'] = field_index['rows']
+
+    typeahead = snapshot['typeahead']
+    _put_strings(arrays, 'typeahead.keys', typeahead['keys'])
+    _put_strings(arrays, 'typeahead.names', [display for display, _ in typeahead['names']])
+    _put_strings(arrays, 'typeahead.fields', [field for _, field in typeahead['names']])
+    # Positions and row counts all fit in 32 bits; the sparse table is most of the payload
+    for name in ('name_ids', 'counts', 'name_counts'):
+        arrays[f'typeahead.{name}'] = np.asarray(typeahead[name], dtype=np.int32)
+    _put_postings(arrays, 'typeahead.table', typeahead['table'], dtype=np.int32)
+
+    manifest = {'columns': columns, 'size': index['size'], 'changes': snapshot['changes']}
+    arrays['manifest'] = np.frombuffer(json.dumps(manifest).encode('utf-8'), dtype=np.uint8)
+
+    fh = io.BytesIO()
+    np.savez(fh, **arrays)
+    return fh.getvalue()
+
+
+def unpack_snapshot(data):
+    """Inverse of pack_snapshot: {'df', 'index', 'typeahead', 'changes'} (ValueError if malformed)"""
+    if not data.startswith(b'PK'):
+        raise ValueError("Malformed catalog snapshot: not an .npz archive")
+    try:
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            arrays = {name: npz[name] for name in npz.files}
+        manifest = json.loads(arrays['manifest'].tobytes())
+
+        df = pd.DataFrame({
+            column: pd.array(_get_strings(arrays, f'df.{column}'), dtype='string') if column in STRING_COLUMNS
+            else arrays[f'df.{column}']
+            for column in manifest['columns']
+        })
+
+        index = {'size': manifest['size'], 'text': {}, 'range': {}}
+        for field in TEXT_FIELDS:
+            tokens = _get_strings(arrays, f'index.{field}.tokens')
+            index['text'][field] = {
+                'normalized': np.array(_get_strings(arrays, f'index.{field}.normalized'), dtype=object),
+                'tokens': tokens,
+                'postings': dict(zip(tokens, _get_postings(arrays, f'index.{field}.postings')))
+            }
+        for field in RANGE_FIELDS:
+            index['range'][field] = {'values': arrays[f'index.{field}.values'], 'rows': arrays[f'index.{field}.rows']}
+
+        typeahead = {
+            'keys': _get_strings(arrays, 'typeahead.keys'),
+            'name_ids': arrays['typeahead.name_ids'].tolist(),
+            'counts': arrays['typeahead.counts'].tolist(),
+            'table': [level.tolist() for level in _get_postings(arrays, 'typeahead.table')],
+            'names': list(zip(_get_strings(arrays, 'typeahead.names'), _get_strings(arrays, 'typeahead.fields'))),
+            'name_counts': arrays['typeahead.name_counts'].tolist()
+        }
+    except (OSError, KeyError, EOFError, zipfile.BadZipFile, UnicodeDecodeError, json.JSONDecodeError, ValueError) as e:
+        raise ValueError(f"Malformed catalog snapshot: {e}") from None
+    return {'df': df, 'index': index, 'typeahead': typeahead, 'changes': manifest['changes']}
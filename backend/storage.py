@@ -0,0 +1,314 @@
+"""Where catalogs and templates are read from and generated documents go
+
+The pipeline talks to a Storage: find a folder, find the files a
+generation needs, read them, and write the results back. Two backends:
+
+    STORAGE_BACKEND=drive    Google Drive (drive.py: batched lookups,
+                             retries, the export cache)
+    STORAGE_BACKEND=local    a directory tree under LOCAL_STORAGE_ROOT, one
+                             subdirectory per configured folder name (or
+                             an absolute path), e.g. a mounted network share
+
+Both return Drive-shaped file info dicts ('id', 'name', 'mimeType',
+'modifiedTime', 'version', plus 'md5Checksum' for versions), so catalog
+revisions, shared snapshots and same-day version reuse work the same way
+on either. Locally a file's id is its path, and its revision is its mtime.
+Local reads are memory-mapped (MappedFile), and writes land under a
+temporary name and are renamed into place, so a reader never sees a
+half-written document or catalog.
+"""
+
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+from drive import (authenticate, thread_service, find_folder, get_file, find_catalog, fetch_file, download_files,
+                   upload_document, batch_list, first, file_query, catalog_query, catalog_file, versions_query,
+                   XLSX_MIME, DOCX_MIME, CSV_MIME)
+
+BACKEND = os.getenv('STORAGE_BACKEND', 'drive')
+# Absolute, so the API and the generation scripts (in GENERATE_CWD) see the same paths and file ids
+LOCAL_ROOT = os.path.abspath(os.getenv('LOCAL_STORAGE_ROOT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'storage')))
+
+MIME_TYPES = {'.xlsx': XLSX_MIME, '.docx': DOCX_MIME, '.csv': CSV_MIME}
+
+
+class MappedFile(io.RawIOBase):
+    """Read-only file object over a memory-mapped file
+
+    Readers (zipfile, calamine, pyarrow) pull bytes straight from the page
+    cache instead of a private copy of the whole file. The mapping holds a
+    file descriptor until close(); use it as a context manager (IOBase's
+    __enter__/__exit__ call close()).
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        end = len(self._map) if size is None or size < 0 else min(len(self._map), self._position + size)
+        data = self._map[self._position:end]
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._map)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def getvalue(self):
+        """The whole file as bytes (like BytesIO.getvalue)"""
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+        return self._map[:]
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap) and not self._map.closed:
+            self._map.close()
+        super().close()
+
+
+class Storage:
+    """Interface of a storage backend (folder ids and file infos are backend-specific)"""
+
+    label = None  # for progress messages
+
+    def find_folder(self, folder_name):
+        """Id of a configured folder, or None"""
+        raise NotImplementedError
+
+    def get_file(self, folder_id, file_name):
+        """First file in the folder whose name contains file_name, or None"""
+        raise NotImplementedError
+
+    def find_catalog(self, folder_id, folder):
+        """The folder's current catalog file, or None"""
+        raise NotImplementedError
+
+    def find_generation_files(self, folder_id, folder, today):
+        """Everything one generation looks up: {'tasting_template', 'price_template'
+        (when configured), 'catalog': file info or None, 'tasting_versions',
+        'price_versions': today's documents with md5Checksum}"""
+        raise NotImplementedError
+
+    def read(self, file_info):
+        """File contents as a seekable binary file object (close it when done)"""
+        raise NotImplementedError
+
+    def read_many(self, files):
+        """({name: file object}, {name: seconds}) for {name: file info}; the caller closes them"""
+        handles, timings = {}, {}
+        try:
+            for name, file_info in files.items():
+                start = time.perf_counter()
+                handles[name] = self.read(file_info)
+                timings[name] = time.perf_counter() - start
+        except BaseException:
+            for handle in handles.values():
+                handle.close()
+            raise
+        return handles, timings
+
+    def write(self, folder_id, path):
+        """Store a local file in the folder under its own name; returns its id"""
+        raise NotImplementedError
+
+
+class DriveStorage(Storage):
+    """Google Drive through one authenticated service"""
+
+    label = 'Google Drive'
+
+    def __init__(self, service):
+        self.service = service
+
+    def find_folder(self, folder_name):
+        return find_folder(self.service, folder_name)
+
+    def get_file(self, folder_id, file_name):
+        return get_file(self.service, folder_id, file_name)
+
+    def find_catalog(self, folder_id, folder):
+        return find_catalog(self.service, folder_id, folder)
+
+    def find_generation_files(self, folder_id, folder, today):
+        # Every lookup is independent: one batch round trip
+        lookups = {
+            'tasting_template': file_query(folder_id, folder['tasting_template']),
+            'catalog': catalog_query(folder_id, folder),
+            'tasting_versions': versions_query(folder_id, 'Tasting_Sheet', today),
+            'price_versions': versions_query(folder_id, 'Price_List', today)
+        }
+        if folder.get('price_template'):
+            lookups['price_template'] = file_query(folder_id, folder['price_template'])
+        found = batch_list(self.service, lookups)
+
+        files = {
+            'tasting_template': first(found['tasting_template']),
+            'catalog': catalog_file(first(found['catalog']), folder),
+            'tasting_versions': found['tasting_versions'],
+            'price_versions': found['price_versions']
+        }
+        if 'price_template' in found:
+            files['price_template'] = first(found['price_template'])
+        return files
+
+    def read(self, file_info):
+        return fetch_file(self.service, file_info)
+
+    def read_many(self, files):
+        # Concurrent downloads: one download's latency, not the sum
+        return download_files(self.service, files)
+
+    def write(self, folder_id, path):
+        return upload_document(self.service, folder_id, path)
+
+
+class LocalStorage(Storage):
+    """Folders as directories under a root (a local disk or a mounted share)"""
+
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root) if root else LOCAL_ROOT
+        self.label = f"local storage ({self.root})"
+
+    def find_folder(self, folder_name):
+        path = os.path.join(self.root, folder_name)  # an absolute folder name is used as is
+        return path if os.path.isdir(path) else None
+
+    def _file_info(self, path):
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        return {
+            'id': path,
+            'name': name,
+            'mimeType': MIME_TYPES.get(os.path.splitext(name)[1].lower(), 'application/octet-stream'),
+            'modifiedTime': datetime.fromtimestamp(stat.st_mtime, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'version': str(stat.st_mtime_ns)
+        }
+
+    def _files(self, folder_id):
+        """File infos in a folder, by name (temporary and hidden files skipped)"""
+        try:
+            names = sorted(os.listdir(folder_id))
+        except FileNotFoundError:
+            return []
+        files = []
+        for name in names:
+            path = os.path.join(folder_id, name)
+            if name.startswith('.') or not os.path.isfile(path):
+                continue
+            try:
+                files.append(self._file_info(path))
+            except FileNotFoundError:
+                continue  # replaced or removed since the listing
+        return files
+
+    def _latest(self, files):
+        return max(files, key=lambda f: f['modifiedTime'], default=None)
+
+    def get_file(self, folder_id, file_name):
+        # Same rule as the Drive lookup, in name order
+        return first([f for f in self._files(folder_id) if file_name in f['name']])
+
+    def find_catalog(self, folder_id, folder):
+        files = self._files(folder_id)
+        if folder.get('catalog_name'):
+            files = [f for f in files if folder['catalog_name'] in f['name']]
+        # A folder that keeps its catalog as a Google Sheet has it exported as CSV here
+        mime_type = CSV_MIME if folder.get('catalog_format') == 'sheet' else XLSX_MIME
+        if folder.get('catalog_format') == 'sheet' or not folder.get('catalog_name'):
+            files = [f for f in files if f['mimeType'] == mime_type]
+        return self._latest(files)
+
+    def versions(self, folder_id, base_name, day):
+        """Generated files with base_name from one day, with checksums"""
+        versions = []
+        for file_info in self._files(folder_id):
+            if day in file_info['name'] and base_name in file_info['name']:
+                with MappedFile(file_info['id']) as f:
+                    file_info['md5Checksum'] = hashlib.md5(f.getvalue()).hexdigest()
+                versions.append(file_info)
+        return versions
+
+    def find_generation_files(self, folder_id, folder, today):
+        files = {
+            'tasting_template': self.get_file(folder_id, folder['tasting_template']),
+            'catalog': self.find_catalog(folder_id, folder),
+            'tasting_versions': self.versions(folder_id, 'Tasting_Sheet', today),
+            'price_versions': self.versions(folder_id, 'Price_List', today)
+        }
+        if folder.get('price_template'):
+            files['price_template'] = self.get_file(folder_id, folder['price_template'])
+        return files
+
+    def read(self, file_info):
+        return MappedFile(file_info['id'])
+
+    def write(self, folder_id, path):
+        target = os.path.join(folder_id, os.path.basename(path))
+        tmp_path = os.path.join(folder_id, f".{os.path.basename(path)}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            # Data on disk before the rename, and the rename on disk before returning:
+            # after a crash the document is either the old one or the whole new one
+            with open(path, 'rb') as source, open(tmp_path, 'wb') as copy:
+                shutil.copyfileobj(source, copy)
+                copy.flush()
+                os.fsync(copy.fileno())
+            os.replace(tmp_path, target)
+            _fsync_directory(folder_id)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return target
+
+
+def _fsync_directory(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _is_local():
+    if BACKEND not in ('drive', 'local'):
+        raise ValueError(f"Unknown STORAGE_BACKEND '{BACKEND}' (expected 'drive' or 'local')")
+    return BACKEND == 'local'
+
+
+def open_storage():
+    """The configured storage backend (authenticates with Drive when that's the backend)"""
+    return LocalStorage() if _is_local() else DriveStorage(authenticate())
+
+
+def thread_storage():
+    """The configured storage backend for the current thread (see drive.thread_service)"""
+    return LocalStorage() if _is_local() else DriveStorage(thread_service())
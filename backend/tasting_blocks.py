@@ -0,0 +1,125 @@
+"""Tasting sheet wine blocks: placeholder replacement, template splitting, block rendering
+
+Shared by the single-process renderer (generate_selected_wines) and the
+sharded one (sharded_render), so both produce the same blocks.
+"""
+
+import logging
+
+from docx.oxml import parse_xml
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+def tasting_replacements(wine):
+    """Map tasting sheet placeholders to a wine's precomputed display strings"""
+    lq = chr(8220)
+    rq = chr(8221)
+
+    return {
+        f'{lq}PRODUCER{rq}': wine['producer'],
+        f'{lq}REGION_APPELLATION{rq}': wine['region'],
+        f'{lq}CUVEE_NAME{rq}': wine['cuvee'],
+        f'{lq}VINTAGE{rq}': wine['vintage'],
+        f'{lq}BLEND_DETAILS{rq}': wine['blend'],
+        f'{lq}PACKAGING{rq}': wine['packaging'],
+        f'{lq}STANDARD_PRICE{rq}': wine['standard_price'],
+        # Drops the comma, placeholder and ** marker when there is no discount
+        f', {lq}DISCOUNTED_PRICE{rq}**': wine['discount_marker']
+    }
+
+def replace_placeholders(text, replacements, wine, wine_num):
+    """Replace quoted placeholders with actual data"""
+    original_text = text
+
+    for placeholder, value in replacements.items():
+        if placeholder in text:
+            text = text.replace(placeholder, value)
+
+    if chr(8220) + 'PRODUCER' in original_text:
+        logger.info(f"\n--- Wine #{wine_num}: {wine['producer']} ---")
+        logger.info(f"  Before: {original_text}")
+        logger.info(f"  After:  {text}")
+
+    return text
+
+def copy_paragraph_with_formatting(template_para, doc, wine, wine_num, replacements=None):
+    """Copy paragraph preserving all formatting and replace placeholders"""
+    if replacements is None:
+        replacements = tasting_replacements(wine)
+
+    new_para = doc.add_paragraph()
+    new_para.style = template_para.style
+    new_para.paragraph_format.alignment = template_para.paragraph_format.alignment
+
+    for run in template_para.runs:
+        new_run = new_para.add_run()
+        new_run.text = replace_placeholders(run.text, replacements, wine, wine_num)
+
+        new_run.bold = run.bold
+        new_run.italic = run.italic
+        new_run.underline = run.underline
+        new_run.font.name = run.font.name
+        new_run.font.size = run.font.size
+        new_run.font.color.rgb = run.font.color.rgb
+
+    return new_para
+
+def split_template(doc):
+    """Pull the wine block and footer paragraphs out of the template, leaving only the header"""
+    # Get template paragraphs (handle templates with different lengths)
+    if len(doc.paragraphs) < 5:
+        wine_template_paras = doc.paragraphs[1:min(5, len(doc.paragraphs))]
+    else:
+        wine_template_paras = [doc.paragraphs[i] for i in range(1, 5)]
+
+    footer_idx = min(14, len(doc.paragraphs) - 1) if len(doc.paragraphs) > 14 else len(doc.paragraphs) - 1
+    footer_para_template = doc.paragraphs[footer_idx] if len(doc.paragraphs) > 0 else None
+
+    # Delete placeholder content
+    for i in range(len(doc.paragraphs) - 1, 0, -1):
+        p = doc.paragraphs[i]
+        p._element.getparent().remove(p._element)
+
+    return wine_template_paras, footer_para_template
+
+def append_fragments(doc, fragments):
+    """Insert serialized body elements at the end of the body (before sectPr)"""
+    body = doc.element.body
+    # Look sectPr up once; python-docx's own insert rescans the body on every call
+    sect_pr = body.sectPr
+    for fragment in fragments:
+        element = parse_xml(fragment)
+        if sect_pr is not None:
+            sect_pr.addprevious(element)
+        else:
+            body.append(element)
+
+def render_wine_blocks(doc, wine_template_paras, wines, first_wine_num=1, cache=None):
+    """Append one formatted block (plus two blank lines) per wine
+
+    With a render cache, blocks already rendered for this template and
+    these display strings are inserted from their cached XML; new ones are
+    rendered and stored.
+    """
+    body = doc.element.body
+    trailing = 1 if body.sectPr is not None else 0
+
+    for wine_num, wine in enumerate(wines, first_wine_num):
+        replacements = tasting_replacements(wine)
+        if cache is not None:
+            fragments = cache.get(replacements.values())
+            if fragments is not None:
+                append_fragments(doc, fragments)
+                continue
+        start = len(body) - trailing
+
+        for template_para in wine_template_paras:
+            copy_paragraph_with_formatting(template_para, doc, wine, wine_num, replacements)
+
+        doc.add_paragraph()
+        doc.add_paragraph()
+
+        if cache is not None:
+            cache.put(replacements.values(),
+                      [etree.tostring(element) for element in body[start:len(body) - trailing]])
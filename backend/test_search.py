@@ -0,0 +1,180 @@
+"""Query grammar and incremental search index checks
+
+Run with: python -m pytest test_search.py
+"""
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from catalog import normalize_catalog
+from catalog_diff import diff_catalogs, update_search_index
+from search import parse_query, run_query
+from search_index import build_search_index
+
+REGIONS = ['Rioja', 'Jura', 'Etna', 'Mosel', 'Cotes du Rhone']
+
+
+def catalog(rows):
+    """A small raw catalog (before normalize_catalog) from (producer, cuvee, vintage, region, price) tuples"""
+    return pd.DataFrame({
+        'PRODUCER': [r[0] for r in rows],
+        'CUVEE_NAME': [r[1] for r in rows],
+        'VINTAGE': [r[2] for r in rows],
+        'REGION_APPELLATION': [r[3] for r in rows],
+        'BLEND_DETAILS': ['Tempranillo'] * len(rows),
+        'PACKAGING': ['12x750ml'] * len(rows),
+        'STANDARD_PRICE': [r[4] for r in rows],
+        'DISCOUNT_PRICE': [None] * len(rows),
+    })
+
+
+@pytest.fixture(scope='module')
+def index():
+    df = normalize_catalog(catalog([
+        ('Scopa', 'Realce', 2018, 'Rioja', 24),
+        ('Domaine de la Pepiere', 'Clos des Briords', 2020, 'Muscadet', 32),
+        ('Producer 12', 'Cuvee A', 2015, 'Jura', 18),
+        ('Producer 120', 'Cuvee B', 'NV', 'Jura', 40),
+        ('Tenuta', 'Etna Rosso', 2021, 'Etna', 55),
+    ]))
+    return build_search_index(df)
+
+
+def rows(index, query):
+    return [sorted(int(r) for r in result['rows']) for result in run_query(index, parse_query(query))]
+
+
+# Grammar
+
+def test_bare_words_are_prefix_terms():
+    parsed = parse_query('the scopa')
+    assert parsed['terms'] == [{'text': 'scopa', 'field': None, 'prefix': True, 'label': 'scopa'}]
+
+
+def test_legacy_quantifiers_are_dropped():
+    assert [t['text'] for t in parse_query('both scopa all realce')['terms']] == ['scopa', 'realce']
+
+
+def test_quoted_phrase_is_one_exact_term():
+    parsed = parse_query('"Domaine de la Pepiere"')
+    assert parsed['terms'] == [{'text': 'Domaine de la Pepiere', 'field': None, 'prefix': False,
+                                'label': '"Domaine de la Pepiere"'}]
+
+
+def test_field_terms_and_region_filters():
+    parsed = parse_query('producer:"Scopa" cuvee:Realce region:"Rioja" appellation:Jura')
+    assert [(t['field'], t['text']) for t in parsed['terms']] == [('producer', 'Scopa'), ('cuvee', 'Realce')]
+    assert parsed['regions'] == ['Rioja', 'Jura']
+
+
+def test_unknown_field_is_a_word():
+    assert [t['text'] for t in parse_query('colour:red')['terms']] == ['colour:red']
+
+
+@pytest.mark.parametrize('query, low, high, low_inclusive, high_inclusive', [
+    ('vintage:2018..2021', 2018, 2021, True, True),
+    ('vintage:2018..', 2018, None, True, True),
+    ('vintage:..2019', None, 2019, True, True),
+    ('vintage:2018', 2018, 2018, True, True),
+    ('year<2020', None, 2020, True, False),
+    ('price<40', None, 40, True, False),
+    ('price<=40', None, 40, True, True),
+    ('price>40', 40, None, False, True),
+    ('price>=40', 40, None, True, True),
+    ('price >= $40', 40, None, True, True),
+    ('price:20..40', 20, 40, True, True),
+    ('price=25', 25, 25, True, True),
+])
+def test_range_filters(query, low, high, low_inclusive, high_inclusive):
+    (r,) = parse_query(query)['ranges']
+    assert (r['low'], r['high'], r['low_inclusive'], r['high_inclusive']) == (low, high, low_inclusive, high_inclusive)
+
+
+@pytest.mark.parametrize('query', ['price:', 'vintage:', 'price>=', 'price <=', 'price:""', 'price:..', 'scopa price:'])
+def test_range_without_value_is_an_error(query):
+    with pytest.raises(ValueError, match='Missing value for'):
+        parse_query(query)
+
+
+@pytest.mark.parametrize('query, message', [
+    ('price:abc', "Invalid price value: 'abc'"),
+    ('producer<scopa', "'<' only works with vintage and price"),
+])
+def test_malformed_filters(query, message):
+    with pytest.raises(ValueError, match=message):
+        parse_query(query)
+
+
+def test_empty_text_field_is_ignored():
+    assert parse_query('producer: scopa')['terms'][0]['text'] == 'scopa'
+    assert parse_query('producer:""') == {'terms': [], 'regions': [], 'ranges': []}
+
+
+# Matching
+
+def test_bare_word_matches_a_prefix(index):
+    assert rows(index, 'pep') == [[1]]
+
+
+def test_quoted_and_field_terms_match_whole_words(index):
+    assert rows(index, '"producer 12"') == [[2]]
+    assert rows(index, 'producer:"producer 12"') == [[2]]
+    assert rows(index, 'producer 12') == [[2, 3], [2, 3]]
+
+
+def test_filters_narrow_terms(index):
+    assert rows(index, 'producer price<30') == [[2]]
+    assert rows(index, 'region:jura vintage:2010..2016') == [[2]]
+    assert rows(index, 'vintage:2018..') == [[0, 1, 4]]
+
+
+# Incremental index
+
+def random_revision(rng, raw, serial):
+    """Remove, add, reprice, re-region and shuffle some rows of a raw catalog"""
+    df = raw.drop(index=rng.sample(list(raw.index), k=rng.randrange(len(raw) // 5 + 1)))
+    for column, choices in [('STANDARD_PRICE', [12, 19.5, 24, 40, None]), ('REGION_APPELLATION', REGIONS)]:
+        changed = rng.sample(list(df.index), k=rng.randrange(len(df) // 4 + 1))
+        df.loc[changed, column] = [rng.choice(choices) for _ in changed]
+    added = catalog([
+        (f"Producer {rng.randrange(40)}", f"Cuvee {serial}-{i}", rng.choice([2016, 2019, 'NV', None]),
+         rng.choice(REGIONS), rng.choice([15, 28, '$36']))
+        for i in range(rng.randrange(10))
+    ])
+    df = pd.concat([df, added], ignore_index=True)
+    return df.sample(frac=1, random_state=rng.randrange(2 ** 32)).reset_index(drop=True)
+
+
+def assert_same_index(updated, built):
+    assert updated['size'] == built['size']
+    for field, expected in built['text'].items():
+        actual = updated['text'][field]
+        assert list(actual['tokens']) == expected['tokens']
+        assert list(actual['normalized']) == list(expected['normalized'])
+        for token, postings in expected['postings'].items():
+            assert np.array_equal(actual['postings'][token], postings), (field, token)
+    for field, expected in built['range'].items():
+        assert np.array_equal(updated['range'][field]['values'], expected['values'])
+        assert np.array_equal(updated['range'][field]['rows'], expected['rows'])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_update_search_index_matches_a_fresh_build(seed):
+    rng = random.Random(seed)
+    raw = catalog([
+        (f"Producer {rng.randrange(40)}", f"Cuvee {i}", rng.choice([2015, 2018, 'NV', None]),
+         rng.choice(REGIONS), rng.choice([18, 24.5, '$32', 40]))
+        for i in range(200)
+    ])
+    old = normalize_catalog(raw.copy())
+    index = build_search_index(old)
+
+    for serial in range(3):
+        raw = random_revision(rng, raw, serial)
+        new = normalize_catalog(raw.copy())
+        index = update_search_index(index, diff_catalogs(old, new), new)
+        assert_same_index(index, build_search_index(new))
+        old = new
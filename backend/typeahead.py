@@ -0,0 +1,109 @@
+"""Typeahead completions for producer and cuvee names
+
+Names are normalized (case-folded, accents stripped) and stored in one
+sorted array, once for the full name and once for every later word
+(so 'pepiere' finds 'Domaine de la Pépière'). A prefix maps to a
+contiguous slice found by binary search; a sparse table of range maxima
+over row counts pulls the top-k out of that slice without scanning it.
+"""
+
+import heapq
+import unicodedata
+from bisect import bisect_left
+
+FIELDS = {'PRODUCER': 'producer', 'CUVEE_NAME': 'cuvee'}
+
+
+def normalize_name(value):
+    """Case-fold, strip accents and collapse whitespace"""
+    decomposed = unicodedata.normalize('NFKD', str(value).casefold())
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(stripped.split())
+
+
+def _build_sparse_table(counts):
+    """table[j][i] = index of the max count in counts[i:i + 2**j]"""
+    table = [list(range(len(counts)))]
+    width = 1
+    while width * 2 <= len(counts):
+        previous = table[-1]
+        level = []
+        for i in range(len(counts) - width * 2 + 1):
+            left, right = previous[i], previous[i + width]
+            level.append(left if counts[left] >= counts[right] else right)
+        table.append(level)
+        width *= 2
+    return table
+
+
+def build_typeahead(df):
+    """Build the completion index for one catalog revision"""
+    names = []   # (display name, field)
+    counts = []  # rows per name
+    for column, field in FIELDS.items():
+        for display, count in df[column].dropna().value_counts().items():
+            if str(display).strip():
+                names.append((str(display).strip(), field))
+                counts.append(int(count))
+
+    entries = []
+    for name_id, (display, _) in enumerate(names):
+        words = normalize_name(display).split(' ')
+        for start in range(len(words)):
+            entries.append((' '.join(words[start:]), name_id))
+    entries.sort()
+
+    entry_counts = [counts[name_id] for _, name_id in entries]
+    return {
+        'keys': [key for key, _ in entries],
+        'name_ids': [name_id for _, name_id in entries],
+        'counts': entry_counts,
+        'table': _build_sparse_table(entry_counts),
+        'names': names,
+        'name_counts': counts
+    }
+
+
+def _range_max(index, lo, hi):
+    """Index of the max count in [lo, hi)"""
+    table, counts = index['table'], index['counts']
+    level = (hi - lo).bit_length() - 1
+    left, right = table[level][lo], table[level][hi - (1 << level)]
+    return left if counts[left] >= counts[right] else right
+
+
+def complete(index, prefix, k=10):
+    """Top-k names (by row count) with a word starting with prefix"""
+    prefix = normalize_name(prefix)
+    if not prefix or not index['keys']:
+        return []
+
+    lo = bisect_left(index['keys'], prefix)
+    hi = bisect_left(index['keys'], prefix + '\uffff')
+
+    # Best-first over sub-ranges: pop the range holding the largest count,
+    # emit it, then push the two halves around it
+    heap = []
+    if lo < hi:
+        best = _range_max(index, lo, hi)
+        heap.append((-index['counts'][best], best, lo, hi))
+
+    seen = set()
+    completions = []
+    while heap and len(completions) < k:
+        _, best, lo, hi = heapq.heappop(heap)
+        name_id = index['name_ids'][best]
+        if name_id not in seen:
+            seen.add(name_id)
+            display, field = index['names'][name_id]
+            completions.append({
+                'value': display,
+                'field': field,
+                'count': index['name_counts'][name_id]
+            })
+        for sub_lo, sub_hi in ((lo, best), (best + 1, hi)):
+            if sub_lo < sub_hi:
+                sub_best = _range_max(index, sub_lo, sub_hi)
+                heapq.heappush(heap, (-index['counts'][sub_best], sub_best, sub_lo, sub_hi))
+
+    return completions
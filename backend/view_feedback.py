@@ -1,30 +1,20 @@
 """View user feedback"""
 
-import json
-import os
-
-FEEDBACK_FILE = 'feedback_log.json'
+from feedback_logger import iter_feedback
 
 def view_feedback():
-    """Display all user feedback"""
-    if not os.path.exists(FEEDBACK_FILE):
-        print("No feedback found yet.")
-        return
-
-    with open(FEEDBACK_FILE, 'r') as f:
-        data = json.load(f)
-
-    feedback_list = data.get('feedback', [])
+    """Display all user feedback (streamed from every retained log segment)"""
+    total = sum(1 for _ in iter_feedback())
 
-    if not feedback_list:
+    if not total:
         print("No feedback submitted yet.")
         return
 
     print(f"\n{'='*80}")
-    print(f"USER FEEDBACK - {len(feedback_list)} total submissions")
+    print(f"USER FEEDBACK - {total} total submissions")
     print(f"{'='*80}\n")
 
-    for entry in feedback_list:
+    for entry in iter_feedback():
         print(f"Feedback #{entry['id']}")
         print(f"Submitted: {entry['timestamp']}")
 
@@ -1,32 +1,24 @@
 """View session logs"""
 
-import json
-import os
-from datetime import datetime
-
-LOG_FILE = 'session_log.json'
+from session_logger import iter_sessions
 
 def view_logs():
-    """Display all logged sessions"""
-    if not os.path.exists(LOG_FILE):
-        print("No logs found yet.")
-        return
-
-    with open(LOG_FILE, 'r') as f:
-        log = json.load(f)
-
-    sessions = log.get('sessions', [])
+    """Display all logged sessions (streamed from every retained log segment)"""
+    total = sum(1 for _ in iter_sessions())
 
-    if not sessions:
+    if not total:
         print("No sessions logged yet.")
         return
 
     print(f"\n{'='*80}")
-    print(f"SESSION LOG - {len(sessions)} total sessions")
+    print(f"SESSION LOG - {total} total sessions")
     print(f"{'='*80}\n")
 
-    for session in sessions:
-        status = "✓ SUCCESS" if session.get('success') else "✗ FAILED"
+    for session in iter_sessions():
+        if session.get('cancelled'):
+            status = "⊘ CANCELLED"
+        else:
+            status = "✓ SUCCESS" if session.get('success') else "✗ FAILED"
         print(f"Session #{session['id']} - {status}")
         print(f"Query: {session['query']}")
         print(f"Started: {session['timestamp']}")
@@ -32,6 +32,7 @@ rsync -avz -e "ssh -i $SSH_KEY" \
     --exclude '*.pyc' \
     --exclude 'session_log.json' \
     --exclude 'feedback_log.json' \
+    --exclude 'logs' \
     ${PROJECT_ROOT}/backend/ \
     ${EC2_USER}@${EC2_HOST}:${REMOTE_DIR}/backend/
 
@@ -54,6 +55,13 @@ scp -i "$SSH_KEY" \
 echo "🔨 Rebuilding containers on EC2..."
 ssh -i "$SSH_KEY" ${EC2_USER}@${EC2_HOST} << 'EOF'
     cd ~/fantasma
+    # One-time move of the old single-file logs into the mounted logs directory
+    mkdir -p backend/logs
+    for log in session_log.json feedback_log.json; do
+        if [ -f "backend/$log" ] && [ ! -e "backend/logs/$log" ]; then
+            mv "backend/$log" backend/logs/
+        fi
+    done
     docker compose build
     docker compose up -d
     echo "✅ Deployment complete!"